@@ -0,0 +1,19 @@
+/*
+ * Adds the indexes of the Ticket, TicketEvent and QueueLoginEvent hot
+ * queries to an existing database (new ones get them from autograder.sql).
+ * CONCURRENTLY keeps the tables writable while the indexes build, so this
+ * can run against a live queue, but it cannot run inside a transaction:
+ *
+ *   docker exec -i autograder_db psql -U postgres < data/migrations/001_hot_path_indexes.sql
+ *
+ * Safe to run more than once.
+ */
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_ticket_queue_status_created" ON "Ticket" USING btree ("queue_id", "status", "created_at");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_ticket_queue_student_status" ON "Ticket" USING btree ("queue_id", "ec_student_id", "status");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_ticket_queue_grader_status" ON "Ticket" USING btree ("queue_id", "ec_grader_id", "status");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_ticketevent_ticket_timestamp" ON "TicketEvent" USING btree ("ticket_id", "timestamp");
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_queueloginevent_queue_grader_timestamp" ON "QueueLoginEvent" USING btree ("queue_id", "grader_id", "timestamp");
+
+ANALYZE "Ticket";
+ANALYZE "TicketEvent";
+ANALYZE "QueueLoginEvent";
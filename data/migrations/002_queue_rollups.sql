@@ -0,0 +1,51 @@
+/*
+ * Adds the hourly and daily rollup tables of the queue analytics to an
+ * existing database (new ones get them from autograder.sql). Fill them
+ * from the existing tickets afterwards, preferably while the queues are
+ * closed:
+ *
+ *   docker exec -i autograder_db psql -U postgres < data/migrations/002_queue_rollups.sql
+ *   python runner.py backfill_rollups
+ *
+ * Safe to run more than once.
+ */
+CREATE TABLE IF NOT EXISTS "QueueHourlyRollup" (
+	"queue_id" integer NOT NULL,
+	"bucket_start" TIMESTAMP NOT NULL,
+	"created" integer NOT NULL DEFAULT 0,
+	"accepted" integer NOT NULL DEFAULT 0,
+	"resolved" integer NOT NULL DEFAULT 0,
+	"canceled" integer NOT NULL DEFAULT 0,
+	"wait_seconds" double precision NOT NULL DEFAULT 0,
+	"help_seconds" double precision NOT NULL DEFAULT 0,
+	"rating_bad" integer NOT NULL DEFAULT 0,
+	"rating_neutral" integer NOT NULL DEFAULT 0,
+	"rating_good" integer NOT NULL DEFAULT 0,
+	CONSTRAINT "QueueHourlyRollup_pk" PRIMARY KEY ("queue_id", "bucket_start")
+) WITH (
+  OIDS=FALSE
+);
+
+
+
+CREATE TABLE IF NOT EXISTS "QueueDailyRollup" (
+	"queue_id" integer NOT NULL,
+	"bucket_start" TIMESTAMP NOT NULL,
+	"created" integer NOT NULL DEFAULT 0,
+	"accepted" integer NOT NULL DEFAULT 0,
+	"resolved" integer NOT NULL DEFAULT 0,
+	"canceled" integer NOT NULL DEFAULT 0,
+	"wait_seconds" double precision NOT NULL DEFAULT 0,
+	"help_seconds" double precision NOT NULL DEFAULT 0,
+	"rating_bad" integer NOT NULL DEFAULT 0,
+	"rating_neutral" integer NOT NULL DEFAULT 0,
+	"rating_good" integer NOT NULL DEFAULT 0,
+	CONSTRAINT "QueueDailyRollup_pk" PRIMARY KEY ("queue_id", "bucket_start")
+) WITH (
+  OIDS=FALSE
+);
+
+ALTER TABLE "QueueHourlyRollup" DROP CONSTRAINT IF EXISTS "QueueHourlyRollup_fk0";
+ALTER TABLE "QueueHourlyRollup" ADD CONSTRAINT "QueueHourlyRollup_fk0" FOREIGN KEY ("queue_id") REFERENCES "Queue"("id");
+ALTER TABLE "QueueDailyRollup" DROP CONSTRAINT IF EXISTS "QueueDailyRollup_fk0";
+ALTER TABLE "QueueDailyRollup" ADD CONSTRAINT "QueueDailyRollup_fk0" FOREIGN KEY ("queue_id") REFERENCES "Queue"("id");
@@ -0,0 +1,24 @@
+/*
+ * Adds the table tracking the seat assignment emails to an existing
+ * database (new ones get it from autograder.sql):
+ *
+ *   docker exec -i autograder_db psql -U postgres < data/migrations/003_email_jobs.sql
+ *
+ * Safe to run more than once.
+ */
+CREATE TABLE IF NOT EXISTS "EmailJobs" (
+	"id" serial NOT NULL,
+	"assignment_id" integer NOT NULL,
+	"status" integer NOT NULL DEFAULT 0,
+	"total" integer NOT NULL DEFAULT 0,
+	"sent" integer NOT NULL DEFAULT 0,
+	"failed" integer NOT NULL DEFAULT 0,
+	"created_at" TIMESTAMP NOT NULL,
+	"finished_at" TIMESTAMP,
+	CONSTRAINT "EmailJobs_pk" PRIMARY KEY ("id")
+) WITH (
+  OIDS=FALSE
+);
+
+ALTER TABLE "EmailJobs" DROP CONSTRAINT IF EXISTS "EmailJobs_fk0";
+ALTER TABLE "EmailJobs" ADD CONSTRAINT "EmailJobs_fk0" FOREIGN KEY ("assignment_id") REFERENCES "AssignedSeats"("id");
@@ -0,0 +1,14 @@
+/*
+ * Adds the partial indexes of the closed ticket history (keyset pages of
+ * find_ticket_history) to an existing database (new ones get them from
+ * autograder.sql). CONCURRENTLY keeps the Ticket table writable while the
+ * indexes build, but it cannot run inside a transaction:
+ *
+ *   docker exec -i autograder_db psql -U postgres < data/migrations/004_history_indexes.sql
+ *
+ * Safe to run more than once.
+ */
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_ticket_queue_closed" ON "Ticket" USING btree ("queue_id", "closed_at", "id") WHERE "closed_at" IS NOT NULL;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx_ticket_queue_grader_closed" ON "Ticket" USING btree ("queue_id", "ec_grader_id", "closed_at", "id") WHERE "closed_at" IS NOT NULL;
+
+ANALYZE "Ticket";
@@ -0,0 +1,18 @@
+import os
+
+# gunicorn -c gunicorn.conf.py, see "Running with gunicorn" in
+# docs/development.md for how these were picked.
+
+wsgi_app = 'project:app'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Requests are mostly Python, a worker process per core
+workers = int(os.getenv('GUNICORN_WORKERS', os.cpu_count() or 1))
+
+# A few threads cover the time spent waiting on the database. Each holds
+# at most one connection, so keep the pool (DB_POOL_SIZE) as big.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', os.getenv('DB_POOL_SIZE', 4)))
+
+# Import the app once, every worker disposes the pool it inherits
+preload_app = True
@@ -21,6 +21,9 @@ from .src.api.ticket_feedback import feedback_api_bp as tfapi
 from .src.api.tutor_stats import tutor_stats_api_bp as tsapi
 from .src.api.autograder.seating_layout import seating_layout_api_bp as saapi
 from .src.api.autograder.assigned_seats import assigned_seats_api_bp as asapi
+from .src.api.diagnostics import diagnostics_api_bp as dapi
+from .src.utils.mailer import MailDispatcher
+from .src.utils.query_profiler import QueryProfiler
 
 app.register_blueprint(uapi, url_prefix="/api/users")
 app.register_blueprint(tapi, url_prefix="/api/ticket")
@@ -35,6 +38,11 @@ app.register_blueprint(tfapi, url_prefix="/api/ticketfeedback")
 app.register_blueprint(tsapi, url_prefix="/api/tutorstats")
 app.register_blueprint(saapi, url_prefix="/api/seating_layout")
 app.register_blueprint(asapi, url_prefix="/api/assigned_seats")
+if app.config.get('QUERY_DIAGNOSTICS'):
+    app.register_blueprint(dapi, url_prefix="/api/diagnostics")
+
+MailDispatcher.get_instance().init_app(app)
+QueryProfiler.get_instance().init_app(app)
 
 # DO NOT EDIT BELOW THE LINE
 # ----------------------------------------------------------------
@@ -44,7 +52,7 @@ def load_user(user_id):
     '''
     Function used to be a default loader for flask login.
     '''
-    return User.get_user_by_id(user_id)
+    return User.load_user(user_id)
 
 
 login_manager.user_loader(load_user)
@@ -0,0 +1,198 @@
+'''
+Compare the wait times the dispatch policies of Queue.next_ticket give.\n
+Tickets arrive at their creation time and the graders take them with
+PendingTicketIndex.peek, one policy at a time, each ticket keeping the help
+time it took in real life. The history of a queue is replayed from its
+tickets and their ACCEPTED / RESOLVED TicketEvents, without a queue (or
+without history) a synthetic day is generated instead.\n
+Usage:\n
+    python -m project.benchmarks.dispatch_sim --queue_id 1
+    python -m project.benchmarks.dispatch_sim --tickets 2000 --graders 4
+'''
+import argparse
+import heapq
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from ..src.utils.dispatch_policy import PendingEntry
+from ..src.utils.pending_index import PendingTicketIndex
+from ..src.utils.wait_estimator import MAX_HELP_TIME, PRIOR_HELP_TIME
+
+# Rooms of the synthetic tickets.
+SYNTHETIC_ROOMS = ('B230', 'B240', 'B250', 'B260')
+
+
+class SimTicket(NamedTuple):
+    '''
+    A ticket of the simulation and how long helping it takes.
+    '''
+    entry: PendingEntry
+    help_time: timedelta
+
+
+def load_history(queue_id: int) -> List[SimTicket]:
+    '''
+    Replay the tickets of a queue which were helped. The help time of a
+    ticket is the time from its last ACCEPTED to its RESOLVED event.\n
+    '''
+    from .. import app
+    from ..src.models.ticket import Ticket
+    from ..src.models.events.ticket_event import TicketEvent, EventType
+
+    with app.app_context():
+        tickets = Ticket.query.filter_by(queue_id=queue_id).all()
+        events = TicketEvent.query.\
+            filter(TicketEvent.ticket_id.in_([t.id for t in tickets])).\
+            filter(TicketEvent.event_type.in_(
+                [EventType.ACCEPTED.value, EventType.RESOLVED.value])).\
+            order_by(TicketEvent.timestamp, TicketEvent.id).all()
+
+        accepted: Dict[int, datetime] = {}
+        help_times: Dict[int, timedelta] = {}
+        for evt in events:
+            if evt.event_type == EventType.ACCEPTED.value:
+                accepted[evt.ticket_id] = evt.timestamp
+            elif evt.ticket_id in accepted:
+                help_times[evt.ticket_id] = \
+                    evt.timestamp - accepted[evt.ticket_id]
+
+        cap = timedelta(seconds=MAX_HELP_TIME)
+        return [SimTicket(t.pending_entry(),
+                          min(max(help_times[t.id], timedelta()), cap))
+                for t in tickets if t.id in help_times]
+
+
+def synthetic_history(count: int, graders: int,
+                      seed: int) -> List[SimTicket]:
+    '''
+    Generate a busy queue: Poisson arrivals slightly faster than the
+    graders can keep up with, exponential help times, one in five tickets
+    a checkoff (which are quicker), and random tags and rooms.\n
+    '''
+    rng = random.Random(seed)
+    mean_help = PRIOR_HELP_TIME
+    mean_gap = mean_help / graders / 1.05
+    now = datetime(2020, 1, 1, 12)
+    tickets = []
+    for ticket_id in range(1, count + 1):
+        now += timedelta(seconds=rng.expovariate(1 / mean_gap))
+        help_type = 1 if rng.random() < 0.2 else 0
+        seconds = rng.expovariate(1 / (mean_help / (2 if help_type else 1)))
+        entry = PendingEntry(ticket_id, now, help_type,
+                             (rng.randrange(11),), rng.choice(SYNTHETIC_ROOMS),
+                             'ws{}'.format(rng.randrange(40)))
+        tickets.append(SimTicket(entry, timedelta(
+            seconds=min(seconds, MAX_HELP_TIME))))
+    return tickets
+
+
+def simulate(policy, tickets: List[SimTicket], graders: int,
+             queue_id: int) -> Tuple[List[float], Dict[int, List[float]],
+                                     float]:
+    '''
+    Run the tickets through the index with a policy and some graders.\n
+    Return:\n
+    The waits in seconds, the waits by help type, and the seconds spent in
+    peek.\n
+    '''
+    index = PendingTicketIndex.get_instance()
+    pending: Dict[int, PendingEntry] = {}
+    by_id = {t.entry.ticket_id: t for t in tickets}
+    arrivals = sorted(tickets, key=lambda t: (t.entry.created_at,
+                                              t.entry.ticket_id))
+    rooms = sorted({t.entry.room for t in tickets}) or ['']
+
+    def loader(_):
+        return list(pending.values())
+
+    index.rebuild(queue_id, [])
+    # (time the grader is free, grader number)
+    free: List[Tuple[datetime, int]] = []
+    start = arrivals[0].entry.created_at if arrivals else datetime.now()
+    for grader in range(graders):
+        heapq.heappush(free, (start, grader))
+
+    waits: List[float] = []
+    by_type: Dict[int, List[float]] = {}
+    peek_time = 0.0
+    i = 0
+    while i < len(arrivals) or pending:
+        now, grader = heapq.heappop(free)
+        while i < len(arrivals) and arrivals[i].entry.created_at <= now:
+            entry = arrivals[i].entry
+            pending[entry.ticket_id] = entry
+            index.add(queue_id, entry)
+            i += 1
+        if not pending:
+            # Idle until the next ticket comes in
+            heapq.heappush(free, (arrivals[i].entry.created_at, grader))
+            continue
+
+        began = perf_counter()
+        ticket_id = index.peek(queue_id, policy, loader,
+                               rooms[grader % len(rooms)])
+        peek_time += perf_counter() - began
+        index.remove(queue_id, ticket_id)
+        entry = pending.pop(ticket_id)
+
+        wait = (now - entry.created_at).total_seconds()
+        waits.append(wait)
+        by_type.setdefault(entry.help_type, []).append(wait)
+        heapq.heappush(free, (now + by_id[ticket_id].help_time, grader))
+
+    index.invalidate(queue_id)
+    return waits, by_type, peek_time
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def report(policies, tickets: List[SimTicket], graders: int) -> None:
+    print('{} tickets, {} graders'.format(len(tickets), graders))
+    print('{:<10} {:>10} {:>10} {:>12} {:>12} {:>10}'.format(
+        'policy', 'mean (m)', 'p95 (m)', 'p95 q (m)', 'p95 co (m)',
+        'peek (us)'))
+    for n, policy in enumerate(policies.values()):
+        waits, by_type, peek_time = simulate(policy, tickets, graders,
+                                             -1 - n)
+        print('{:<10} {:>10.1f} {:>10.1f} {:>12.1f} {:>12.1f} {:>10.1f}'
+              .format(policy.name, mean(waits) / 60,
+                      percentile(waits, 95) / 60,
+                      percentile(by_type.get(0, []), 95) / 60,
+                      percentile(by_type.get(1, []), 95) / 60,
+                      peek_time / max(len(waits), 1) * 1e6))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--queue_id', type=int,
+                        help='replay the history of this queue')
+    parser.add_argument('--graders', type=int, default=3)
+    parser.add_argument('--tickets', type=int, default=2000,
+                        help='number of synthetic tickets')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from ..src.models.queue import DISPATCH_POLICIES
+
+    tickets = load_history(args.queue_id) if args.queue_id else []
+    if not tickets:
+        if args.queue_id:
+            print('No helped tickets in queue {}, using synthetic ones.'
+                  .format(args.queue_id))
+        tickets = synthetic_history(args.tickets, args.graders, args.seed)
+    report(DISPATCH_POLICIES, tickets, args.graders)
+
+
+if __name__ == '__main__':
+    main()
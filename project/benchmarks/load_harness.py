@@ -0,0 +1,425 @@
+'''
+Replay a busy office-hours day against the app and measure it.\n
+A scratch database (a temporary SQLite file, or --database) is seeded with
+courses, their queues, sections and rosters and a history of closed
+tickets. Then students and tutors drive the app through the Flask test
+client, each with their own session: students poll the queue, submit
+tickets and sometimes cancel them, tutors log into the queue, accept the
+oldest pending ticket and resolve it. Every actor acts as soon as its
+last request returned, so the run measures the most the app can serve.\n
+The requests per second, the p50/p95/p99 latency and the number of
+queries and commits per request of every route are printed at the end.\n
+The tables of --database are dropped and created again, only point it at
+a database made for this.\n
+Usage:\n
+    python -m project.benchmarks.load_harness --duration 30
+    python -m project.benchmarks.load_harness --students 300 --threads 4 \\
+        --database postgresql://localhost/autograder_load
+'''
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+ROOMS = ('B230', 'B240', 'B250', 'B260')
+
+# Their foreign keys name tables which don't exist, nothing uses them.
+SKIPPED_TABLES = ('NewsFeedPost', 'QueueCalendar')
+
+# Chances of what an actor does next. Anything else is a poll.
+SUBMIT_CHANCE = 0.1
+CANCEL_CHANCE = 0.02
+RESOLVE_CHANCE = 0.2
+LOGOUT_CHANCE = 0.01
+
+
+class Recorder(object):
+    '''
+    Collects the latency and the number of queries and commits of every
+    request, per route. They are counted by engine events, on the thread
+    which runs them.
+    '''
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Dict[str, int] = defaultdict(int)
+        self.commits: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        event.listen(engine, 'before_cursor_execute', self._count)
+        event.listen(engine, 'commit', self._count_commit)
+
+    def _count(self, *args) -> None:
+        self._local.queries = getattr(self._local, 'queries', 0) + 1
+
+    def _count_commit(self, *args) -> None:
+        self._local.commits = getattr(self._local, 'commits', 0) + 1
+
+    def call(self, client, method: str, route: str, **kwargs):
+        self._local.queries = self._local.commits = 0
+        start = perf_counter()
+        response = client.open(route, method=method, **kwargs)
+        elapsed = perf_counter() - start
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            self.queries[route] += self._local.queries
+            self.commits[route] += self._local.commits
+            # A ticket somebody else accepted first is part of the workload
+            if response.status_code >= 400 and response.status_code != 409:
+                self.errors[route] += 1
+        return response
+
+    def report(self, wall: float) -> None:
+        total = sum(len(times) for times in self.latencies.values())
+        print(f'{total} requests in {wall:.1f}s: {total / wall:.1f} req/s')
+        print(f'{"route":<36}{"count":>7}{"req/s":>8}{"p50 ms":>8}'
+              f'{"p95 ms":>8}{"p99 ms":>8}{"queries":>8}{"commits":>8}'
+              f'{"errors":>7}')
+        for route in sorted(self.latencies):
+            times = sorted(self.latencies[route])
+            print(f'{route:<36}{len(times):>7}{len(times) / wall:>8.1f}'
+                  f'{percentile(times, 50) * 1000:>8.1f}'
+                  f'{percentile(times, 95) * 1000:>8.1f}'
+                  f'{percentile(times, 99) * 1000:>8.1f}'
+                  f'{self.queries[route] / len(times):>8.1f}'
+                  f'{self.commits[route] / len(times):>8.1f}'
+                  f'{self.errors[route]:>7}')
+
+
+def percentile(times: List[float], pct: float) -> float:
+    '''
+    The nearest-rank percentile of sorted times.\n
+    '''
+    rank = max(int(round(pct / 100 * len(times) + 0.5)) - 1, 0)
+    return times[min(rank, len(times) - 1)]
+
+
+class Student(object):
+    '''
+    A student on the queue of their course, with at most one open ticket.
+    '''
+
+    def __init__(self, client, user_id: int, queue_id: int):
+        self.client = client
+        self.user_id = user_id
+        self.queue_id = queue_id
+        self.ticket_id = None
+
+    def act(self, rng: random.Random, recorder: Recorder) -> None:
+        if self.ticket_id is None and rng.random() < SUBMIT_CHANCE:
+            response = recorder.call(
+                self.client, 'POST', '/api/ticket/add_ticket',
+                json={'student_id': self.user_id, 'queue_id': self.queue_id,
+                      'title': 'Stuck', 'description': 'Help please',
+                      'room': rng.choice(ROOMS),
+                      'workstation': str(rng.randrange(1, 60)),
+                      'is_private': 0, 'help_type': int(rng.random() < 0.2),
+                      'tag_list': str(rng.randrange(0, 9))})
+            if response.status_code == 200:
+                self.ticket_id = ticket_id(response.json['result'])
+        elif self.ticket_id is not None and rng.random() < CANCEL_CHANCE:
+            recorder.call(self.client, 'POST', '/api/ticket/student_update',
+                          json={'ticket_id': self.ticket_id, 'cancel': 1})
+            self.ticket_id = None
+        else:
+            tickets = poll(self.client, recorder, self.queue_id, accepted=1)
+            if self.ticket_id not in set(map(ticket_id, tickets)):
+                # Resolved by a tutor
+                self.ticket_id = None
+
+
+class Tutor(object):
+    '''
+    A tutor on duty, helping one ticket at a time.
+    '''
+
+    def __init__(self, client, user_id: int, queue_id: int):
+        self.client = client
+        self.user_id = user_id
+        self.queue_id = queue_id
+        self.ticket_id = None
+        self.on_duty = False
+
+    def act(self, rng: random.Random, recorder: Recorder) -> None:
+        if not self.on_duty:
+            self._login(recorder, 'login_grader')
+            self.on_duty = True
+        elif self.ticket_id is not None:
+            if rng.random() < RESOLVE_CHANCE:
+                self._update(recorder, 'RESOLVED')
+                self.ticket_id = None
+            else:
+                poll(self.client, recorder, self.queue_id, accepted=1)
+        elif rng.random() < LOGOUT_CHANCE:
+            self._login(recorder, 'logout_grader')
+            self.on_duty = False
+        else:
+            tickets = poll(self.client, recorder, self.queue_id)
+            if tickets:
+                # Newest first, take the one waiting the longest
+                self.ticket_id = ticket_id(tickets[-1])
+                if self._update(recorder, 'ACCEPTED').status_code != 200:
+                    self.ticket_id = None
+
+    def _login(self, recorder: Recorder, route: str) -> None:
+        recorder.call(self.client, 'POST', '/api/queue/' + route,
+                      json={'queue_id': self.queue_id,
+                            'user_id': self.user_id,
+                            'action_type': 'MANUAL'})
+
+    def _update(self, recorder: Recorder, status: str):
+        return recorder.call(self.client, 'POST', '/api/ticket/grader_update',
+                             json={'ticket_id': self.ticket_id,
+                                   'status': status})
+
+
+def poll(client, recorder: Recorder, queue_id: int,
+         accepted: int = 0) -> List[Dict]:
+    response = recorder.call(
+        client, 'GET', '/api/ticket/find_all_tickets',
+        query_string={'queue_id': queue_id, 'pending': 1,
+                      'accepted': accepted})
+    return response.json['result'] if response.status_code == 200 else []
+
+
+def ticket_id(ticket: Dict) -> Optional[int]:
+    return ticket['ticket_info'].get('ticket_id')
+
+
+def seed(args: argparse.Namespace) -> Tuple[List, List]:
+    '''
+    Create the tables and fill them, returning the (user id, queue id) of
+    the students and of the tutors taking part in the run.\n
+    '''
+    from ..setup import db
+    from ..src.models.user import User
+    from ..src.models.queue import Queue
+    from ..src.models.course import Course
+    from ..src.models.section import Section
+    from ..src.models.enrolled_course import EnrolledCourse, Role, Status
+    from ..src.security.roles import URole
+
+    tables = [table for name, table in db.metadata.tables.items()
+              if name not in SKIPPED_TABLES]
+    db.metadata.drop_all(bind=db.engine, tables=tables)
+    db.metadata.create_all(bind=db.engine, tables=tables)
+
+    rng = random.Random(args.seed)
+    per_course = args.roster + args.staff
+    db.session.bulk_insert_mappings(User, [
+        {'email': f'user{i}@load.test', 'first_name': 'User',
+         'last_name': str(i), 'pid': f'A{i:08d}', 'password': '!',
+         'urole': URole.NONE.value, 'request': False, 'token': ''}
+        for i in range(args.courses * per_course)])
+    user_ids = [uid for uid, in db.session.query(User.id).order_by(User.id)]
+
+    students, tutors = [], []
+    for number in range(args.courses):
+        queue = Queue(status=0, high_capacity_enable=True,
+                      high_capacity_threshold=25, high_capacity_message='',
+                      high_capacity_warning='', ticket_cool_down=0,
+                      queue_lock=False)
+        db.session.add(queue)
+        db.session.flush()
+        course = Course(name=f'Course {number}', quarter=0,
+                        short_name=f'CSE{number}', year=2020,
+                        queue_id=queue.id, instructor_id=user_ids[0])
+        db.session.add(course)
+        db.session.flush()
+        section = Section(section_name=f'A{number:02d}', section_id=number,
+                          course_id=course.id)
+        db.session.add(section)
+        db.session.flush()
+
+        members = user_ids[number * per_course:(number + 1) * per_course]
+        db.session.bulk_insert_mappings(EnrolledCourse, [
+            {'user_id': uid, 'section_id': section.id,
+             'course_id': course.id, 'course_short_name': course.short_name,
+             'role': (Role.GRADER if i < args.staff else Role.STUDENT).value,
+             'status': Status.INACTIVE.value}
+            for i, uid in enumerate(members)])
+        ecs = dict(db.session.query(EnrolledCourse.user_id,
+                                    EnrolledCourse.id).
+                   filter_by(course_id=course.id))
+        staff, roster = members[:args.staff], members[args.staff:]
+        tutors += [(uid, queue.id) for uid in staff[:args.tutors]]
+        students += [(uid, queue.id) for uid in roster[:args.students]]
+        seed_history(rng, queue.id, [ecs[uid] for uid in roster],
+                     [ecs[uid] for uid in staff], args.history)
+    db.session.commit()
+    return students, tutors
+
+
+def seed_history(rng: random.Random, queue_id: int, students: List[int],
+                 staff: List[int], count: int) -> None:
+    '''
+    Insert the closed tickets of the past weeks of a queue, nine in ten
+    resolved and the rest canceled, with their events.\n
+    '''
+    from ..setup import db
+    from ..src.models.ticket import Ticket, Status as TStatus
+    from ..src.models.events.ticket_event import TicketEvent, EventType
+
+    start = datetime.now() - timedelta(weeks=10)
+    rows = []
+    for _ in range(count):
+        created = start + timedelta(seconds=rng.randrange(10 * 7 * 86400))
+        accepted = created + timedelta(seconds=rng.randrange(60, 3600))
+        closed = accepted + timedelta(seconds=rng.randrange(60, 900))
+        resolved = rng.random() < 0.9
+        rows.append({'queue_id': queue_id, 'created_at': created,
+                     'accepted_at': accepted if resolved else None,
+                     'closed_at': closed, 'room': rng.choice(ROOMS),
+                     'workstation': str(rng.randrange(1, 60)),
+                     'title': 'Stuck', 'description': 'Help please',
+                     'is_private': False, 'help_type': 0,
+                     'tag_one': rng.randrange(0, 9),
+                     'ec_student_id': rng.choice(students),
+                     'ec_grader_id': rng.choice(staff) if resolved else None,
+                     'status': (TStatus.RESOLVED if resolved
+                                else TStatus.CANCELED).value})
+    db.session.bulk_insert_mappings(Ticket, rows)
+
+    events = []
+    for ticket in Ticket.query.filter_by(queue_id=queue_id):
+        done = ticket.status == TStatus.RESOLVED.value
+        steps = [(EventType.CREATED, ticket.created_at, ticket.ec_student_id)]
+        if done:
+            steps.append((EventType.ACCEPTED, ticket.accepted_at,
+                          ticket.ec_grader_id))
+        steps.append((EventType.RESOLVED if done else EventType.CANCELED,
+                      ticket.closed_at, ticket.ec_grader_id if done
+                      else ticket.ec_student_id))
+        events += [{'ticket_id': ticket.id, 'event_type': kind.value,
+                    'timestamp': when, 'ec_user_id': ec, 'is_private': False,
+                    'message': kind.name}
+                   for kind, when, ec in steps]
+    db.session.bulk_insert_mappings(TicketEvent, events)
+    db.session.expunge_all()
+
+
+def accept_iso_strings() -> None:
+    '''
+    The models write their timestamps as isoformat strings, which Postgres
+    parses but the SQLite DateTime type refuses. Let it parse them too.\n
+    '''
+    from sqlalchemy.dialects.sqlite import base
+
+    from ..src.utils.time import TimeUtil
+
+    bind_processor = base.DATETIME.bind_processor
+
+    def parsing_bind_processor(self, dialect):
+        process = bind_processor(self, dialect)
+
+        def parse(value):
+            if isinstance(value, str):
+                value = TimeUtil.convert_str_to_datetime(value)
+            if isinstance(value, datetime):
+                value = TimeUtil.to_db_time(value)
+            return process(value)
+        return parse
+
+    base.DATETIME.bind_processor = parsing_bind_processor
+
+
+def run_actors(actors: List, deadline: float, seed: int,
+               recorder: Recorder) -> None:
+    rng = random.Random(seed)
+    while perf_counter() < deadline:
+        rng.choice(actors).act(rng, recorder)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database',
+                        help='database URL, a temporary SQLite file if not '
+                        'given. Its tables are dropped!')
+    parser.add_argument('--courses', type=int, default=2)
+    parser.add_argument('--roster', type=int, default=300,
+                        help='students enrolled per course')
+    parser.add_argument('--staff', type=int, default=20,
+                        help='tutors enrolled per course')
+    parser.add_argument('--history', type=int, default=5000,
+                        help='closed tickets per queue')
+    parser.add_argument('--students', type=int, default=100,
+                        help='students on the queue per course')
+    parser.add_argument('--tutors', type=int, default=8,
+                        help='tutors on duty per course')
+    parser.add_argument('--duration', type=float, default=20,
+                        help='seconds of load')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from .. import app
+    from ..config import engine_options
+
+    scratch = tempfile.mkdtemp(prefix='load_harness')
+    # The engine and the logger are created on first use, after this
+    uri = args.database or 'sqlite:///' + os.path.join(scratch, 'load.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    app.config['LOG_FILE'] = os.path.join(scratch, 'load.log')
+    app.config['SECRET_KEY'] = app.config.get('SECRET_KEY') or 'load harness'
+    try:
+        run(args)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def run(args: argparse.Namespace) -> None:
+    from .. import app
+    from ..setup import db
+    from ..src.utils.logger import Logger
+    from ..src.utils.pool_metrics import PoolMetrics
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            accept_iso_strings()
+        began = perf_counter()
+        students, tutors = seed(args)
+        print(f'seeded {args.courses} courses, {args.history} closed tickets '
+              f'per queue in {perf_counter() - began:.1f}s')
+        recorder = Recorder(db.engine)
+
+    actors = []
+    for kind, people in ((Student, students), (Tutor, tutors)):
+        for user_id, queue_id in people:
+            client = app.test_client()
+            # Logins aren't what is measured here (see login_bench)
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user_id)
+                session['_fresh'] = True
+            actors.append(kind(client, user_id, queue_id))
+    random.Random(args.seed).shuffle(actors)
+    print(f'{len(students)} students and {len(tutors)} tutors, '
+          f'{args.threads} threads, {args.duration:.0f}s')
+
+    deadline = perf_counter() + args.duration
+    began = perf_counter()
+    threads = [threading.Thread(target=run_actors,
+                                args=(actors[i::args.threads], deadline,
+                                      args.seed + i, recorder))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.report(perf_counter() - began)
+    with app.app_context():
+        print('pool:', PoolMetrics.get_instance().to_json())
+    Logger.get_instance().stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Measure how many password checks per second a worker can do: the old
+login path (master password, then the user's hash) against the current one
+(the user's hash only), first on one thread and then with many concurrent
+logins, at most PASSWORD_WORKERS of them hashing at once, as at the start
+of a class.\n
+Usage:\n
+    python -m project.benchmarks.login_bench --logins 200 --clients 16
+'''
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Callable, List, Optional
+
+from ..src.security import password
+from ..src.security.password import pwd_context, superpass, \
+    verify_password, is_superpass
+
+PASSWORD = 'correct horse battery staple'
+
+
+def old_check(hashed: str) -> bool:
+    return pwd_context.verify(PASSWORD, superpass) or \
+        pwd_context.verify(PASSWORD, hashed)
+
+
+def new_check(hashed: str) -> bool:
+    return verify_password(PASSWORD, hashed)[0] or is_superpass(PASSWORD)
+
+
+def rate(check: Callable[[str], bool], hashed: str, logins: int,
+         clients: int) -> float:
+    start = perf_counter()
+    if clients == 1:
+        for _ in range(logins):
+            assert check(hashed)
+    else:
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            assert all(pool.map(check, [hashed] * logins))
+    return logins / (perf_counter() - start)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=16,
+                        help='concurrent logins in the second run')
+    args = parser.parse_args(argv)
+
+    hashed = pwd_context.hash(PASSWORD)
+    cores = os.cpu_count() or 1
+    print(f'pbkdf2_sha256, {password.PASSWORD_ROUNDS} rounds, {cores} '
+          f'cores, {password.PASSWORD_WORKERS} hashing at once')
+    print(f'{"path":<8}{"clients":>8}{"logins/s":>12}{"per core":>12}')
+    for clients in (1, args.clients):
+        for name, check in (('old', old_check), ('new', new_check)):
+            per_second = rate(check, hashed, args.logins, clients)
+            print(f'{name:<8}{clients:>8}{per_second:>12.1f}'
+                  f'{per_second / cores:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
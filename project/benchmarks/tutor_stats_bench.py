@@ -0,0 +1,79 @@
+'''
+Time TutorStats on a synthetic quarter: every tutor works a few sessions a
+week and helps tickets back to back, some of which get deferred or left
+open. Only the computation is timed, the rows are generated up front as
+the two queries of TutorStats.load would return them.\n
+Usage:\n
+    python -m project.benchmarks.tutor_stats_bench --tutors 50 --weeks 11
+'''
+import argparse
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+from ..src.models.events.queue_login_event import EType
+from ..src.models.events.ticket_event import EventType
+from ..src.utils.tutor_stats import TutorStats
+
+QUARTER_START = datetime(2020, 1, 6, 8)
+
+
+def synthetic_quarter(tutors: int, weeks: int, sessions_per_week: int,
+                      seed: int) -> Tuple[List, List]:
+    rng = random.Random(seed)
+    logins, events = [], []
+    ticket_id = 0
+    for tutor in range(1, tutors + 1):
+        for week in range(weeks):
+            days = rng.sample(range(5), min(sessions_per_week, 5))
+            for day in days:
+                start = QUARTER_START + timedelta(
+                    weeks=week, days=day, hours=rng.randrange(10))
+                end = start + timedelta(hours=2)
+                logins.append((len(logins), tutor, EType.LOGIN.value, start))
+                now = start + timedelta(minutes=rng.randrange(5))
+                while now < end:
+                    ticket_id += 1
+                    events.append((len(events), tutor, ticket_id,
+                                   EventType.ACCEPTED.value, now))
+                    now += timedelta(seconds=rng.randrange(60, 900))
+                    outcome = EventType.RESOLVED.value \
+                        if rng.random() < 0.9 else EventType.DEFERRED.value
+                    events.append((len(events), tutor, ticket_id, outcome,
+                                   now))
+                    now += timedelta(seconds=rng.randrange(0, 300))
+                logins.append((len(logins), tutor, EType.LOGOUT.value, end))
+    return logins, events
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--tutors', type=int, default=50)
+    parser.add_argument('--weeks', type=int, default=11)
+    parser.add_argument('--sessions', type=int, default=4,
+                        help='sessions per tutor per week')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logins, events = synthetic_quarter(args.tutors, args.weeks,
+                                       args.sessions, args.seed)
+    end = QUARTER_START + timedelta(weeks=args.weeks)
+    print('{} tutors, {} weeks: {} login events, {} ticket events'.format(
+        args.tutors, args.weeks, len(logins), len(events)))
+
+    best = None
+    for _ in range(args.repeat):
+        began = perf_counter()
+        stats = TutorStats(logins, events, QUARTER_START, end)
+        sessions = stats.sessions()
+        stats.summary()
+        elapsed = perf_counter() - began
+        best = elapsed if best is None else min(best, elapsed)
+    print('{} sessions in {:.3f}s (best of {})'.format(
+        len(sessions), best, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,72 @@ import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def engine_options(uri: str) -> dict:
+    '''
+    The options of the engine of a database URL. Every gunicorn worker
+    thread holds at most one connection, so a worker needs a pool as big as
+    its number of threads (DB_POOL_SIZE), plus DB_MAX_OVERFLOW extra
+    connections opened when all are taken and closed when given back.
+    Connections are checked before use (DB_POOL_PRE_PING) and replaced
+    after DB_POOL_RECYCLE seconds, so none is used after a database
+    restart. SQLite doesn't pool its connections the same way and only
+    takes the last two.\n
+    '''
+    options = {
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') not in
+        ('0', 'false', ''),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    }
+    if not uri.startswith('sqlite'):
+        options['pool_size'] = int(os.getenv('DB_POOL_SIZE', 5))
+        options['max_overflow'] = int(os.getenv('DB_MAX_OVERFLOW', 5))
+        # Seconds a request waits for a connection before failing
+        options['pool_timeout'] = int(os.getenv('DB_POOL_TIMEOUT', 10))
+    return options
+
+
 class Config(object):
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", 'sqlite://')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.getenv('SECRET_KEY')
     CORS_HEADERS = os.getenv('CORS_HEADERS')
+    # Seconds queue settings and the queue of a course are cached per worker
+    MODEL_CACHE_TTL = int(os.getenv('MODEL_CACHE_TTL', 30))
+    # Postgres channel used to invalidate the other workers' caches (optional)
+    MODEL_CACHE_CHANNEL = os.getenv('MODEL_CACHE_CHANNEL')
+    # Outgoing mail, sent in the background by the MailDispatcher
+    MAIL_SERVER = os.getenv('AG_SMTP_HOST', 'smtp.gmail.com')
+    MAIL_PORT = int(os.getenv('AG_SMTP_PORT', 465))
+    MAIL_USE_SSL = os.getenv('AG_SMTP_SSL', '1') not in ('0', 'false', '')
+    MAIL_USERNAME = os.getenv('AG_EMAIL')
+    MAIL_PASSWORD = os.getenv('AG_PASSWORD')
+    MAIL_WORKERS = int(os.getenv('MAIL_WORKERS', 2))
+    MAIL_QUEUE_SIZE = int(os.getenv('MAIL_QUEUE_SIZE', 1000))
+    MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', 50))
+    # Emails not sent yet are kept here and sent after a restart
+    MAIL_SPOOL_DIR = os.getenv('MAIL_SPOOL_DIR',
+                               os.path.join(basedir, 'mail_spool'))
+    # Logging, written to the file by a background thread
+    LOG_FILE = os.getenv('LOG_FILE', 'application.log')
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    # 'text' for the usual lines, 'json' for one JSON object per line
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    # Levels of single loggers, e.g. 'sqlalchemy.engine=INFO,werkzeug=ERROR'
+    LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+    # The file is gzipped and a new one started when it gets bigger than
+    # LOG_MAX_BYTES or older than LOG_ROTATE_SECONDS (0 to disable either),
+    # keeping the last LOG_BACKUP_COUNT of them.
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_ROTATE_SECONDS = int(os.getenv('LOG_ROTATE_SECONDS', 7 * 24 * 3600))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 8))
+    # Seconds the logged in user is cached per worker, and how many users
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 10))
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 2000))
+    # Count the queries of every request (X-Query-Profile header and a log
+    # line) and log the statements slower than SLOW_QUERY_MS
+    QUERY_PROFILE = os.getenv('QUERY_PROFILE', '0') not in ('0', 'false', '')
+    SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 100))
+    # Also serve the totals per endpoint at /api/diagnostics/queries
+    QUERY_DIAGNOSTICS = os.getenv('QUERY_DIAGNOSTICS', '0') not in \
+        ('0', 'false', '')
@@ -1,14 +1,37 @@
+import os
+
 from flask_api import FlaskAPI
 from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy
 from flask.cli import FlaskGroup
 from flask_cors import CORS
 
+from .src.utils.request_cache import RequestCache
+from .src.utils.model_cache import ModelCache
+from .src.utils.pool_metrics import PoolMetrics
+from .src.utils.unit_of_work import UnitOfWork
+
 app = FlaskAPI(__name__)
 CORS(app)
 app.config.from_object("project.config.Config")
 db = SQLAlchemy(app)
-db.init_app(app)
 cli = FlaskGroup(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
+RequestCache.init_app(app)
+ModelCache.get_instance().init_app(app, db)
+PoolMetrics.get_instance().init_app(app, db)
+UnitOfWork.init_app(app, db)
+
+
+def dispose_engine() -> None:
+    '''
+    Give a forked worker (gunicorn --preload) a pool of its own. The
+    connections of the parent are dropped without closing them, they are
+    still the parent's.
+    '''
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=dispose_engine)
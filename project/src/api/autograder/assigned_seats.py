@@ -1,16 +1,28 @@
 from flask_cors import CORS
+from flask_login import current_user, login_required
 from flask import Blueprint, request, jsonify
-from json import loads
-from ...utils.mailer import MailUtil
-from ...utils.logger import Logger
-from ...models.user import User
+from ...utils.seat_emails import start_seat_emails
 from ...models.autograder.assigned_seats import AssignedSeats
+from ...models.autograder.email_job import EmailJob
+from ...models.enrolled_course import EnrolledCourse, Role
 
 
 assigned_seats_api_bp = Blueprint('assigned_seats_api', __name__)
 CORS(assigned_seats_api_bp, supports_credentials=True)
 
 
+def is_instructor_of(assignment: AssignedSeats) -> bool:
+    '''
+    Whether the current user is an admin, or an instructor (or higher) of
+    the course of a seat assignment.
+    '''
+    if current_user.is_admin():
+        return True
+    ec = EnrolledCourse.find_user_in_course(user_id=current_user.id,
+                                            course_id=assignment.course_id)
+    return ec is not None and ec.role <= Role.INSTRUCTOR.value
+
+
 @assigned_seats_api_bp.route('/add', methods=['POST'])
 def add():
     '''
@@ -127,14 +139,17 @@ def get_all_in_section():
     return jsonify({'reason': 'request OK', 'result': assignments}), 200
 
 
-@assigned_seats_api_bp.route('/email_all_in_assignment', methods=[])
+@assigned_seats_api_bp.route('/email_all_in_assignment',
+                             methods=['POST'])
+@login_required
 def email_all_in_assignment():
     '''
-    TODO: This route can be called by anyone at the moment, no security
-    Route used to send emails to all the students assigned a seat
+    Route used to send emails to all the students assigned a seat. The
+    emails are sent in the background, poll email_job_status with the
+    returned job id to follow them. Instructors of the course only.
     @author james-c-lars
     '''
-    assignment_name = request.args.get('assignment_name', type=str)
+    assignment_name = request.json.get('assignment_name')
 
     assignment = AssignedSeats.find_by_name(assignment_name)
 
@@ -142,27 +157,31 @@ def email_all_in_assignment():
     if not assignment:
         return jsonify({'reason': "assignment doesn't exist"}), 300
 
-    # Otherwise collect the emails of the students
-    assign_dict = loads(assignment.seat_assignments)
-    assign_dict = {seat: User.find_by_pid_email_fallback(student.pid)
-                   for seat, student in assign_dict.items()}
+    if not is_instructor_of(assignment):
+        return jsonify({'reason': 'Method is forbiden from you'}), 403
 
-    for seat, student in assign_dict.items():
-        Logger.get_instance()\
-            .seat_assignment_email(f'{student.first_name} {student.last_name}',
-                                   seat, assignment.assignment_name,
-                                   student.email)
+    job = start_seat_emails(assignment)
 
-        email_body = "Hi there!\n"
-        email_body += f"For the upcoming {assignment.assignment_name} you've "
-        email_body += f"been assigned seat {seat}.\n"
-        email_body += 'Make sure to get there early so that you can find your '
-        email_body += 'seat.\n'
-        email_body += '\nCheers,\nThe Autograder Team'
+    return jsonify({'reason': 'emails queued',
+                    'result': job.to_json()}), 202
 
-        subject = f"Your seat for the upcoming {assignment.assignment_name}"
 
-        MailUtil.get_instance().send(student.email, subject, email_body)
+@assigned_seats_api_bp.route('/email_job_status', methods=['GET'])
+@login_required
+def email_job_status():
+    '''
+    Route used to get how many emails of a job were sent, failed or are
+    still queued. Instructors of the course only.
+    '''
+    job_id = request.args.get('job_id', type=int)
 
-    return jsonify({'reason': 'emails sent'}),\
-        200
+    job = EmailJob.find_by_id(job_id)
+
+    if not job:
+        return jsonify({'reason': "job doesn't exist"}), 300
+
+    assignment = AssignedSeats.get_assignment_by_id(job.assignment_id)
+    if not assignment or not is_instructor_of(assignment):
+        return jsonify({'reason': 'Method is forbiden from you'}), 403
+
+    return jsonify({'reason': 'request OK', 'result': job.to_json()}), 200
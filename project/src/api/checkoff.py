@@ -127,7 +127,7 @@ def submit_evaluation():
 
     title = f'Checkoff Confirmation for {course.short_name} - {checkoff.name}'
 
-    if MailUtil.get_instance().send(student.email, title, msg):
+    if MailUtil.get_instance().send_async(student.email, title, msg):
         Logger.get_instance().custom_msg(f'Email sent to {student.email}', LogLevels.INFO)
         return jsonify({'reason': 'checkoff evaluation successfully created',
                         'eval': ce.to_json()}), 200
@@ -0,0 +1,45 @@
+from flask_cors import CORS
+from flask_login import login_required, current_user
+from flask import Blueprint, request, jsonify
+
+from ..utils.pool_metrics import PoolMetrics
+from ..utils.query_profiler import QueryProfiler
+
+
+# Only registered when QUERY_DIAGNOSTICS is set
+diagnostics_api_bp = Blueprint('diagnostics_api', __name__)
+CORS(diagnostics_api_bp, supports_credentials=True)
+
+
+@diagnostics_api_bp.route('/queries', methods=['GET'])
+@login_required
+def queries():
+    '''
+    Route used to see the queries every endpoint ran since the worker
+    started, and the last slow statements. Pass reset=1 to start counting
+    again. Admins only.\n
+    '''
+    if not current_user.is_admin():
+        return jsonify({'reason': 'only admin users can see this'}), 400
+
+    profiler = QueryProfiler.get_instance()
+    result = {'endpoints': profiler.endpoint_stats(),
+              'slow_queries': profiler.slow_queries()}
+    if request.args.get('reset', default=0, type=int):
+        profiler.reset()
+    return jsonify({'reason': 'request OK', 'result': result}), 200
+
+
+@diagnostics_api_bp.route('/pool', methods=['GET'])
+@login_required
+def pool():
+    '''
+    Route used to see the connection pool of the worker answering: its
+    state, how saturated it is and was at most, and how many connections
+    it opened and threw away. Admins only.\n
+    '''
+    if not current_user.is_admin():
+        return jsonify({'reason': 'only admin users can see this'}), 400
+
+    return jsonify({'reason': 'request OK',
+                    'result': PoolMetrics.get_instance().to_json()}), 200
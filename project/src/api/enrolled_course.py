@@ -1,10 +1,13 @@
 from flask_cors import CORS
 # from flask_login import login_required, current_user
-from flask_login import current_user
+from flask_login import current_user, login_required
 from flask import Blueprint, request, jsonify
 
 from ..models.user import User
+from ..models.course import Course
 from ..models.enrolled_course import Role, EnrolledCourse
+from ..utils.roster_import import RosterImport, read_roster, \
+    ROSTER_FORMATS
 
 enrolled_course_api_bp = Blueprint('enrolled_course_api', __name__)
 CORS(enrolled_course_api_bp)
@@ -50,6 +53,47 @@ def enroll_user():
         return jsonify({'reason': 'user existed'}), 300
 
 
+@enrolled_course_api_bp.route('/import_roster', methods=['POST'])
+@login_required
+def import_roster():
+    """
+    Route to create the accounts of a whole roster and enroll everyone in
+    their section of a course, in batches. The roster is the body of the
+    request (or a `roster` file field), as csv, ndjson or a json list.
+    Rows which can't be imported are listed with the reason.
+    """
+    course_id = request.args.get('course_id', type=int)
+    course = Course.get_course_by_id(course_id) if course_id else None
+    if not course:
+        return jsonify({'reason': 'course not found'}), 400
+
+    ec = EnrolledCourse.find_user_in_course(user_id=current_user.id,
+                                            course_id=course.id)
+    if not current_user.is_admin() and \
+            (not ec or ec.role > Role.INSTRUCTOR.value):
+        return jsonify({'reason': 'Method is forbiden from you'}), 403
+
+    # Only look at the form for uploads, so other bodies are left unparsed
+    upload = request.files.get('roster') \
+        if request.mimetype == 'multipart/form-data' else None
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format', type=str)
+    if not fmt:
+        mimetype = upload.mimetype if upload else request.mimetype
+        fmt = {'application/json': 'json',
+               'application/x-ndjson': 'ndjson'}.get(mimetype, 'csv')
+
+    if fmt not in ROSTER_FORMATS:
+        return jsonify({'reason': 'unknown format'}), 400
+
+    # Admins act as admins, even in courses they are enrolled in lower
+    role = Role(ec.role) if ec else Role.ADMIN
+    if current_user.is_admin() and role.value > Role.ADMIN.value:
+        role = Role.ADMIN
+    result = RosterImport(course, role).run(read_roster(stream, fmt))
+    return jsonify({'reason': 'roster imported', 'result': result}), 200
+
+
 @enrolled_course_api_bp.route('/change_role', methods=['POST'])
 # @login_required
 def change_role():
@@ -1,17 +1,28 @@
+from json import dumps
 from flask_cors import CORS
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 
-from ..models.queue import Queue, Status, ActionType
+from ...setup import db
+from ..models.queue import Queue, Status, ActionType, \
+    DISPATCH_POLICIES, DEFAULT_DISPATCH_POLICY
 from ..models.enrolled_course import EnrolledCourse, Role
 from ..models.course import Course
+from ..models.ticket import Ticket
 from ..models.ticket import Status as t_Status
 from ..models.queue_calendar import QueueCalendar
+from ..utils.queue_notifier import QueueNotifier
 
 
 queue_api_bp = Blueprint('queue_api', __name__)
 CORS(queue_api_bp, supports_credentials=True)
 
+# Seconds a stream waits for a notification before checking the DB anyway.
+# Picks up changes made by other workers and doubles as a keep-alive.
+STREAM_POLL_INTERVAL = 15
+# Max number of events read from the DB in one go.
+STREAM_BATCH_SIZE = 500
+
 
 def user_in_course(queue_id: int, course_id: int) -> bool:
     """
@@ -26,6 +37,14 @@ def user_in_course(queue_id: int, course_id: int) -> bool:
         return False
 
 
+def sse_frame(event: str, data: dict, event_id: int = None) -> str:
+    """
+    Format a server-sent event.
+    """
+    frame = f'id: {event_id}\n' if event_id is not None else ''
+    return frame + f'event: {event}\ndata: {dumps(data, default=str)}\n\n'
+
+
 def user_own_queue(queue_id: int) -> bool:
     """
     Checking whetehr the user is the instructor of the course
@@ -64,6 +83,92 @@ def find_queue():
     return jsonify(ret), 200
 
 
+@queue_api_bp.route('/stream', methods=['GET'])
+@login_required
+def stream():
+    """
+    Stream the changes of a queue as server-sent events instead of polling
+    find_queue / find_all_tickets.\n
+    A `queue` event carrying the queue status is sent on connect and whenever
+    the queue is opened, locked or closed. A `ticket` event is sent for every
+    TicketEvent written on the queue, its id is the TicketEvent id.\n
+    To resume, pass the last id seen in the Last-Event-ID header (browsers do
+    it on reconnect) or as the last_event_id argument. Without one the stream
+    starts from now, so fetch the tickets first and then open the stream.\n
+    Each open stream holds a worker thread, so run with threaded workers.
+    Only the people enrolled in the course of the queue can follow it.
+    """
+    queue_id = request.args.get('queue_id', type=int)
+    course = Course.get_course_by_queue_id(queue_id) if queue_id else None
+    if not course or not Queue.get_queue_by_id(queue_id):
+        return jsonify({'reason': 'queue not found'}), 400
+
+    if not EnrolledCourse.find_user_in_course(user_id=current_user.id,
+                                              course_id=course.id):
+        return jsonify({'reason': 'user not enrolled'}), 403
+
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_event_id', type=int)
+    if last_id is None:
+        last_id = Ticket.find_last_event_id_for_queue(queue_id)
+
+    notifier = QueueNotifier.get_instance()
+
+    def generate(last_id: int):
+        status = None
+        while True:
+            seen = notifier.version(queue_id)
+
+            queue = Queue.get_queue_by_id(queue_id)
+            if queue.status != status:
+                status = queue.status
+                yield sse_frame('queue', {'queue_id': queue_id,
+                                          'status': Status(status).name})
+
+            events = Ticket.find_events_for_queue_since(queue_id, last_id,
+                                                        STREAM_BATCH_SIZE)
+            for evt in events:
+                last_id = evt.id
+                yield sse_frame('ticket', evt.to_delta(), evt.id)
+
+            # Don't hold on to a connection while idling
+            db.session.remove()
+
+            if len(events) == STREAM_BATCH_SIZE:
+                continue
+            if notifier.wait(queue_id, seen, STREAM_POLL_INTERVAL) == seen:
+                yield ': keep-alive\n\n'
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate(last_id)),
+                    mimetype='text/event-stream', headers=headers)
+
+
+@queue_api_bp.route('/next_ticket', methods=['POST'])
+@login_required
+def next_ticket():
+    """
+    Accept the next pending ticket of the queue for the current user, as
+    picked by a dispatch policy (fifo, priority, aging or locality).\n
+    """
+    queue_id = request.json.get('queue_id')
+    policy = request.json.get('policy', DEFAULT_DISPATCH_POLICY)
+    room = request.json.get('room')
+    if not queue_id or not Queue.get_queue_by_id(queue_id):
+        return jsonify({'reason': 'queue not found'}), 400
+    if policy not in DISPATCH_POLICIES:
+        return jsonify({'reason': 'unknown policy'}), 400
+
+    success, reason, ticket = Queue.next_ticket(queue_id, current_user.id,
+                                                policy, room)
+    if not success:
+        code = 403 if reason == 'Permission denied' else 409
+        return jsonify({'reason': reason}), code
+    return jsonify({'reason': 'success',
+                    'result': ticket.to_json(current_user.id)}), 200
+
+
 @queue_api_bp.route('/create_queue', methods=['POST'])
 # @login_required
 # @role_required(role=URole.ADMIN.value)
@@ -1,19 +1,31 @@
 from flask_cors import CORS
 from flask_login import login_required, current_user
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, \
+    stream_with_context
 
 from ..models.ticket import Ticket, HelpType, TicketTag
 from ..models.events.ticket_event import TicketEvent, EventType
 from ..models.queue import Queue
-from ..models.enrolled_course import EnrolledCourse
+from ..models.enrolled_course import EnrolledCourse, Role
 from ..models.course import Course
 from ..models.user import User
+from ..utils.time import TimeUtil
+from ..utils.ticket_export import EXPORT_COLUMNS, EXPORT_FORMATS, \
+    export_query, export_rows
 
 # TODO: Change some POST to PUT request
 
 ticket_api_bp = Blueprint('ticket_api', __name__)
 CORS(ticket_api_bp, supports_credentials=True)
 
+# Default and max page size of /find_tickets
+FIND_TICKETS_LIMIT = 100
+FIND_TICKETS_MAX_LIMIT = 500
+
+# Default and max page size of /history
+HISTORY_LIMIT = 20
+HISTORY_MAX_LIMIT = 100
+
 
 # Route for testing
 @ticket_api_bp.route('/show_all_evts', methods=['GET'])
@@ -170,15 +182,18 @@ def grader_update():
     grader = User.get_user_by_id(current_user.id)
 
     if status == 'ACCEPTED':
-        ticket.mark_accepted_by(grader)
+        # Writes its own event, in the same transaction
+        accepted, reason = ticket.mark_accepted_by(grader)
+        if not accepted:
+            return jsonify({'reason': reason}), 409
     else:
         actions[status]()
-
-    TicketEvent.create_event(event_type=EventType[status],
-                             ticket_id=ticket.id,
-                             message=status,
-                             is_private=ticket.is_private,
-                             user_id=current_user.id, queue_id=ticket.queue_id)
+        TicketEvent.create_event(event_type=EventType[status],
+                                 ticket_id=ticket.id,
+                                 message=status,
+                                 is_private=ticket.is_private,
+                                 user_id=current_user.id,
+                                 queue_id=ticket.queue_id)
 
     return jsonify({'status': status,
                     'grader_name': grader.first_name + ' ' + grader.last_name,
@@ -207,6 +222,8 @@ def find_tickets():
     Route used to find tickets in a queue (id must be provided). Optional
     Optional parameters (student_id, grader_id, list with desired statuses,
     start/end date) can be passed in to add filters to the search.
+    Results are paginated, latest first: pass the returned next_after_id as
+    after_id to get the following page.
     @author nouryehia
     '''
     # Only required argument
@@ -217,58 +234,151 @@ def find_tickets():
     # Dates must have MM.DD.YYYY format
     student_id = request.args.get('student_id', default=None, type=int)
     grader_id = request.args.get('grader_id', default=None, type=int)
-    status_list = request.args.get('status', default=None, type=int)
+    status_list = request.args.get('status', default=None, type=str)
     start = request.args.get('start', default=None, type=str)
     end = request.args.get('end', default=None, type=str)
+    limit = request.args.get('limit', default=FIND_TICKETS_LIMIT, type=int)
+    offset = request.args.get('offset', default=0, type=int)
+    after_id = request.args.get('after_id', default=None, type=int)
 
-    course_id = Course.get_course_by_queue_id(queue_id).id
+    course = Course.get_course_by_queue_id(queue_id)
+    if not course:
+        return jsonify({'reason': 'queue not found'}), 400
 
+    s_id = g_id = None
     if student_id:
-        s_id = EnrolledCourse.find_all_user_in_course(user_id=student_id,
-                                                      course_id=course_id).id
+        ec = EnrolledCourse.find_user_in_course(user_id=student_id,
+                                                course_id=course.id)
+        if not ec:
+            return jsonify({'result': [], 'next_after_id': None}), 200
+        s_id = ec.id
     if grader_id:
-        g_id = EnrolledCourse.find_all_user_in_course(user_id=grader_id,
-                                                      course_id=course_id).id
+        ec = EnrolledCourse.find_user_in_course(user_id=grader_id,
+                                                course_id=course.id)
+        if not ec:
+            return jsonify({'result': [], 'next_after_id': None}), 200
+        g_id = ec.id
 
+    status = None
     if status_list:
-        status_list = set(status_list.split(';'))
-
-    if not start:
-        start = '01.01.2000'
-
-    if not end:
-        end = '12.31.2100'
-
-    tickets = Ticket.find_tickets_in_range(queue_id, start, end)
-    to_return = []
-
-    for t in tickets:
-        if (
-           # all three optinals params passed in and all of them match
-           student_id and grader_id and status_list and
-           s_id == t.ec_student_id and g_id == t.ec_grader_id and
-           str(t.status) in status_list or
-           # student id and grader id passed in and both of them match
-           student_id and grader_id and s_id == t.ec_student_id and
-           g_id == t.ec_grader_id or
-           # student id and status list passed in and both of them match
-           student_id and status_list and s_id == t.ec_student_id and
-           str(t.status) in status_list or
-           # grader id and status list passed in and both of them match
-           grader_id and status_list and g_id == t.ec_grader_id and
-           str(t.status) in status_list or
-           # only student id passed in and matches
-           student_id and s_id == t.ec_student_id or
-           # only grader id passed in and matches
-           grader_id and g_id == t.ec_grader_id or
-           # only status list passed in and matches
-           status_list and str(t.status) in status_list or
-           # no optinal params passed in (return all the tickets in timeframe)
-           not student_id and not grader_id and not status_list):
-
-            to_return.append(t.to_json(current_user.id))
-
-    return jsonify({'result': to_return}), 200
+        try:
+            status = [int(x) for x in status_list.split(';') if x]
+        except ValueError:
+            return jsonify({'reason': 'invalid status list'}), 400
+
+    try:
+        start = TimeUtil.convert_str_to_datetime(start) if start else None
+        end = TimeUtil.convert_str_to_datetime(end) if end else None
+    except ValueError:
+        return jsonify({'reason': 'invalid date'}), 400
+
+    after = None
+    if after_id is not None:
+        after = Ticket.get_ticket_by_id(after_id)
+        if not after or after.queue_id != queue_id:
+            return jsonify({'reason': 'invalid after_id'}), 400
+
+    limit = max(1, min(limit, FIND_TICKETS_MAX_LIMIT))
+    query = Ticket.build_query(queue_id, start=start, end=end,
+                               ec_student_id=s_id, ec_grader_id=g_id,
+                               status=status)
+    tickets = Ticket.find_tickets_page(query, limit, offset=max(offset, 0),
+                                       after=after)
+
+    next_after_id = tickets[-1].id if len(tickets) == limit else None
+    return jsonify({'result': Ticket.to_json_many(tickets, current_user.id),
+                    'next_after_id': next_after_id}), 200
+
+
+@ticket_api_bp.route('/history', methods=['GET'])
+@login_required
+def history():
+    '''
+    Route used to page through the closed tickets of a queue, latest closed
+    first, optionally only those of a student or of a grader. Pass the
+    returned next_cursor as cursor to get the following page.
+    '''
+    queue_id = request.args.get('queue_id', type=int)
+    student_id = request.args.get('student_id', default=None, type=int)
+    grader_id = request.args.get('grader_id', default=None, type=int)
+    limit = request.args.get('limit', default=HISTORY_LIMIT, type=int)
+    cursor = request.args.get('cursor', default=None, type=str)
+
+    course = Course.get_course_by_queue_id(queue_id)
+    if not course:
+        return jsonify({'reason': 'queue not found'}), 400
+
+    s_id = g_id = None
+    if student_id:
+        ec = EnrolledCourse.find_user_in_course(user_id=student_id,
+                                                course_id=course.id)
+        if not ec:
+            return jsonify({'result': [], 'next_cursor': None}), 200
+        s_id = ec.id
+    if grader_id:
+        ec = EnrolledCourse.find_user_in_course(user_id=grader_id,
+                                                course_id=course.id)
+        if not ec:
+            return jsonify({'result': [], 'next_cursor': None}), 200
+        g_id = ec.id
+
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    try:
+        tickets, next_cursor = Ticket.find_ticket_history(
+            queue_id, limit=limit, cursor=cursor,
+            ec_student_id=s_id, ec_grader_id=g_id)
+    except ValueError:
+        return jsonify({'reason': 'invalid cursor'}), 400
+
+    return jsonify({'result': Ticket.to_json_many(tickets, current_user.id),
+                    'next_cursor': next_cursor}), 200
+
+
+@ticket_api_bp.route('/export', methods=['GET'])
+@login_required
+def export():
+    '''
+    Route used by the staff of a course to download the tickets of a queue,
+    or their events or feedback, as CSV or NDJSON. The file is streamed as
+    it is read from the database, so it can be as big as the history.
+    '''
+    queue_id = request.args.get('queue_id', type=int)
+    kind = request.args.get('kind', default='tickets', type=str)
+    fmt = request.args.get('format', default='csv', type=str)
+    status_list = request.args.get('status', default=None, type=str)
+    start = request.args.get('start', default=None, type=str)
+    end = request.args.get('end', default=None, type=str)
+
+    if kind not in EXPORT_COLUMNS or fmt not in EXPORT_FORMATS:
+        return jsonify({'reason': 'invalid kind or format'}), 400
+
+    course = Course.get_course_by_queue_id(queue_id)
+    if not course:
+        return jsonify({'reason': 'queue not found'}), 400
+    ec = EnrolledCourse.find_user_in_course(user_id=current_user.id,
+                                            course_id=course.id)
+    if not ec or ec.role == Role.STUDENT.value:
+        return jsonify({'reason': 'permission denied'}), 403
+
+    status = None
+    if status_list:
+        try:
+            status = [int(x) for x in status_list.split(';') if x]
+        except ValueError:
+            return jsonify({'reason': 'invalid status list'}), 400
+
+    try:
+        start = TimeUtil.convert_str_to_datetime(start) if start else None
+        end = TimeUtil.convert_str_to_datetime(end) if end else None
+    except ValueError:
+        return jsonify({'reason': 'invalid date'}), 400
+
+    query = export_query(kind, queue_id, start=start, end=end, status=status)
+    filename = f'{course.short_name}-{kind}.{fmt}'
+    return Response(stream_with_context(export_rows(query, kind, fmt)),
+                    mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition':
+                             f'attachment; filename="{filename}"'})
 
 
 ##################################################
@@ -293,9 +403,7 @@ def find_all_tickets():
 
     tickets = Ticket.find_all_tickets(queue_id=queue_id, status=status)
 
-    ticket_infos = []
-    for ticket in tickets:
-        ticket_infos.append(ticket.to_json(user_id=current_user.id))
+    ticket_infos = Ticket.to_json_many(tickets, user_id=current_user.id)
 
     return jsonify({'result': ticket_infos}), 200
 
@@ -320,9 +428,7 @@ def find_all_tickets_by_student():
                 int(request.args.get('queue_id', type=int)),
                 int(request.args.get('student_id', type=int)), status)
 
-    ticket_infos = []
-    for ticket in tickets:
-        ticket_infos.append(ticket.to_json(user_id=current_user.id))
+    ticket_infos = Ticket.to_json_many(tickets, user_id=current_user.id)
 
     return jsonify({'result': ticket_infos}), 200
 
@@ -338,9 +444,7 @@ def find_all_tickets_for_grader():
         queue_id=int(request.args.get('queue_id', type=int)),
         grader_id=int(request.args.get('grader_id', type=int)))
 
-    ticket_infos = []
-    for ticket in tickets:
-        ticket_infos.append(ticket.to_json(user_id=current_user.id))
+    ticket_infos = Ticket.to_json_many(tickets, user_id=current_user.id)
 
     return jsonify({'result': ticket_infos}), 200
 
@@ -362,8 +466,6 @@ def find_tickets_in_range():
 
     tickets = Ticket.find_tickets_in_range(queue_id, start, end, grader_id,
                                            resolved)
-    ticket_infos = []
-    for ticket in tickets:
-        ticket_infos.append(ticket.to_json(user_id=current_user.id))
+    ticket_infos = Ticket.to_json_many(tickets, user_id=current_user.id)
 
     return jsonify({'result': ticket_infos}), 200
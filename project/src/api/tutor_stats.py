@@ -4,12 +4,102 @@ from flask import Blueprint, request, jsonify
 
 from ..utils.time import TimeUtil
 from ..utils.tutor_stats import TutoringSession
+from ..utils.ticket_statistics import get_total_rating, \
+    get_ticket_counts_by_grader, get_ticket_counts_by_student
 from ..models.ticket import Ticket
+from ..models.queue_rollup import QueueRollup
 from ..models.ticket_feedback import TicketFeedback, Rating
+from ..models.course import Course
+from ..models.enrolled_course import EnrolledCourse, Role
 
 
 tutor_stats_api_bp = Blueprint('tutor_stats_api', __name__)
 CORS(tutor_stats_api_bp, supports_credentials=True)
 
 
-# @tutor_stats_api_bp.route('get_on_duty_time')
+def user_is_staff(queue_id: int) -> bool:
+    """
+    Checking whether the user is an instructor or a grader of the course
+    that has this queue.
+    """
+    course = Course.get_course_by_queue_id(queue_id)
+    if not course:
+        return False
+    ec_entry = EnrolledCourse.find_user_in_course(user_id=current_user.id,
+                                                  course_id=course.id)
+    return ec_entry is not None and ec_entry.role != Role.STUDENT.value
+
+
+def stats_args():
+    """
+    Read the queue_id and the optional start / end (isoformat) arguments.
+    """
+    queue_id = request.args.get('queue_id', type=int)
+    start = request.args.get('start', type=str)
+    end = request.args.get('end', type=str)
+    try:
+        if start:
+            TimeUtil.convert_str_to_datetime(start)
+        if end:
+            TimeUtil.convert_str_to_datetime(end)
+    except (ValueError, OverflowError):
+        return queue_id, None, None, 'invalid time'
+    return queue_id, start or None, end or None, None
+
+
+def run_stats(func):
+    """
+    Answer a stats request with the result of func(queue_id, start, end).
+    """
+    queue_id, start, end, error = stats_args()
+    if not queue_id:
+        return jsonify({'reason': 'queue_id invalid'}), 400
+    if error:
+        return jsonify({'reason': error}), 400
+    if not user_is_staff(queue_id):
+        return jsonify({'reason': 'permission denied'}), 403
+    return jsonify({'reason': 'success',
+                    'result': func(queue_id, start, end)}), 200
+
+
+@tutor_stats_api_bp.route('/get_total_rating', methods=['GET'])
+@login_required
+def total_rating():
+    """
+    Get the number of good, neutral and bad ratings of a queue.
+    """
+    return run_stats(get_total_rating)
+
+
+@tutor_stats_api_bp.route('/get_ticket_counts_by_grader', methods=['GET'])
+@login_required
+def ticket_counts_by_grader():
+    """
+    Get the number of tickets resolved by each grader of a queue.
+    """
+    return run_stats(get_ticket_counts_by_grader)
+
+
+@tutor_stats_api_bp.route('/get_ticket_counts_by_student', methods=['GET'])
+@login_required
+def ticket_counts_by_student():
+    """
+    Get the number of tickets created by each student of a queue.
+    """
+    return run_stats(get_ticket_counts_by_student)
+
+
+@tutor_stats_api_bp.route('/get_queue_summary', methods=['GET'])
+@login_required
+def queue_summary():
+    """
+    Get the ticket counts, average wait and help time and ratings of a
+    queue, with the same per day (or per hour if hourly is given).
+    """
+    hourly = request.args.get('hourly', default=0, type=int)
+
+    def summary(queue_id, start, end):
+        return {'total': QueueRollup.summary(queue_id, start, end),
+                'buckets': QueueRollup.series(queue_id, start, end,
+                                              daily=not hourly)}
+    return run_stats(summary)
@@ -112,7 +112,8 @@ def reset_password():
             ' on the Autograder team IMMEDIATELY.\nPlease do not reply to' +\
             ' this email; replies are not checked.' +\
             '\n\nCheers,\nThe Autograder Team'
-        if MailUtil.get_instance().send(user.email, 'Password Reset', msg):
+        mailer = MailUtil.get_instance()
+        if mailer.send_async(user.email, 'Password Reset', msg):
             Logger.get_instance().custom_msg(f'Email sent to {user.email}',
                                              LogLevels.INFO)
             return jsonify({'reason': 'request OK'}), 200
@@ -140,7 +141,8 @@ def forgot_password():
         ' this email; replies are not checked.' +\
         f' Your temp password is {new_pass}; go change it ASAP!' +\
         '\n\nCheers,\nThe Autograder Team'
-    if MailUtil.get_instance().send(user.email, 'Forgot Password', msg):
+    mailer = MailUtil.get_instance()
+    if mailer.send_async(user.email, 'Forgot Password', msg):
         Logger.get_instance().custom_msg(f'Email sent to {user.email}',
                                          LogLevels.INFO)
         return jsonify({'reason': 'request OK'}), 200
@@ -185,7 +187,7 @@ def create_user():
         msg += '\n\nCheers,\nThe Autograder Team'
 
         subject = 'Created Autograder Account'
-        if MailUtil.get_instance().send(user.email, subject, msg):
+        if MailUtil.get_instance().send_async(user.email, subject, msg):
             Logger.get_instance().custom_msg(f'Email sent to {user.email}',
                                              LogLevels.INFO)
         else:
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
 from typing import List, Optional, Dict
 
 # import other models after they are merged
@@ -50,7 +51,7 @@ class Assignment(db.Model):
         Params: None\n
         Returns: None\n
         '''
-        db.session.commit()
+        UnitOfWork.commit()
 
     def to_json(self) -> Dict[str, str]:
         ret = {}
@@ -226,7 +227,7 @@ class Assignment(db.Model):
         assignment_list = Assignment.query.filter_by(course_id=course_id).all()
         for assignment in assignment_list:
             assignment.soft_delete()
-        db.session.commit()
+        UnitOfWork.commit()
 
     @staticmethod
     def restore_asn_for_course(cs_id: int, as_id: int) -> Optional[Assignment]:
@@ -248,4 +249,4 @@ class Assignment(db.Model):
         assignment_list = Assignment.query.filter_by(course_id=course_id).all()
         for assignment in assignment_list:
             assignment.restore()
-        db.session.commit()
+        UnitOfWork.commit()
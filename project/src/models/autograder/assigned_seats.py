@@ -4,6 +4,7 @@ from __future__ import annotations
 from typing import Dict, Tuple, Optional, List
 
 from ....setup import db
+from ...utils.unit_of_work import UnitOfWork
 
 
 class AssignedSeats(db.Model):
@@ -49,7 +50,7 @@ class AssignedSeats(db.Model):
         Params: None\n
         Returns: None
         '''
-        db.session.commit()
+        UnitOfWork.commit()
 
     def to_json(self) -> Dict[str, str]:
         '''
@@ -0,0 +1,152 @@
+# needed for annotating return types of the same object
+from __future__ import annotations
+
+from enum import Enum
+from typing import Dict, Optional, Tuple
+
+from ....setup import db
+from ...utils.unit_of_work import UnitOfWork
+from ...utils.time import TimeUtil
+
+
+class JobStatus(Enum):
+    """
+    The status of an email job with the following options --> database
+    value:\n
+    QUEUED --> 0 (the students are being looked up)\n
+    SENDING --> 1 (the emails are queued for sending)\n
+    DONE --> 2 (every email was sent or given up on)\n
+    FAILED --> 3 (the job could not start, e.g. invalid seat assignments)\n
+    """
+    QUEUED = 0
+    SENDING = 1
+    DONE = 2
+    FAILED = 3
+
+
+class EmailJob(db.Model):
+    """
+    Tracks the progress of emailing everyone in a seat assignment.\n
+    Fields:
+    id --> EmailJob ID. Unique, primary key\n
+    assignment_id --> The seat assignment the emails are about.\n
+    status --> The JobStatus of the job.\n
+    total --> Number of students in the assignment.\n
+    sent --> Number of emails sent so far.\n
+    failed --> Number of students who could not be emailed (not found,
+    or the email was rejected).\n
+    created_at --> When the job was started.\n
+    finished_at --> When the last email was sent or given up on.\n
+    """
+    __tablename__ = 'EmailJobs'
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    assignment_id = db.Column(db.Integer,
+                              db.ForeignKey('AssignedSeats.id'),
+                              nullable=False)
+    status = db.Column(db.Integer, nullable=False,
+                       default=JobStatus.QUEUED.value)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    sent = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=TimeUtil.get_current_db_time)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self) -> str:
+        return f'EmailJob {self.id} - assignment_id: {self.assignment_id}, ' \
+            f'sent: {self.sent}/{self.total}, failed: {self.failed}'
+
+    def save(self) -> None:
+        '''
+        Saves the current object in the DB.\n
+        Params: None\n
+        Returns: None
+        '''
+        # The mail threads read the job, don't wait for the request to end
+        UnitOfWork.commit(now=True)
+
+    def to_json(self) -> Dict:
+        '''
+        Function that returns the job in dictionary form. Used on the API
+        layer.\n
+        Params: none\n
+        Returns: Dictionary of the job info
+        '''
+        ret = {}
+        ret['id'] = self.id
+        ret['assignment_id'] = self.assignment_id
+        ret['status'] = JobStatus(self.status).name.lower()
+        ret['total'] = self.total
+        ret['queued'] = max(self.total - self.sent - self.failed, 0)
+        ret['sent'] = self.sent
+        ret['failed'] = self.failed
+        ret['created_at'] = self.created_at.isoformat()
+        ret['finished_at'] = self.finished_at.isoformat() \
+            if self.finished_at else None
+        return ret
+
+    def start(self, total: int, not_found: int) -> None:
+        '''
+        Record that the students were looked up and their emails queued.\n
+        Params: total - number of students in the assignment, not_found -
+        number of them without an account.\n
+        Returns: None
+        '''
+        self.total = total
+        self.status = JobStatus.SENDING.value
+        self.save()
+        EmailJob.record_results({self.id: (0, not_found)})
+
+    def fail(self) -> None:
+        '''
+        Record that the job could not be started.\n
+        Params: None\n
+        Returns: None
+        '''
+        self.status = JobStatus.FAILED.value
+        self.finished_at = TimeUtil.get_current_db_time()
+        self.save()
+
+    @staticmethod
+    def create_job(assignment_id: int) -> EmailJob:
+        '''
+        Function that creates a new, queued, email job.\n
+        Params: assignment_id - int\n
+        Returns: The new EmailJob
+        '''
+        job = EmailJob(assignment_id=assignment_id)
+        db.session.add(job)
+        job.save()
+        return job
+
+    @staticmethod
+    def find_by_id(job_id: int) -> Optional[EmailJob]:
+        '''
+        Function that retrieves an email job via the id.\n
+        Params: job_id - int\n
+        Returns: Optional[EmailJob]
+        '''
+        return EmailJob.query.filter_by(id=job_id).first()
+
+    @staticmethod
+    def record_results(counts: Dict[int, Tuple[int, int]]) -> None:
+        '''
+        Add to the sent and failed counts of jobs, with one UPDATE per job
+        so that the mail workers can do it concurrently, and mark the jobs
+        having nothing left to send as done.\n
+        Params: counts - maps a job id to the (sent, failed) to add.\n
+        Returns: None
+        '''
+        for job_id, (sent, failed) in counts.items():
+            EmailJob.query.filter_by(id=job_id).update(
+                {EmailJob.sent: EmailJob.sent + sent,
+                 EmailJob.failed: EmailJob.failed + failed},
+                synchronize_session=False)
+            EmailJob.query.filter(
+                EmailJob.id == job_id,
+                EmailJob.status == JobStatus.SENDING.value,
+                EmailJob.sent + EmailJob.failed >= EmailJob.total).update(
+                {EmailJob.status: JobStatus.DONE.value,
+                 EmailJob.finished_at: TimeUtil.get_current_db_time()},
+                synchronize_session=False)
+        UnitOfWork.commit()
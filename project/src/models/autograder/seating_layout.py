@@ -4,6 +4,7 @@ from __future__ import annotations
 from typing import Dict, Tuple, Optional, List
 
 from ....setup import db
+from ...utils.unit_of_work import UnitOfWork
 
 
 class SeatingLayout(db.Model):
@@ -35,7 +36,7 @@ class SeatingLayout(db.Model):
         Params: None\n
         Returns: None
         '''
-        db.session.commit()
+        UnitOfWork.commit()
 
     def to_json(self) -> Dict[str, str]:
         '''
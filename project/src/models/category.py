@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
 from typing import Dict
 from .models import course
 
@@ -33,7 +34,7 @@ class Category(db.Model):
         Params: None
         Returns: None
         """
-        db.session.commit()
+        UnitOfWork.commit()
 
     def soft_delete(self) -> Category:
         """
@@ -65,7 +66,7 @@ class Category(db.Model):
         cat = Category(name=cat_name, weight=percent, course_id=course,
                        is_deleted=False)
         db.session.add(cat)
-        db.session.commit()
+        UnitOfWork.commit()
 
     @staticmethod
     def delete_all_for_course(course: int) -> None:
@@ -77,7 +78,7 @@ class Category(db.Model):
         category_list = Category.query.filter_by(course_id=course).all()
         for category in category_list:
             category.soft_delete()
-        db.session.commit()
+        UnitOfWork.commit()
 
     @staticmethod
     def restore_all_for_course(course: int) -> None:
@@ -90,4 +91,4 @@ class Category(db.Model):
         category_list = Category.query.filter_by(course_id=course).all()
         for category in category_list:
             category.restore()
-        db.session.commit()
+        UnitOfWork.commit()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
 from typing import List, Tuple, Optional
 from .user import User
 from .enrolled_course import EnrolledCourse
@@ -52,7 +53,7 @@ class Checkoff(db.Model):
         Returns: None\n
         @author sravyabalasa
         '''
-        db.session.commit()
+        UnitOfWork.commit()
 
     def to_json(self):
         '''
@@ -215,7 +216,7 @@ class CheckoffEvaluation(db.Model):
         Returns: None\n
         @author sravyabalasa 
         '''
-        db.session.commit()
+        UnitOfWork.commit()
 
     def to_json(self):
         '''
@@ -1,6 +1,9 @@
 from __future__ import annotations
 from typing import Dict, List, Optional
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
+from ..utils.request_cache import RequestCache
+from ..utils.model_cache import ModelCache, cached
 from enum import Enum
 # TODO: In the future, use Mihai's security stuffs.
 # from ..security.roles import CRole
@@ -94,7 +97,9 @@ class Course(db.Model):
         """
         Save the object in the database.
         """
-        db.session.commit()
+        UnitOfWork.commit()
+        ModelCache.get_instance().invalidate('course_by_queue',
+                                             'queue_id_by_course')
 
     def __repr__(self) -> str:
         """
@@ -148,6 +153,8 @@ class Course(db.Model):
         return Course.query.filter_by(id=course_id).first()
 
     @staticmethod
+    @RequestCache.memoize
+    @cached('course_by_queue')
     def get_course_by_queue_id(q_id) -> Optional[Course]:
         """
         Returns a Course from a queue id
@@ -155,6 +162,7 @@ class Course(db.Model):
         return Course.query.filter_by(queue_id=q_id).first()
 
     @staticmethod
+    @cached('queue_id_by_course')
     def get_queue_id_by_id(course_id) -> Optional[int]:
         """
         Returns a queue_id from a course id
@@ -1,6 +1,8 @@
 from __future__ import annotations
 from enum import Enum
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
+from ..utils.request_cache import RequestCache
 from typing import List, Dict, Tuple
 from .course import Course
 from .user import User
@@ -181,7 +183,7 @@ class EnrolledCourse(db.Model):
         """
         Update the object to the database.\n
         """
-        db.session.commit()
+        UnitOfWork.commit()
 
     @staticmethod
     def get_ec_by_id(ec_id: int) -> EnrolledCourse:
@@ -200,7 +202,7 @@ class EnrolledCourse(db.Model):
         Whether the user is added.
         """
         db.session.add(enrolled_user)
-        db.session.commit()
+        UnitOfWork.commit()
         return True
 
     @staticmethod
@@ -233,6 +235,7 @@ class EnrolledCourse(db.Model):
         return EnrolledCourse.enroll_user(enroll_student)
 
     @staticmethod
+    @RequestCache.memoize
     def find_user_in_course(user_id: int,
                             course_id: int) -> EnrolledCourse:
         """
@@ -294,6 +297,23 @@ class EnrolledCourse(db.Model):
                 filter(EnrolledCourse.role.in_(role)).all().\
                 order_by(EnrolledCourse.id.desc()).all()
 
+    @staticmethod
+    def count_tutors_on_duty(course_id: int) -> int:
+        """
+        Get the number of staff of a course who are logged in to its queue,
+        helping a student or not.\n
+        Inputs:\n
+        course_id --> The id of the course to look for.\n
+        Returns:\n
+        The number of staff with an ACTIVE or BUSY status.\n
+        """
+        roles = [Role.ADMIN.value, Role.INSTRUCTOR.value, Role.GRADER.value]
+        return EnrolledCourse.query.\
+            filter_by(course_id=course_id).\
+            filter(EnrolledCourse.status.in_([Status.ACTIVE.value,
+                                              Status.BUSY.value])).\
+            filter(EnrolledCourse.role.in_(roles)).count()
+
     @staticmethod
     def find_active_tutor_for(queue_id: int) -> Tuple[bool, str, List[User]]:
         """
@@ -335,7 +355,7 @@ class EnrolledCourse(db.Model):
                                                            course_id=course_id)
         if enrolled_user:
             db.session.delete(enrolled_user)
-            db.session.commit()
+            UnitOfWork.commit()
             return True
         else:
             return False
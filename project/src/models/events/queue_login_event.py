@@ -5,6 +5,7 @@ from enum import Enum
 from ...utils.time import TimeUtil
 
 from ....setup import db
+from ...utils.unit_of_work import UnitOfWork
 from ..user import User
 # from ..queue import Queue
 
@@ -44,6 +45,11 @@ class QueueLoginEvent(db.Model):
     @author YixuanZhou
     """
     __tablename__ = 'QueueLoginEvent'
+    # Keep in sync with data/autograder.sql.
+    __table_args__ = (
+        db.Index('idx_queueloginevent_queue_grader_timestamp',
+                 'queue_id', 'grader_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     event_type = db.Column(db.Integer, nullable=False)
     action_type = db.Column(db.Integer, nullable=False)
@@ -82,30 +88,34 @@ class QueueLoginEvent(db.Model):
         """
         return self.action_type == ActionType.AUTOMATIC
 
-    def find_event_in_range(self, queue_id: int, start: str,
-                            end: str = TimeUtil.get_current_time(),
-                            grader: User = None):
+    @staticmethod
+    def find_event_in_range(queue_id: int, start: str, end: str = None,
+                            grader: User = None) -> List[QueueLoginEvent]:
         """
         Get all the queue login events for a queue in a given range.\n
         Inputs:\n
-        queue --> The queue object to look for.\n
-        start --> The datetime object of the time to start looking for\n
-        end --> The datetime objec tof the time to end looking for
-        (default = now).\n
+        queue_id --> The id of the queue to look for.\n
+        start --> The time to start looking for (str or datetime).\n
+        end --> The time to end looking for (default = now).\n
         grader --> The grader to serch for (Optional if wanted).\n
         Returns:\n
         A list of the queue login event objects that is associsated with the
-        given queue for a given range of time.\n
+        given queue for a given range of time, oldest first.\n
         """
-        if (grader is not None):
-            event_list = QueueLoginEvent.query().filter_by(queue_id=queue_id)\
-                        .order_by(QueueLoginEvent.timestamp).desc.all()
-        else:
-            event_list = QueueLoginEvent.query()\
-                         .filter_by(queue_id=queue_id,
-                                    grader_id=grader.id)\
-                         .order_by(QueueLoginEvent.timestamp).desc.all()
-        return list(filter(lambda x: start <= x.closed_at <= end, event_list))
+        if end is None:
+            end = TimeUtil.get_current_time()
+        if isinstance(start, str):
+            start = TimeUtil.convert_str_to_datetime(start)
+        if isinstance(end, str):
+            end = TimeUtil.convert_str_to_datetime(end)
+
+        query = QueueLoginEvent.query.filter_by(queue_id=queue_id)
+        if grader is not None:
+            query = query.filter_by(grader_id=grader.id)
+        return query.filter(
+            QueueLoginEvent.timestamp >= TimeUtil.to_db_time(start),
+            QueueLoginEvent.timestamp <= TimeUtil.to_db_time(end)).\
+            order_by(QueueLoginEvent.timestamp).all()
 
     # Static add method
     @staticmethod
@@ -119,7 +129,7 @@ class QueueLoginEvent(db.Model):
         qle --> the QueueLoginEvent object created.\n
         """
         db.session.add(self)
-        db.session.commit()
+        UnitOfWork.commit()
 
     @staticmethod
     def find_login_time_for_user(grader: User) -> List[QueueLoginEvent]:
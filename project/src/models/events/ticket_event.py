@@ -1,8 +1,12 @@
 from __future__ import annotations
 
 from ....setup import db
+from ...utils.unit_of_work import UnitOfWork
+from datetime import datetime
 from enum import Enum
+from typing import Optional
 from ...utils.time import TimeUtil
+from ...utils.queue_notifier import QueueNotifier
 from ..enrolled_course import EnrolledCourse, Role
 from ..course import Course
 
@@ -42,6 +46,10 @@ class TicketEvent(db.Model):
     @authour: YixuanZ
     """
     __tablename__ = 'TicketEvent'
+    # Keep in sync with data/autograder.sql.
+    __table_args__ = (
+        db.Index('idx_ticketevent_ticket_timestamp', 'ticket_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     # need to change a name in db, since type is a presereved word in python
     event_type = db.Column(db.Integer, nullable=False)
@@ -128,28 +136,52 @@ class TicketEvent(db.Model):
         ret['timestamp'] = self.timestamp
         return ret
 
+    def to_delta(self) -> dict:
+        """
+        Return the small dict pushed to the queue stream for this event. The
+        message is left out of private events.
+        """
+        ret = {}
+        ret['id'] = self.id
+        ret['event_type'] = EventType(self.event_type).name
+        ret['ticket_id'] = self.ticket_id
+        ret['timestamp'] = self.timestamp
+        if not self.is_private:
+            ret['message'] = self.message
+        return ret
+
     def reveal_user(self, user_id: int, course_id: int) -> bool:
         """
         Determine whether this event can be revealed to a user.\n
         Inputs:\n
         user --> The user object to be determined.\n
-        course --> The course of this user & of this ticket is in.\b
+        course --> The course of this user & of this ticket is in.\n
         Return:\n
         bool value of whether this can be viewed by this user.\n
         """
+        if not self.is_private:
+            return True
         ec = EnrolledCourse.find_user_in_course(user_id=user_id,
                                                 course_id=course_id)
-        origin_event = TicketEvent.query.filter_by(id=self.id).\
-            order_by(TicketEvent.timestamp.desc()).first()
+        return self.can_reveal_to(ec)
 
+    def can_reveal_to(self, ec: Optional[EnrolledCourse]) -> bool:
+        """
+        Same as reveal_user, for a viewer whose enrollment has already been
+        looked up. Private events are only shown to the staff of the course
+        and to the user who made them.\n
+        Inputs:\n
+        ec --> The EnrolledCourse of the viewer, None if not enrolled.\n
+        Return:\n
+        bool value of whether this can be viewed by this user.\n
+        """
         if not self.is_private:
             return True
-        elif ec.role > Role.STUDENT.value:
-            return True
-        elif origin_event.ec_user_id == ec:
-            return True
-        else:
+        if ec is None:
             return False
+        if ec.role != Role.STUDENT.value:
+            return True
+        return self.ec_user_id == ec.id
 
     def add_to_db(self):
         """
@@ -158,7 +190,7 @@ class TicketEvent(db.Model):
         ticket --> the ticket object created.\n
         """
         db.session.add(self)
-        db.session.commit()
+        UnitOfWork.commit()
 
     # Static add method
     @staticmethod
@@ -177,12 +209,44 @@ class TicketEvent(db.Model):
         ec = EnrolledCourse.find_user_in_course(user_id=user_id,
                                                 course_id=cid).id
 
+        evt = TicketEvent.stage_event(event_type=event_type,
+                                      ticket_id=ticket_id, message=message,
+                                      is_private=is_private, ec_user_id=ec)
+        UnitOfWork.commit()
+        TicketEvent.notify(queue_id)
+        return evt
+
+    @staticmethod
+    def stage_event(event_type: EventType, ticket_id: int,
+                    message: str, is_private: bool, ec_user_id: int,
+                    timestamp: Optional[datetime] = None) -> TicketEvent:
+        """
+        Add a ticket event to the session without committing, so it is
+        written in the same transaction as the change it records. Commit
+        and then call notify, like create_event does.\n
+        Inputs:\n
+        event_type --> The type of this event.\n
+        ticket_id --> The id of the ticket the event is to.\n
+        message --> The message of this event.\n
+        is_private --> Whether this event is private.\n
+        ec_user_id --> The EC id of the user creating this event.\n
+        timestamp --> The time of this event, now by default.\n
+        """
         evt = TicketEvent(event_type=event_type.value, ticket_id=ticket_id,
                           message=message, is_private=is_private,
-                          ec_user_id=ec, timestamp=TimeUtil.get_current_time())
-        evt.add_to_db()
+                          ec_user_id=ec_user_id,
+                          timestamp=timestamp or TimeUtil.get_current_time())
+        db.session.add(evt)
         return evt
 
+    @staticmethod
+    def notify(queue_id: int) -> None:
+        """
+        Wake up the streams of a queue once the events staged so far are
+        committed.\n
+        """
+        UnitOfWork.on_commit(QueueNotifier.get_instance().notify, queue_id)
+
     @staticmethod
     def get_events_for_tickets(user_id: int, course_id: int,
                                ticket_id: int) -> dict:
@@ -195,14 +259,12 @@ class TicketEvent(db.Model):
         Results:\n
         A dict of ticket events.
         """
+        ec = EnrolledCourse.find_user_in_course(user_id=user_id,
+                                                course_id=course_id)
         event_list = TicketEvent.query.filter_by(ticket_id=ticket_id).\
             order_by(TicketEvent.timestamp.desc()).all()
-        ret = []
-        for event in event_list:
-            if not event.reveal_user(user_id=user_id, course_id=course_id):
-                continue
-            ret.append(event.to_json())
-        return ret
+        return [event.to_json() for event in event_list
+                if event.can_reveal_to(ec)]
 
     @staticmethod
     def get_all_ticket_events():
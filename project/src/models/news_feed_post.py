@@ -2,6 +2,7 @@ from __future__ import annotations
 from ..utils.time import TimeUtil
 
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
 from ..models.user import User
 
 
@@ -50,7 +51,7 @@ class NewsFeedPost(db.Model):
         """
         Save the object into database.
         """
-        db.session.commit()
+        UnitOfWork.commit()
 
     def archive(self):
         """
@@ -105,4 +106,4 @@ class NewsFeedPost(db.Model):
         nfp --> the NewsFeedPost object created.\n
         """
         db.session.add(nfp)
-        db.session.commit()
+        UnitOfWork.commit()
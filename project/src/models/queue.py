@@ -1,16 +1,25 @@
 from __future__ import annotations
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from enum import Enum
 from datetime import timedelta
-from ..utils.time import TimeUtil
+from ..utils.queue_notifier import QueueNotifier
+from ..utils.model_cache import ModelCache, cached
+from ..utils.wait_estimator import WaitTimeEstimator, WaitEstimate, \
+    HISTORY_SIZE
+from ..utils.pending_index import PendingTicketIndex
+from ..utils.dispatch_policy import DispatchPolicy, FifoPolicy, \
+    PriorityPolicy, AgingPolicy, LocalityPolicy
 
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
+from ..utils.time import TimeUtil
 
 from .user import User
 from .course import Course
 from .ticket import Ticket, TicketTag, HelpType
 from .ticket import Status as t_status
 from .ticket_feedback import TicketFeedback
+from .queue_rollup import QueueRollup
 from .events.ticket_event import TicketEvent, EventType
 from .events.queue_login_event import QueueLoginEvent, ActionType, EType
 
@@ -26,6 +35,27 @@ Define Constant
 DEFAULT_WAIT_TIME = '0:12:00'  # 12min
 MIN_WAIT_TIME = '0:05:00'  # 5min
 
+# Weights of the help types and tags for the priority based policies.
+HELP_TYPE_WEIGHTS = {HelpType.CHECKOFF.value: 2}
+TAG_WEIGHTS = {TicketTag.GETTING_STARTED.value: 1,
+               TicketTag.COMPILE_ERROR.value: 1}
+
+# The policies next_ticket can hand out tickets with, by name.
+DISPATCH_POLICIES: Dict[str, DispatchPolicy] = {
+    policy.name: policy for policy in (
+        FifoPolicy(),
+        PriorityPolicy(HELP_TYPE_WEIGHTS, TAG_WEIGHTS),
+        AgingPolicy(HELP_TYPE_WEIGHTS, TAG_WEIGHTS,
+                    unit=timedelta(minutes=2),
+                    max_head_start=timedelta(minutes=10)),
+        LocalityPolicy(max_skip=timedelta(minutes=10)),
+    )}
+DEFAULT_DISPATCH_POLICY = FifoPolicy.name
+
+# Number of times next_ticket tries again when another grader took the
+# ticket it picked first.
+NEXT_TICKET_RETRIES = 5
+
 
 class Status(Enum):
     """
@@ -92,7 +122,8 @@ class Queue(db.Model):
         """
         Save the object that is modified into the database.\n
         """
-        db.session.commit()
+        UnitOfWork.commit()
+        ModelCache.get_instance().invalidate('queue')
 
     def update_ticket(self, student: User, title: str,
                       description: str, room: str,
@@ -165,6 +196,7 @@ class Queue(db.Model):
         """
         self.status = Status.OPEN.value
         self.save()
+        UnitOfWork.on_commit(QueueNotifier.get_instance().notify, self.id)
 
     def lock(self) -> None:
         """
@@ -172,6 +204,7 @@ class Queue(db.Model):
         """
         self.status = Status.LOCKED.value
         self.save()
+        UnitOfWork.on_commit(QueueNotifier.get_instance().notify, self.id)
 
     def close(self) -> None:
         """
@@ -179,6 +212,7 @@ class Queue(db.Model):
         """
         self.status = Status.CLOSED.value
         self.save()
+        UnitOfWork.on_commit(QueueNotifier.get_instance().notify, self.id)
 
     def clear_ticket(self) -> None:
         """
@@ -261,46 +295,81 @@ class Queue(db.Model):
 
     def is_at_high_capacity(self) -> bool:
         """
-        Check if the queue is at high capacity.\n
+        Check if the queue is at high capacity. The threshold is a number of
+        tickets: the queue is at high capacity once the pessimistic (upper
+        bound) wait of a new ticket is longer than what it takes to go
+        through that many tickets of average length.\n
         Return:\n
         bool value indicates queue is at high capacity or not.\n
         """
-        threshold = self.high_capacity_threshold
-        return self.high_capacity_enabled and\
-            len(self.get_unresolved_tickets(self)) > threshold
+        if not self.high_capacity_enable:
+            return False
+        full = WaitTimeEstimator.get_instance().estimate(
+            self.id, self.high_capacity_threshold, Queue.load_wait_stats)
+        return self.get_queue_wait_estimate().high > full.expected
 
-    def get_closed_ticktes_history(self, page_num: int = 0,
-                                   num_per_page: int = 10) -> List[Ticket]:
+    def get_closed_ticktes_history(self, cursor: str = None,
+                                   num_per_page: int = 10) \
+            -> Tuple[List[Ticket], Optional[str]]:
         """
-        Get the closed tickte history of page.\n
+        Get a page of the closed ticket history, latest first.\n
         Inputs:\n
-        page_num --> The page to start looking at, default 0.\n
+        cursor --> The cursor returned with the previous page, default None
+        for the first one.\n
         num_per_page --> The number of entries to list per page, default 10.\n
         Returns:\n
-        List of closed tickets history.\n
+        List of closed tickets history, and the cursor of the next page.\n
         """
-        offset = page_num * num_per_page
-        return Ticket.find_ticket_history_with_offset(queue=self,
-                                                      offset=offset,
-                                                      limit=num_per_page)
+        return Ticket.find_ticket_history(self.id, limit=num_per_page,
+                                          cursor=cursor)
 
-    def get_closed_ticket_history_for(self, student: User, page_num: int = 0,
+    def get_closed_ticket_history_for(self, student: User,
+                                      cursor: str = None,
                                       num_per_page: int = 10) \
-            -> List[Ticket]:
+            -> Tuple[List[Ticket], Optional[str]]:
         """
-        Get the closed tickte history of page for a student.\n
+        Get a page of the closed ticket history for a student.\n
         Inputs:\n
         student --> The User object for the student.\n
-        page_num --> The page to start looking at, default 0.\n
+        cursor --> The cursor returned with the previous page, default None
+        for the first one.\n
         num_per_page --> The number of entries to list per page, default 10.\n
         Returns:\n
-        List of closed tickets history for a student.\n
-        """
-        offset = page_num * num_per_page
-        return Ticket.find_ticket_history_with_offset(queue=self,
-                                                      offset=offset,
-                                                      limit=num_per_page,
-                                                      student=student)
+        List of closed tickets history for a student, and the cursor of the
+        next page.\n
+        """
+        ec = EnrolledCourse.find_user_in_course(
+            user_id=student.id,
+            course_id=Course.get_course_by_queue_id(self.id).id)
+        if not ec:
+            return [], None
+        return Ticket.find_ticket_history(self.id, limit=num_per_page,
+                                          cursor=cursor,
+                                          ec_student_id=ec.id)
+
+    def get_closed_ticket_history_by(self, grader: User,
+                                     cursor: str = None,
+                                     num_per_page: int = 10) \
+            -> Tuple[List[Ticket], Optional[str]]:
+        """
+        Get a page of the closed ticket history handled by a grader.\n
+        Inputs:\n
+        grader --> The User object for the grader.\n
+        cursor --> The cursor returned with the previous page, default None
+        for the first one.\n
+        num_per_page --> The number of entries to list per page, default 10.\n
+        Returns:\n
+        List of closed tickets history of the grader, and the cursor of the
+        next page.\n
+        """
+        ec = EnrolledCourse.find_user_in_course(
+            user_id=grader.id,
+            course_id=Course.get_course_by_queue_id(self.id).id)
+        if not ec:
+            return [], None
+        return Ticket.find_ticket_history(self.id, limit=num_per_page,
+                                          cursor=cursor,
+                                          ec_grader_id=ec.id)
 
     def get_pending_ticket_for(self, student: User) -> Optional[Ticket]:
         """
@@ -311,8 +380,9 @@ class Queue(db.Model):
         Returns:\n
         The pending ticket of the student on this queue.\n
         """
-        return Ticket.find_all_tickets_by_student(queue=self, student=student,
-                                                  status=[t_status.PENDING])[0]
+        tickets = Ticket.find_all_tickets_by_student(
+            self.id, student.id, [t_status.PENDING.value])
+        return tickets[0] if tickets else None
 
     def get_accepted_ticket_for(self, student: User) -> Optional[Ticket]:
         """
@@ -469,8 +539,9 @@ class Queue(db.Model):
         Get the average help time within a time period for tickes in
         the queue.\n
         Inputs:\n
-        day --> To look for a day, default would be true.\n
-        hour --> To look for the recent hour, default would be false.\n
+        day --> To look for the recent day, default would be true.\n
+        hour --> To look for the recent hour, default would be false. hour
+                 has priority over day. With neither, all time is used.\n
         start --> The start time to look for. The default would be None.
                   If start is provided, it has priority among hour and day.\n
         end --> The end time to look for. The default would be None.
@@ -479,44 +550,37 @@ class Queue(db.Model):
         A timedelta object representing the averge help time for the tickes
         given that period.\n
         """
-        if not start:
-            day = False
-            hour = False
-        tickets = Ticket.find_resolved_tickets_in(self, day=day,
-                                                  hour=hour,
-                                                  start=start, end=end)
-        if len(tickets) < 5:
+        if start is None:
+            end = None
+            if hour:
+                start = TimeUtil.get_time_before(hours=1)
+            elif day:
+                start = TimeUtil.get_time_before(hours=24)
+        # Read from the rollups, the hour or day the range starts in counts
+        # as a whole.
+        stats = QueueRollup.summary(self.id, start, end)
+        if stats['resolved'] < 5:
             return MIN_WAIT_TIME
-        average_resolved_time = Ticket.average_resolved_time(tickets)
-        return timedelta(seconds=average_resolved_time)
+        return timedelta(seconds=stats['average_help_seconds'])
 
-    # getExpectedTimeUntilAvailableTutor need a query method probably in
-    # enrolled classs...
-    def wait_time_for_next_tutor(self) -> timedelta:
+    def get_wait_estimate(self, student: User) -> Optional[WaitEstimate]:
         """
-        Get the expected wait time for the next tutor to be avaliable
+        Get the expected wait time for a student, with its confidence
+        interval.\n
+        Inputs:\n
+        The student User object.\n
         Returns:\n
-        The timedelta object for the expected time for the next tutor to be
-        avaliale.
-        """
-        ave_resolve_time = self.average_help_time(hour=True)
-        # pending_num = self.get_pending_tickets()
-        status, reason, active_tutors \
-            = EnrolledCourse.find_active_tutor_for(self.id)
-        active_tutor_num = len(active_tutors)
-        # Use enrolled course methods to find the num of active tutor.
-        accepted_tickets = self.get_accepted_tickets()
-        next_avaliable = timedelta(seconds=0)
-        if active_tutor_num > len(accepted_tickets):
-            return next_avaliable
-        now = TimeUtil.get_current_time()
-        # Simplifing the algorithm for now (without using utils)
-        for ticket in accepted_tickets:
-            current_help_time = now - ticket.accepted_at
-            potential_time_need = ave_resolve_time - current_help_time
-            next_avaliable = max(next_avaliable, potential_time_need)
-
-        return next_avaliable
+        The estimated wait for this student's ticket to be accepted.
+        If this student has no pending tickect in the queue, return None.\n
+        """
+        student_ticket = self.get_pending_ticket_for(student=student)
+        if student_ticket is None:
+            return None
+        position = student_ticket.get_position()
+        if position is None:
+            return None
+        return WaitTimeEstimator.get_instance().estimate(
+            self.id, position, Queue.load_wait_stats)
 
     def get_wait_time(self, student: User) -> Optional[timedelta]:
         """
@@ -527,17 +591,19 @@ class Queue(db.Model):
         The expected wait time for this student's ticket to be accepted.
         If this student has no tickect in the queue, return None.\n
         """
-        student_ticket = self.get_pending_ticket_for(student=student)
-        if student_ticket is None:
-            return None
-        # Get the number of tickets before this student's
-        position = student_ticket.get_position()
-        wait_time = timedelta(seconds=0)
-        next_avaliable = self.wait_time_for_next_tutor()
-        ave_help_time = self.average_help_time()
-        wait_time = position * ave_help_time + next_avaliable
+        estimate = self.get_wait_estimate(student)
+        return estimate.expected if estimate else None
 
-        return wait_time
+    def get_queue_wait_estimate(self) -> WaitEstimate:
+        """
+        Estimate the wait time of a ticket submited now, with its confidence
+        interval.\n
+        Return:\n
+        The estimated wait for a ticket that is submited now.\n
+        """
+        position = Ticket.count_pending(self.id) + 1
+        return WaitTimeEstimator.get_instance().estimate(
+            self.id, position, Queue.load_wait_stats)
 
     def get_queue_wait_time(self) -> timedelta:
         """
@@ -546,10 +612,18 @@ class Queue(db.Model):
         Return:\n
         The expected wait time for a ticket that is submited now.\n
         """
-        pending_num = len(self.get_pending_tickets())
-        ave_time = self.average_help_time()
+        return self.get_queue_wait_estimate().expected
 
-        return pending_num * ave_time
+    @staticmethod
+    def load_wait_stats(queue_id: int) -> Tuple[List[float], int]:
+        """
+        Load what the WaitTimeEstimator is seeded with: the latest help
+        times of the queue and its number of tutors on duty.\n
+        """
+        course = Course.get_course_by_queue_id(queue_id)
+        tutors = EnrolledCourse.count_tutors_on_duty(course.id) \
+            if course else 0
+        return Ticket.find_recent_help_times(queue_id, HISTORY_SIZE), tutors
 
     # Static add method
     @staticmethod
@@ -560,7 +634,7 @@ class Queue(db.Model):
         queue --> the queue object created.\n
         """
         db.session.add(queue)
-        db.session.commit()
+        UnitOfWork.commit()
 
     @staticmethod
     def update_queue_setting(queue_id: int,
@@ -607,6 +681,7 @@ class Queue(db.Model):
         return queue
 
     @staticmethod
+    @cached('queue')
     def get_queue_by_id(queue_id: int) -> Optional(Queue):
         """
         Find the queue by the queue_id.\n
@@ -644,8 +719,11 @@ class Queue(db.Model):
         grader.change_status(EStatus.ACTIVE)
         event = QueueLoginEvent.create_login_event(event_type=EType.LOGIN,
                                                    action_type=action_type,
-                                                   grader_id=grader_id,
+                                                   grader_id=grader.id,
                                                    queue_id=queue_id)
+        UnitOfWork.on_commit(
+            WaitTimeEstimator.get_instance().set_tutors, queue_id,
+            EnrolledCourse.count_tutors_on_duty(course.id))
         queue.open()
         return True, 'Success'
 
@@ -678,6 +756,9 @@ class Queue(db.Model):
                                                    grader_id=grader.id,
                                                    queue_id=queue.id
                                                    )
+        UnitOfWork.on_commit(
+            WaitTimeEstimator.get_instance().set_tutors, queue_id,
+            EnrolledCourse.count_tutors_on_duty(course.id))
         s, r, grader = EnrolledCourse.find_active_tutor_for(queue.id)
         if len(grader) == 0:
             queue.lock()
@@ -693,19 +774,58 @@ class Queue(db.Model):
         ticket_id --> The id of the ticket to be accepted.\n
         grader_id --> The id of the grader to accept the ticket.\n
         Return:\n
-        Whether the operation successed or not.
+        Whether the operation successed or not, and why.
         """
-        course_id = Course.get_course_by_queue_id(queue_id=queue_id)
+        t = Ticket.get_ticket_by_id(ticket_id)
+        if not t or t.queue_id != queue_id:
+            return (False, 'Ticket not found')
+        course = Course.get_course_by_queue_id(queue_id)
         e_grader = EnrolledCourse.find_user_in_course(user_id=grader_id,
-                                                      course_id=course_id)
-        if e_grader.get_role() not in [ERole.INSTRUCTOR, ERole.GRADER]:
+                                                      course_id=course.id) \
+            if course else None
+        if not e_grader or e_grader.get_role() not in \
+                [ERole.INSTRUCTOR.value, ERole.GRADER.value]:
             return (False, 'You cant take the ticket')
-        if e_grader.get_status() != EStatus.ACTIVE:
+        if e_grader.get_status() != EStatus.ACTIVE.value:
             return (False, 'The user is currently busy')
-        t = Ticket.get_ticket_by_id(ticket_id)
-        t.mark_accepted_by(e_grader.id)
-        e_grader.change_status(EStatus.BUSY)
-        return (True, 'Ticket Accepted')
+        return Ticket.accept_ticket(ticket_id, grader_id)
+
+    @staticmethod
+    def next_ticket(queue_id: int, grader_id: int,
+                    policy: str = DEFAULT_DISPATCH_POLICY,
+                    room: str = None) -> Tuple[bool, str, Optional[Ticket]]:
+        """
+        Accept the pending ticket a dispatch policy picks for a grader.
+        The ticket is picked from the PendingTicketIndex in O(log n) and
+        accepted with Ticket.accept_ticket, if another grader got to it
+        first the next pick is tried.\n
+        Inputs:\n
+        queue_id --> The id of the queue to take a ticket from.\n
+        grader_id --> The id of the grader taking the ticket.\n
+        policy --> The name of a policy in DISPATCH_POLICIES.\n
+        room --> The room of the grader, used by the locality policy.\n
+        Return:\n
+        Whether a ticket was accepted, why not if it wasn't, and the
+        ticket.\n
+        """
+        dispatch = DISPATCH_POLICIES.get(policy)
+        if dispatch is None:
+            return False, 'Unknown policy', None
+
+        index = PendingTicketIndex.get_instance()
+        for _ in range(NEXT_TICKET_RETRIES):
+            ticket_id = index.peek(queue_id, dispatch,
+                                   Ticket.find_pending_entries, room)
+            if ticket_id is None:
+                return False, 'No pending ticket', None
+            success, reason = Ticket.accept_ticket(ticket_id, grader_id)
+            if success:
+                return True, reason, Ticket.get_ticket_by_id(ticket_id)
+            if reason != 'Ticket is no longer pending':
+                return False, reason, None
+            # Taken by another worker, this copy of the index is stale.
+            index.remove(queue_id, ticket_id)
+        return False, 'Queue is busy, try again', None
 
     @staticmethod
     def resolve_ticket(queue_id: int, ticket_id: int,
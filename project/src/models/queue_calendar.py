@@ -3,6 +3,7 @@ from __future__ import annotations
 from typing import List, Dict
 
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
 
 
 class QueueCalendar(db.Model):
@@ -39,7 +40,7 @@ class QueueCalendar(db.Model):
         """
         Save the object in the database.
         """
-        db.session.commit()
+        UnitOfWork.commit()
 
     def to_json(self) -> Dict[QueueCalendar]:
         """
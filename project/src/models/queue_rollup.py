@@ -0,0 +1,344 @@
+from __future__ import annotations
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import click
+from sqlalchemy import event, func
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import Session
+
+from ..utils.time import TimeUtil
+
+from ...setup import app, db
+from .ticket import Ticket
+from .ticket_feedback import TicketFeedback, Rating
+from .events.ticket_event import TicketEvent, EventType
+
+# The counters of a bucket, summed up by the readers.
+COUNTERS = ('created', 'accepted', 'resolved', 'canceled', 'wait_seconds',
+            'help_seconds', 'rating_bad', 'rating_neutral', 'rating_good')
+
+# The counter each rating goes to.
+RATING_COUNTERS = {Rating.BAD.value: 'rating_bad',
+                   Rating.NEUTRAL.value: 'rating_neutral',
+                   Rating.GOOD.value: 'rating_good'}
+
+# The counters holding a number of seconds, the others count things.
+SECONDS_COUNTERS = ('wait_seconds', 'help_seconds')
+
+# Number of tickets backfill_rollups reads in one go.
+BACKFILL_BATCH_SIZE = 1000
+
+# (queue_id, created_at, accepted_at) of a ticket
+TicketTimes = Tuple[int, datetime, Optional[datetime]]
+
+
+class RollupColumns(object):
+    """
+    The columns shared by the rollup tables: the queue, the start of the
+    bucket (PST wall time, like the timestamps it sums up) and the counters.
+    """
+    @declared_attr
+    def queue_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('Queue.id'),
+                         primary_key=True, nullable=False)
+
+    bucket_start = db.Column(db.DateTime, primary_key=True, nullable=False)
+    created = db.Column(db.Integer, nullable=False, default=0)
+    accepted = db.Column(db.Integer, nullable=False, default=0)
+    resolved = db.Column(db.Integer, nullable=False, default=0)
+    canceled = db.Column(db.Integer, nullable=False, default=0)
+    wait_seconds = db.Column(db.Float, nullable=False, default=0)
+    help_seconds = db.Column(db.Float, nullable=False, default=0)
+    rating_bad = db.Column(db.Integer, nullable=False, default=0)
+    rating_neutral = db.Column(db.Integer, nullable=False, default=0)
+    rating_good = db.Column(db.Integer, nullable=False, default=0)
+
+
+class QueueHourlyRollup(RollupColumns, db.Model):
+    """
+    Ticket counts, wait / help time and ratings of a queue, per hour.\n
+    Fields:\n
+    queue_id --> The id of the queue.\n
+    bucket_start --> The start of the hour.\n
+    created, accepted, resolved, canceled --> The number of ticket events
+                                               of each type.\n
+    wait_seconds --> Sum of the time from creation to each acceptance.\n
+    help_seconds --> Sum of the time from acceptance to each resolution.\n
+    rating_bad, rating_neutral, rating_good --> Feedbacks submitted.\n
+    """
+    __tablename__ = 'QueueHourlyRollup'
+
+    @staticmethod
+    def truncate(time: datetime) -> datetime:
+        """
+        Get the start of the hour a time falls in.\n
+        """
+        return time.replace(minute=0, second=0, microsecond=0)
+
+
+class QueueDailyRollup(RollupColumns, db.Model):
+    """
+    The same as QueueHourlyRollup, per day.\n
+    """
+    __tablename__ = 'QueueDailyRollup'
+
+    @staticmethod
+    def truncate(time: datetime) -> datetime:
+        """
+        Get the start of the day a time falls in.\n
+        """
+        return time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+ROLLUPS = (QueueHourlyRollup, QueueDailyRollup)
+
+
+class QueueRollup(object):
+    """
+    Keeps the rollup tables up to date and reads them.\n
+    Every flush writing TicketEvents or TicketFeedbacks adds them to the
+    buckets they fall in, in the same transaction, with an upsert. The
+    dashboards and averages then sum a few buckets instead of going through
+    the tickets. Use the backfill_rollups command to build the buckets of
+    the history from before the rollups existed.
+    """
+
+    @staticmethod
+    def summary(queue_id: int, start: Union[datetime, str] = None,
+                end: Union[datetime, str] = None) -> Dict[str, float]:
+        """
+        Sum the buckets of a queue over a range of time. Ranges starting
+        and ending on midnight are read from the daily buckets.\n
+        Inputs:\n
+        queue_id --> The id of the queue.\n
+        start --> The start of the range, optional.\n
+        end --> The end of the range (excluded), optional.\n
+        Return:\n
+        The totals of every counter, with the average wait and help time
+        in seconds (None without any ticket).\n
+        """
+        model, query = QueueRollup._query(queue_id, start, end)
+        sums = query.with_entities(
+            *[func.coalesce(func.sum(getattr(model, name)), 0)
+              for name in COUNTERS]).one()
+        ret = dict(zip(COUNTERS, sums))
+        ret['average_wait_seconds'] = \
+            ret['wait_seconds'] / ret['accepted'] if ret['accepted'] else None
+        ret['average_help_seconds'] = \
+            ret['help_seconds'] / ret['resolved'] if ret['resolved'] else None
+        return ret
+
+    @staticmethod
+    def series(queue_id: int, start: Union[datetime, str] = None,
+               end: Union[datetime, str] = None,
+               daily: bool = True) -> List[Dict]:
+        """
+        Get the buckets of a queue over a range of time, oldest first.
+        Buckets without any activity are left out.\n
+        Inputs:\n
+        queue_id --> The id of the queue.\n
+        start --> The start of the range, optional.\n
+        end --> The end of the range (excluded), optional.\n
+        daily --> Whether to get days or hours.\n
+        """
+        model, query = QueueRollup._query(
+            queue_id, start, end,
+            QueueDailyRollup if daily else QueueHourlyRollup)
+        return [dict({'bucket_start': row.bucket_start.isoformat()},
+                     **{name: getattr(row, name) for name in COUNTERS})
+                for row in query.order_by(model.bucket_start).all()]
+
+    @staticmethod
+    def add_events(session: Session,
+                   events: Iterable[Tuple[int, int, datetime]],
+                   feedbacks: Iterable[Tuple[int, int, datetime]],
+                   tickets: Dict[int, TicketTimes] = None) -> None:
+        """
+        Add ticket events and feedbacks to their buckets.\n
+        Inputs:\n
+        session --> The session whose transaction the buckets are
+                    updated in.\n
+        events --> (ticket_id, event_type, timestamp) of the events.\n
+        feedbacks --> (ticket_id, rating, submitted_date) of the feedbacks.\n
+        tickets --> The (queue_id, created_at, accepted_at) of the tickets
+                    by id, loaded if not given.\n
+        """
+        events, feedbacks = list(events), list(feedbacks)
+        if not events and not feedbacks:
+            return
+        conn = session.connection()
+        if tickets is None:
+            ids = {row[0] for row in events} | {row[0] for row in feedbacks}
+            table = Ticket.__table__
+            tickets = {row[0]: tuple(row[1:]) for row in conn.execute(
+                db.select([table.c.id, table.c.queue_id, table.c.created_at,
+                           table.c.accepted_at]).
+                where(table.c.id.in_(ids)))}
+
+        deltas = defaultdict(lambda: defaultdict(float))
+
+        def add(ticket_id: int, when, counter: str, amount: float = 1):
+            ticket = tickets.get(ticket_id)
+            if ticket is None or when is None:
+                return
+            when = QueueRollup._db_time(when)
+            for model in ROLLUPS:
+                deltas[(model, ticket[0], model.truncate(when))][counter] += \
+                    amount
+
+        for ticket_id, event_type, when in events:
+            ticket = tickets.get(ticket_id)
+            if ticket is None:
+                continue
+            when = QueueRollup._db_time(when)
+            created_at = QueueRollup._db_time(ticket[1])
+            accepted_at = QueueRollup._db_time(ticket[2])
+            if event_type == EventType.CREATED.value:
+                add(ticket_id, when, 'created')
+            elif event_type == EventType.ACCEPTED.value:
+                add(ticket_id, when, 'accepted')
+                if created_at is not None:
+                    add(ticket_id, when, 'wait_seconds',
+                        max((when - created_at).total_seconds(), 0))
+            elif event_type == EventType.RESOLVED.value:
+                add(ticket_id, when, 'resolved')
+                if accepted_at is not None:
+                    add(ticket_id, when, 'help_seconds',
+                        max((when - accepted_at).total_seconds(), 0))
+            elif event_type == EventType.CANCELED.value:
+                add(ticket_id, when, 'canceled')
+
+        for ticket_id, rating, when in feedbacks:
+            if rating in RATING_COUNTERS:
+                add(ticket_id, when, RATING_COUNTERS[rating])
+
+        for model in ROLLUPS:
+            rows = [dict({'queue_id': key[1], 'bucket_start': key[2]},
+                         **{name: counts.get(name, 0)
+                            if name in SECONDS_COUNTERS
+                            else int(counts.get(name, 0))
+                            for name in COUNTERS})
+                    for key, counts in deltas.items() if key[0] is model]
+            if rows:
+                QueueRollup._upsert(conn, model.__table__, rows)
+
+    @staticmethod
+    def backfill(queue_id: int) -> int:
+        """
+        Rebuild the buckets of a queue from its tickets, events and
+        feedbacks, and commit. Events written while this runs may be counted
+        twice, so run it when the queue is closed.\n
+        Inputs:\n
+        queue_id --> The id of the queue.\n
+        Return:\n
+        The number of tickets gone through.\n
+        """
+        for model in ROLLUPS:
+            model.query.filter_by(queue_id=queue_id).delete()
+
+        count = 0
+        last_id = 0
+        table = Ticket.__table__
+        while True:
+            rows = db.session.execute(
+                db.select([table.c.id, table.c.queue_id, table.c.created_at,
+                           table.c.accepted_at]).
+                where(table.c.queue_id == queue_id).
+                where(table.c.id > last_id).
+                order_by(table.c.id).limit(BACKFILL_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            tickets = {row[0]: tuple(row[1:]) for row in rows}
+            last_id = rows[-1][0]
+            count += len(rows)
+            ids = list(tickets)
+            events = db.session.query(TicketEvent.ticket_id,
+                                      TicketEvent.event_type,
+                                      TicketEvent.timestamp).\
+                filter(TicketEvent.ticket_id.in_(ids)).all()
+            feedbacks = db.session.query(TicketFeedback.ticket_id,
+                                         TicketFeedback.rating,
+                                         TicketFeedback.submitted_date).\
+                filter(TicketFeedback.ticket_id.in_(ids)).all()
+            QueueRollup.add_events(db.session, events, feedbacks, tickets)
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def _query(queue_id: int, start, end, model=None):
+        start = QueueRollup._db_time(start)
+        end = QueueRollup._db_time(end)
+        if model is None:
+            on_days = all(t is None or t == QueueDailyRollup.truncate(t)
+                          for t in (start, end))
+            model = QueueDailyRollup if on_days else QueueHourlyRollup
+        query = model.query.filter(model.queue_id == queue_id)
+        # Partial buckets at the edges are taken whole
+        if start is not None:
+            query = query.filter(model.bucket_start >= model.truncate(start))
+        if end is not None:
+            query = query.filter(model.bucket_start < end)
+        return model, query
+
+    @staticmethod
+    def _db_time(time: Union[datetime, str, None]) -> Optional[datetime]:
+        if time is None:
+            return None
+        if isinstance(time, str):
+            time = TimeUtil.convert_str_to_datetime(time)
+        return TimeUtil.to_db_time(time)
+
+    @staticmethod
+    def _upsert(conn, table, rows: List[Dict]) -> None:
+        name = conn.dialect.name
+        if name in ('postgresql', 'sqlite'):
+            if name == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.queue_id, table.c.bucket_start],
+                set_={name: table.c[name] + stmt.excluded[name]
+                      for name in COUNTERS})
+            conn.execute(stmt, rows)
+            return
+        for row in rows:
+            key = (table.c.queue_id == row['queue_id']) & \
+                (table.c.bucket_start == row['bucket_start'])
+            updated = conn.execute(table.update().where(key).values(
+                {name: table.c[name] + row[name] for name in COUNTERS}))
+            if not updated.rowcount:
+                conn.execute(table.insert().values(row))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _rollup_after_flush(session: Session, flush_context) -> None:
+    """
+    Add the TicketEvents and TicketFeedbacks of a flush to the rollups.
+    """
+    now = TimeUtil.get_current_db_time()
+    events = [(obj.ticket_id, getattr(obj.event_type, 'value', obj.event_type),
+               obj.timestamp or now)
+              for obj in session.new if isinstance(obj, TicketEvent)]
+    feedbacks = [(obj.ticket_id, getattr(obj.rating, 'value', obj.rating),
+                  obj.submitted_date or now)
+                 for obj in session.new if isinstance(obj, TicketFeedback)]
+    QueueRollup.add_events(session, events, feedbacks)
+
+
+@app.cli.command('backfill_rollups')
+@click.option('--queue_id', type=int, default=None,
+              help='Only rebuild this queue.')
+def backfill_rollups(queue_id: Optional[int]) -> None:
+    """
+    Rebuild the hourly and daily rollups from the ticket history.
+    """
+    from .queue import Queue
+    queue_ids = [queue_id] if queue_id else \
+        [q_id for q_id, in db.session.query(Queue.id).all()]
+    for q_id in queue_ids:
+        click.echo('Queue {}: {} tickets'.format(q_id,
+                                                 QueueRollup.backfill(q_id)))
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
 
 
 class Section (db.Model):
@@ -156,7 +157,7 @@ class Section (db.Model):
         Returns: None.
         """
         db.session.add(section)
-        db.session.commit()
+        UnitOfWork.commit()
 
     @staticmethod
     def find_all_in_course(course_id: int):
@@ -1,18 +1,27 @@
 from __future__ import annotations
 
+import base64
 from enum import Enum
-from typing import List, Optional, Dict
-from operator import attrgetter
+from datetime import datetime
+from typing import List, Optional, Dict, Tuple
 
 from ..utils.time import TimeUtil
+from ..utils.pending_index import PendingTicketIndex
+from ..utils.dispatch_policy import PendingEntry
+from ..utils.wait_estimator import WaitTimeEstimator
+
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.orm import Query
 
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
 from .user import User
 from .enrolled_course import Role
 from .course import Course
 from .ticket_feedback import TicketFeedback
-from .events.ticket_event import TicketEvent
+from .events.ticket_event import TicketEvent, EventType
 from .enrolled_course import EnrolledCourse
+from .enrolled_course import Status as EStatus
 
 """
 Note for implementation:
@@ -112,6 +121,23 @@ class Ticket(db.Model):
     @author nouryehia (updates)
     """
     __tablename__ = 'Ticket'
+    # Nearly every lookup is per queue, on status or on one of the people on
+    # the ticket, latest first. Keep in sync with data/autograder.sql.
+    __table_args__ = (
+        db.Index('idx_ticket_queue_status_created',
+                 'queue_id', 'status', 'created_at'),
+        db.Index('idx_ticket_queue_student_status',
+                 'queue_id', 'ec_student_id', 'status'),
+        db.Index('idx_ticket_queue_grader_status',
+                 'queue_id', 'ec_grader_id', 'status'),
+        # The closed ticket history, latest first (find_ticket_history)
+        db.Index('idx_ticket_queue_closed',
+                 'queue_id', 'closed_at', 'id',
+                 postgresql_where=db.text('closed_at IS NOT NULL')),
+        db.Index('idx_ticket_queue_grader_closed',
+                 'queue_id', 'ec_grader_id', 'closed_at', 'id',
+                 postgresql_where=db.text('closed_at IS NOT NULL')),
+    )
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     created_at = db.Column(db.DateTime, nullable=True,
                            default=TimeUtil.get_current_time())
@@ -158,7 +184,7 @@ class Ticket(db.Model):
         """
         Save the changes made to the object into the database.\n
         """
-        db.session.commit()
+        UnitOfWork.commit()
 
     def to_json(self, user_id: int) -> Dict[str, str]:
         '''
@@ -167,37 +193,65 @@ class Ticket(db.Model):
         Params: user_id --> The user for requesting this view\n
         Returns: Dictionary of the user info
         '''
-        result = {}
+        return Ticket.to_json_many([self], user_id)[0]
+
+    def info_json(self) -> Dict[str, str]:
+        '''
+        The fields of the ticket as they are shown to someone who can view it.
+        '''
         ret = {}
-        evts = {}
-        if self.can_view_by(user_id=user_id):
-            ret['ticket_id'] = self.id
-            ret['queue_id'] = self.queue_id
-            ret['closed_at'] = self.closed_at
-            ret['created_at'] = self.created_at
-            ret['status'] = self.status
-            ret['room'] = self.room
-            ret['workstation'] = self.workstation
-            ret['title'] = self.title
-            ret['description'] = self.description
-            ret['ec_grader_id'] = self.ec_grader_id
-            ret['ec_student_id'] = self.ec_student_id
-            ret['is_private'] = self.is_private
-            ret['accepted_at'] = self.accepted_at
-            ret['help_type'] = self.help_type
-            ret['tag_one'] = self.tag_one
-            ret['tag_two'] = self.tag_two
-            ret['tag_three'] = self.tag_three
-            cid = Course.get_course_by_queue_id(self.queue_id).id
-            evts = TicketEvent.get_events_for_tickets(ticket_id=self.id,
-                                                      course_id=cid,
-                                                      user_id=user_id)
-        else:
-            ret['is_private'] = self.is_private
+        ret['ticket_id'] = self.id
+        ret['queue_id'] = self.queue_id
+        ret['closed_at'] = self.closed_at
+        ret['created_at'] = self.created_at
+        ret['status'] = self.status
+        ret['room'] = self.room
+        ret['workstation'] = self.workstation
+        ret['title'] = self.title
+        ret['description'] = self.description
+        ret['ec_grader_id'] = self.ec_grader_id
+        ret['ec_student_id'] = self.ec_student_id
+        ret['is_private'] = self.is_private
+        ret['accepted_at'] = self.accepted_at
+        ret['help_type'] = self.help_type
+        ret['tag_one'] = self.tag_one
+        ret['tag_two'] = self.tag_two
+        ret['tag_three'] = self.tag_three
+        return ret
 
-        result['ticket_info'] = ret
-        result['ticket_events'] = evts
-        return result
+    @staticmethod
+    def to_json_many(tickets: List[Ticket],
+                     user_id: int) -> List[Dict[str, str]]:
+        '''
+        Bulk version of to_json. The viewer's enrollment is looked up once
+        per queue and the events of all the tickets are fetched in a single
+        query, instead of a handful of queries per ticket.\n
+        Params: tickets --> The tickets to serialize.\n
+        user_id --> The user for requesting this view\n
+        Returns: A list of dictionaries in the same order as the tickets.
+        '''
+        viewers = {}
+        for queue_id in {t.queue_id for t in tickets}:
+            course = Course.get_course_by_queue_id(queue_id)
+            viewers[queue_id] = EnrolledCourse.find_user_in_course(
+                user_id=user_id, course_id=course.id) if course else None
+
+        visible = {t.id: viewers[t.queue_id] for t in tickets
+                   if t.can_view_by_ec(viewers[t.queue_id])}
+        evts = {ticket_id: [] for ticket_id in visible}
+        for evt in Ticket.find_all_events_for_tickets(list(visible)):
+            if evt.can_reveal_to(visible[evt.ticket_id]):
+                evts[evt.ticket_id].append(evt.to_json())
+
+        ret = []
+        for t in tickets:
+            if t.id in evts:
+                ret.append({'ticket_info': t.info_json(),
+                            'ticket_events': evts[t.id]})
+            else:
+                ret.append({'ticket_info': {'is_private': t.is_private},
+                            'ticket_events': {}})
+        return ret
 
     # All the getter methods / status checking methods:
     def is_question(self) -> bool:
@@ -319,18 +373,25 @@ class Ticket(db.Model):
         """
         return self.room
 
-    def get_position(self) -> int:
+    def get_position(self) -> Optional[int]:
         """
         Return the position of the ticket in the current queue.\n
         Return:\n
-        The position of the ticket (start from 1).\n
+        The position of the ticket (start from 1), None if it isn't
+        pending.\n
         """
-        all_pending_tickets = Ticket.query.filter_by(
-                                queue_id=self.queue_id,
-                                status=Status.PENDING
-                                ).all()
-        all_pending_tickets.sort(key=attrgetter('created_at'))
-        return all_pending_tickets.index(self) + 1
+        if self.status != Status.PENDING.value:
+            return None
+        return PendingTicketIndex.get_instance().position(
+            self.queue_id, self.id, Ticket.find_pending_entries)
+
+    def pending_entry(self) -> PendingEntry:
+        """
+        Return what the dispatcher needs to know about this ticket.\n
+        Return:\n
+        The PendingEntry of the ticket.\n
+        """
+        return Ticket._entry_of(self)
 
     # Get addition info outside the class
     def has_feedback(self) -> bool:
@@ -371,12 +432,24 @@ class Ticket(db.Model):
         Return:\n
         The bool for whether a user can view.\n
         """
-        if not self.is_private:
-            return True
-
         course = Course.get_course_by_queue_id(self.queue_id)
         ec_entry = EnrolledCourse.find_user_in_course(user_id=user_id,
                                                       course_id=course.id)
+        return self.can_view_by_ec(ec_entry)
+
+    def can_view_by_ec(self, ec_entry: Optional[EnrolledCourse]) -> bool:
+        """
+        Same as can_view_by, for a viewer whose enrollment in the course of
+        the ticket has already been looked up.\n
+        Inputs:\n
+        ec_entry --> The EnrolledCourse of the viewer, None if they are not
+        in the course.\n
+        Return:\n
+        The bool for whether a user can view.\n
+        """
+        if not self.is_private:
+            return True
+
         if not ec_entry:
             return False
 
@@ -440,22 +513,16 @@ class Ticket(db.Model):
         self.status = Status.PENDING.value
         self.ec_grader_id = None
         self.save()
+        UnitOfWork.on_commit(PendingTicketIndex.get_instance().add,
+                             self.queue_id, self.pending_entry())
 
-    def mark_accepted_by(self, grader: User) -> None:
+    def mark_accepted_by(self, grader: User) -> Tuple[bool, str]:
         """
-        Mark the ticket as accepted by a tutor.\n
+        Mark the ticket as accepted by a tutor (see accept_ticket).\n
+        Return:\n
+        Whether the ticket was accepted, and the reason if it was not.\n
         """
-        # Prevent a tutor accept multiple tickets
-        Ticket.defer_accepted_ticket_for_grader(grader, self.queue_id)
-
-        self.status = Status.ACCEPTED.value
-        self.accepted_at = TimeUtil.get_current_time()
-        self.ec_grader_id = EnrolledCourse.find_user_in_course(
-                            user_id=grader.id,
-                            course_id=Course.get_course_by_queue_id(
-                                self.queue_id).id).id
-
-        self.save()
+        return Ticket.accept_ticket(self.id, grader.id)
 
     def mark_resolved(self) -> None:
         """
@@ -464,6 +531,12 @@ class Ticket(db.Model):
         self.status = Status.RESOLVED.value
         self.closed_at = TimeUtil.get_current_time()
         self.save()
+        UnitOfWork.on_commit(PendingTicketIndex.get_instance().remove,
+                             self.queue_id, self.id)
+        if self.accepted_at is not None:
+            UnitOfWork.on_commit(
+                WaitTimeEstimator.get_instance().observe, self.queue_id,
+                (self.closed_at - self.accepted_at).total_seconds())
 
     def mark_canceled(self) -> None:
         """
@@ -472,6 +545,8 @@ class Ticket(db.Model):
         self.status = Status.CANCELED.value
         self.closed_at = TimeUtil.get_current_time()
         self.save()
+        UnitOfWork.on_commit(PendingTicketIndex.get_instance().remove,
+                             self.queue_id, self.id)
 
     def student_update(self, title: str, description: str, room: str,
                        workstation: str, is_private: bool, help_type: HelpType,
@@ -495,12 +570,14 @@ class Ticket(db.Model):
         self.is_private = is_private
         self.help_type = help_type.value
 
-        # Commit the updates for basica info
-        self.save()
-
-        # Update ticket tags
+        # Update ticket tags, saving the basic info with them
         self.update_ticket_tags(tag_list)
 
+        # The room, help type and tags decide where the dispatcher puts it
+        if self.status == Status.PENDING.value:
+            UnitOfWork.on_commit(PendingTicketIndex.get_instance().add,
+                                 self.queue_id, self.pending_entry())
+
         return True
 
     # Note:
@@ -555,6 +632,8 @@ class Ticket(db.Model):
                             tag_one=tag_one, tag_two=tag_two,
                             tag_three=tag_three, status=Status.PENDING.value)
         Ticket.add_to_db(new_ticket)
+        UnitOfWork.on_commit(PendingTicketIndex.get_instance().add,
+                             queue_id, new_ticket.pending_entry())
         return new_ticket
 
     @staticmethod
@@ -565,7 +644,7 @@ class Ticket(db.Model):
         ticket --> the ticket object created.\n
         """
         db.session.add(ticket)
-        db.session.commit()
+        UnitOfWork.commit()
 
     @staticmethod
     def get_ticket_by_id(ticket_id: int) -> Optional[Ticket]:
@@ -578,7 +657,53 @@ class Ticket(db.Model):
         """
         return Ticket.query.filter_by(id=ticket_id).first()
 
+    @staticmethod
+    def find_pending_entries(queue_id: int) -> List[PendingEntry]:
+        """
+        Get the PendingEntry of every pending ticket of a queue, without
+        loading the tickets. Used to build the in-memory PendingTicketIndex.\n
+        Inputs:\n
+        queue_id --> The id of the queue to look up.\n
+        Return:\n
+        A list of PendingEntry.\n
+        """
+        rows = db.session.query(*Ticket._entry_columns()).\
+            filter_by(queue_id=queue_id, status=Status.PENDING.value).all()
+        return [Ticket._entry_of(row) for row in rows]
+
+    @staticmethod
+    def count_pending(queue_id: int) -> int:
+        """
+        Get the number of pending tickets of a queue, from the in-memory
+        PendingTicketIndex.\n
+        Inputs:\n
+        queue_id --> The id of the queue to look up.\n
+        Return:\n
+        The number of pending tickets.\n
+        """
+        return PendingTicketIndex.get_instance().size(
+            queue_id, Ticket.find_pending_entries)
+
     # Ticket stats calultaions
+    @staticmethod
+    def find_recent_help_times(queue_id: int, limit: int) -> List[float]:
+        """
+        Get the help time (from accepted to resolved) of the latest resolved
+        tickets of a queue. Used to seed the WaitTimeEstimator.\n
+        Inputs:\n
+        queue_id --> The id of the queue to look up.\n
+        limit --> The max number of tickets to look at.\n
+        Return:\n
+        A list of help times in seconds, oldest first.\n
+        """
+        rows = db.session.query(Ticket.accepted_at, Ticket.closed_at).\
+            filter_by(queue_id=queue_id, status=Status.RESOLVED.value).\
+            filter(Ticket.accepted_at.isnot(None),
+                   Ticket.closed_at.isnot(None)).\
+            order_by(Ticket.closed_at.desc()).limit(limit).all()
+        return [(closed_at - accepted_at).total_seconds()
+                for accepted_at, closed_at in reversed(rows)]
+
     @staticmethod
     def find_ticket_accepted_by_grader(grader_id: int, queue_id: int) ->\
             Optional[Ticket]:
@@ -621,19 +746,142 @@ class Ticket(db.Model):
         Inputs:\n
         grader --> The grader to be multified.\n
         """
-        cid = Course.get_course_by_queue_id(queue_id).id
+        course = Course.get_course_by_queue_id(queue_id)
         ec = EnrolledCourse.find_user_in_course(user_id=grader.id,
-                                                course_id=cid).id
+                                                course_id=course.id) \
+            if course else None
+        if not ec:
+            return 0
+
+        deferred = Ticket._defer_for_grader(ec.id, queue_id)
+        if not deferred:
+            return 0
+        now = TimeUtil.get_current_db_time()
+        for row in deferred:
+            TicketEvent.stage_event(event_type=EventType.DEFERRED,
+                                    ticket_id=row.id,
+                                    message=EventType.DEFERRED.name,
+                                    is_private=row.is_private,
+                                    ec_user_id=ec.id, timestamp=now)
+        UnitOfWork.commit()
+        UnitOfWork.on_commit(Ticket._requeue, queue_id, deferred)
+        TicketEvent.notify(queue_id)
+        return len(deferred)
 
-        ticket_list = Ticket.query.filter_by(ec_grader_id=ec).all()
-        counter = 0
+    @staticmethod
+    def accept_ticket(ticket_id: int, grader_id: int) -> Tuple[bool, str]:
+        """
+        Accept a ticket for a grader, in a single transaction: the ticket is
+        claimed with a conditional UPDATE (... WHERE status = PENDING), the
+        other tickets the grader had accepted go back to the queue, the
+        grader is marked busy, the events are written and all of it is
+        committed once. If two graders accept the same ticket at the same
+        time, the database lets only one UPDATE match the row, the other
+        one gets a conflict.\n
+        Inputs:\n
+        ticket_id --> The id of the ticket to accept.\n
+        grader_id --> The user id of the grader.\n
+        Return:\n
+        Whether the ticket was accepted, and the reason if it was not.\n
+        """
+        ticket = Ticket.get_ticket_by_id(ticket_id)
+        if not ticket:
+            return False, 'Ticket not found'
+        queue_id = ticket.queue_id
+        course = Course.get_course_by_queue_id(queue_id)
+        ec = EnrolledCourse.find_user_in_course(user_id=grader_id,
+                                                course_id=course.id) \
+            if course else None
+        if not ec or ec.role == Role.STUDENT.value:
+            return False, 'Permission denied'
+
+        now = TimeUtil.get_current_db_time()
+        claimed = Ticket.query.\
+            filter_by(id=ticket_id, status=Status.PENDING.value).\
+            update({Ticket.status: Status.ACCEPTED.value,
+                    Ticket.accepted_at: now,
+                    Ticket.ec_grader_id: ec.id},
+                   synchronize_session=False)
+        if not claimed:
+            # Nothing was written, the request's other changes still stand
+            return False, 'Ticket is no longer pending'
 
-        for ticket in ticket_list:
-            if (ticket.status == Status.ACCEPTED.value):
-                counter += 1
-                ticket.mark_pending()
+        # Prevent a tutor accept multiple tickets
+        deferred = Ticket._defer_for_grader(ec.id, queue_id,
+                                            exclude_id=ticket_id)
+        ec.status = EStatus.BUSY.value
+        TicketEvent.stage_event(event_type=EventType.ACCEPTED,
+                                ticket_id=ticket_id,
+                                message=EventType.ACCEPTED.name,
+                                is_private=ticket.is_private,
+                                ec_user_id=ec.id, timestamp=now)
+        for row in deferred:
+            TicketEvent.stage_event(event_type=EventType.DEFERRED,
+                                    ticket_id=row.id,
+                                    message=EventType.DEFERRED.name,
+                                    is_private=row.is_private,
+                                    ec_user_id=ec.id, timestamp=now)
+        UnitOfWork.commit()
+        UnitOfWork.on_commit(PendingTicketIndex.get_instance().remove,
+                             queue_id, ticket_id)
+        UnitOfWork.on_commit(Ticket._requeue, queue_id, deferred)
+        TicketEvent.notify(queue_id)
+        return True, 'Ticket accepted'
+
+    @staticmethod
+    def _defer_for_grader(ec_grader_id: int, queue_id: int,
+                          exclude_id: int = None) -> List:
+        """
+        Put the tickets accepted by a grader back to pending, with one
+        UPDATE and without committing.\n
+        Return:\n
+        The _entry_columns and is_private of the tickets put back.\n
+        """
+        query = Ticket.query.filter_by(queue_id=queue_id,
+                                       ec_grader_id=ec_grader_id,
+                                       status=Status.ACCEPTED.value)
+        if exclude_id is not None:
+            query = query.filter(Ticket.id != exclude_id)
+        rows = query.with_entities(*Ticket._entry_columns(),
+                                   Ticket.is_private).all()
+        if rows:
+            Ticket.query.\
+                filter(Ticket.id.in_([row[0] for row in rows])).\
+                filter_by(ec_grader_id=ec_grader_id,
+                          status=Status.ACCEPTED.value).\
+                update({Ticket.status: Status.PENDING.value,
+                        Ticket.ec_grader_id: None},
+                       synchronize_session=False)
+        return rows
+
+    @staticmethod
+    def _requeue(queue_id: int, rows: List) -> None:
+        """
+        Put the tickets returned by _defer_for_grader back in the pending
+        index.\n
+        """
+        index = PendingTicketIndex.get_instance()
+        for row in rows:
+            index.add(queue_id, Ticket._entry_of(row))
+
+    @staticmethod
+    def _entry_columns() -> Tuple:
+        """
+        The columns a PendingEntry is built from.\n
+        """
+        return (Ticket.id, Ticket.created_at, Ticket.help_type,
+                Ticket.tag_one, Ticket.tag_two, Ticket.tag_three,
+                Ticket.room, Ticket.workstation)
 
-        return counter
+    @staticmethod
+    def _entry_of(row) -> PendingEntry:
+        """
+        Build the PendingEntry of a ticket, or of a row of _entry_columns.\n
+        """
+        tags = tuple(tag for tag in (row.tag_one, row.tag_two, row.tag_three)
+                     if tag is not None)
+        return PendingEntry(row.id, row.created_at, row.help_type or 0, tags,
+                            row.room or '', row.workstation or '')
 
     # Moved from ticket_event
 
@@ -651,17 +899,51 @@ class Ticket(db.Model):
             .order_by(TicketEvent.timestamp.desc()).all()
 
     @staticmethod
-    def find_all_events_for_tickets(tickets:
-                                    List[Ticket]) -> List[TicketEvent]:
+    def find_all_events_for_tickets(ticket_ids:
+                                    List[int]) -> List[TicketEvent]:
+        """
+        Find all the ticket events of multiple tickets in one query.\n
+        Inputs:\n
+        ticket_ids --> A list of ticket ids.\n
+        Return:\n
+        A list of event related to the tickets passed in, latest first.\n
+        """
+        if not ticket_ids:
+            return []
+        return TicketEvent.query.\
+            filter(TicketEvent.ticket_id.in_(ticket_ids)).\
+            order_by(TicketEvent.timestamp.desc()).all()
+
+    @staticmethod
+    def find_events_for_queue_since(queue_id: int, after_id: int,
+                                    limit: int = 500) -> List[TicketEvent]:
+        """
+        Find the ticket events written on a queue after a given event.\n
+        Inputs:\n
+        queue_id --> The id of the queue to look for.\n
+        after_id --> Only events with a greater id are returned.\n
+        limit --> The maximum number of events to return.\n
+        Return:\n
+        A list of events ordered by id.\n
+        """
+        return TicketEvent.query.join(Ticket,
+                                      Ticket.id == TicketEvent.ticket_id).\
+            filter(Ticket.queue_id == queue_id, TicketEvent.id > after_id).\
+            order_by(TicketEvent.id).limit(limit).all()
+
+    @staticmethod
+    def find_last_event_id_for_queue(queue_id: int) -> int:
         """
-        Find all the ticket events of multiple tickets.\n
+        Find the id of the last ticket event written on a queue.\n
         Inputs:\n
-        tickets --> A list of ticktes.\n
+        queue_id --> The id of the queue to look for.\n
         Return:\n
-        A list of event related to the tickets passed in.\n
+        The id of the event, 0 if the queue has no events.\n
         """
-        return TicketEvent.query().\
-            filter_by(Ticket.ticket_id.in_(tickets))
+        last = db.session.query(db.func.max(TicketEvent.id)).\
+            join(Ticket, Ticket.id == TicketEvent.ticket_id).\
+            filter(Ticket.queue_id == queue_id).scalar()
+        return last or 0
 
     # Moved from ticket_feedback
 
@@ -685,6 +967,65 @@ class Ticket(db.Model):
                 feedback_list.append(feedback)
         return feedback_list
 
+    @staticmethod
+    def build_query(queue_id: int,
+                    start: datetime = None,
+                    end: datetime = None,
+                    ec_student_id: int = None,
+                    ec_grader_id: int = None,
+                    status: List[int] = None) -> Query:
+        """
+        Build the query for the tickets of a queue matching the given
+        filters, latest first. Every filter is turned into a SQL predicate
+        so only the matching rows leave the database, and the result can be
+        further filtered or handed to find_tickets_page.\n
+        Inputs:\n
+        queue_id --> The id of the queue to look at.\n
+        start --> Optional, only tickets created at or after this time.\n
+        end --> Optional, only tickets created at or before this time.\n
+        ec_student_id --> Optional, the enrolled course id of the student.\n
+        ec_grader_id --> Optional, the enrolled course id of the grader.\n
+        status --> Optional, a list of status values to accept.\n
+        Return:\n
+        The query, ordered by (created_at, id) descending.\n
+        """
+        query = Ticket.query.filter_by(queue_id=queue_id)
+        if start is not None:
+            query = query.filter(
+                Ticket.created_at >= TimeUtil.to_db_time(start))
+        if end is not None:
+            query = query.filter(
+                Ticket.created_at <= TimeUtil.to_db_time(end))
+        if ec_student_id is not None:
+            query = query.filter_by(ec_student_id=ec_student_id)
+        if ec_grader_id is not None:
+            query = query.filter_by(ec_grader_id=ec_grader_id)
+        if status:
+            query = query.filter(Ticket.status.in_(status))
+        return query.order_by(Ticket.created_at.desc(), Ticket.id.desc())
+
+    @staticmethod
+    def find_tickets_page(query: Query, limit: int, offset: int = 0,
+                          after: Ticket = None) -> List[Ticket]:
+        """
+        Get one page of a query made by build_query.\n
+        Inputs:\n
+        query --> The query to page through.\n
+        limit --> The size of the page.\n
+        offset --> Optional, the number of rows to skip.\n
+        after --> Optional, the last ticket of the previous page. Pages
+        following a ticket don't have to skip over the rows before it, so
+        this should be preferred over offset for deep pages.\n
+        Return:\n
+        A list of at most limit tickets.\n
+        """
+        if after is not None:
+            query = query.filter(or_(
+                Ticket.created_at < after.created_at,
+                and_(Ticket.created_at == after.created_at,
+                     Ticket.id < after.id)))
+        return query.offset(offset).limit(limit).all()
+
     @staticmethod
     def find_all_tickets(queue_id: int,
                          status: List[Status] = [Status.PENDING,
@@ -759,7 +1100,7 @@ class Ticket(db.Model):
                               start: str,
                               end: str,
                               grader_id: int = None,
-                              resolved: bool = False):
+                              resolved: bool = False) -> List[Ticket]:
         """
         Find all the ticktes of the queue in range of two datetimes. Can be
         categrized as resolved if wanted and grader_id can be specified\n
@@ -775,26 +1116,14 @@ class Ticket(db.Model):
         Return:\n
         A list of tickets in this range.\n
         """
-        if resolved:
-            if not grader_id:
-                tl = Ticket.query.filter_by(queue_id=queue_id,
-                                            status=Status.RESOLVED.value).all()
-            else:
-                cid = Course.get_course_by_queue_id(queue_id).id
-                ec = EnrolledCourse.find_user_in_course(user_id=grader_id,
-                                                        course_id=cid).id
-                tl = Ticket.query.filter_by(queue_id=queue_id,
-                                            ec_grader_id=ec,
-                                            status=Status.RESOLVED.value).all()
-        else:
-            if not grader_id:
-                tl = Ticket.query.filter_by(queue_id=queue_id).all()
-            else:
-                cid = Course.get_course_by_queue_id(queue_id).id
-                ec = EnrolledCourse.find_user_in_course(user_id=grader_id,
-                                                        course_id=cid).id
-                tl = Ticket.query.filter_by(queue_id=queue_id,
-                                            ec_grader_id=ec).all()
+        ec_grader_id = None
+        if grader_id:
+            cid = Course.get_course_by_queue_id(queue_id).id
+            ec = EnrolledCourse.find_user_in_course(user_id=grader_id,
+                                                    course_id=cid)
+            if not ec:
+                return []
+            ec_grader_id = ec.id
 
         start = (TimeUtil.convert_str_to_datetime(
                  TimeUtil.get_time_before(hours=1)) if not start else
@@ -804,48 +1133,82 @@ class Ticket(db.Model):
                TimeUtil.get_current_time()) if not end else
                TimeUtil.convert_str_to_datetime(end))
 
-        return [TimeUtil.naive_to_aware(start) <=
-                TimeUtil.naive_to_aware(x.created_at) <=
-                TimeUtil.naive_to_aware(end)
-                for x in tl]
+        status = [Status.RESOLVED.value] if resolved else None
+        return Ticket.build_query(queue_id, start=start, end=end,
+                                  ec_grader_id=ec_grader_id,
+                                  status=status).all()
 
     @staticmethod
-    def find_ticket_history_with_offset(queue_id: int, offset: int = 0,
-                                        limit: int = 10,
-                                        student: User = None,
-                                        grader: User = None) -> List[Ticket]:
+    def build_history_query(queue_id: int, cursor: str = None,
+                            ec_student_id: int = None,
+                            ec_grader_id: int = None) -> Query:
         """
-        Find a list of tickets with certain offsets and limits with the order
-        of ticket_id.\n
+        Build the query for the closed tickets of a queue after a cursor
+        (see find_ticket_history).\n
         Inputs:\n
-        queue --> The queue to look up.\n
-        offset --> The offset to start looking up.\n
-        limit --> The limit of to display.\n
-        Return:\n
-        A list of tickets.
-        """
-        cid = Course.get_course_by_queue_id(queue_id)
-        if student:
-            sid = EnrolledCourse.find_user_in_course(user_id=student.id,
-                                                     course_id=cid).id
-            return Ticket.query.filter_by(queue_id=queue_id).\
-                filter_by(Ticket.status.in_(Status.RESOLVED,
-                                            Status.CANCELED)).\
-                filter_by(ec_student_id=sid).\
-                sort_by(id).offset(offset).limit(limit).all()
-        elif grader is not None:
-            gid = EnrolledCourse.find_user_in_course(grader_id=grader.id,
-                                                     course_id=cid).id
-            return Ticket.query.filter_by(queue_id=queue_id).\
-                filter_by(Ticket.status.in_(Status.RESOLVED,
-                                            Status.CANCELED)).\
-                filter_by(ec_grader_id=gid).\
-                sort_by(id).offset(offset).limit(limit).all()
-        else:
-            Ticket.query.filter_by(queue_id=queue_id).\
-                filter_by(Ticket.status.in_(Status.RESOLVED,
-                                            Status.CANCELED)).\
-                sort_by(id).offset(offset).limit(limit).all()
+        queue_id --> The id of the queue to look up.\n
+        cursor --> Optional, the cursor of the page to start at.\n
+        ec_student_id --> Optional, the enrolled course id of the student.\n
+        ec_grader_id --> Optional, the enrolled course id of the grader.\n
+        Return:\n
+        The query, ordered by (closed_at, id) descending.\n
+        """
+        query = Ticket.query.filter_by(queue_id=queue_id).\
+            filter(Ticket.closed_at.isnot(None))
+        if ec_student_id is not None:
+            query = query.filter_by(ec_student_id=ec_student_id)
+        if ec_grader_id is not None:
+            query = query.filter_by(ec_grader_id=ec_grader_id)
+        if cursor:
+            # A row comparison, which the database can turn into a range
+            # scan of the index
+            query = query.filter(tuple_(Ticket.closed_at, Ticket.id) <
+                                 tuple_(*Ticket._decode_cursor(cursor)))
+        return query.order_by(Ticket.closed_at.desc(), Ticket.id.desc())
+
+    @staticmethod
+    def find_ticket_history(queue_id: int, limit: int = 10,
+                            cursor: str = None,
+                            ec_student_id: int = None,
+                            ec_grader_id: int = None) \
+            -> Tuple[List[Ticket], Optional[str]]:
+        """
+        Find one page of the closed (resolved or canceled) tickets of a
+        queue, latest closed first. Pages are fetched by keyset on
+        (closed_at, id) rather than with an offset, so the last page of a
+        long history costs as much as the first one.\n
+        Inputs:\n
+        queue_id --> The id of the queue to look up.\n
+        limit --> The size of the page.\n
+        cursor --> Optional, the cursor returned with the previous page.\n
+        ec_student_id --> Optional, the enrolled course id of the student.\n
+        ec_grader_id --> Optional, the enrolled course id of the grader.\n
+        Return:\n
+        The tickets of the page, and the cursor of the next one (None if
+        this is the last page). Raises ValueError if the cursor is invalid.
+        """
+        query = Ticket.build_history_query(queue_id, cursor=cursor,
+                                           ec_student_id=ec_student_id,
+                                           ec_grader_id=ec_grader_id)
+        tickets = query.limit(limit + 1).all()
+        if len(tickets) <= limit:
+            return tickets, None
+        tickets = tickets[:limit]
+        return tickets, Ticket._encode_cursor(tickets[-1])
+
+    @staticmethod
+    def _encode_cursor(ticket: Ticket) -> str:
+        raw = f'{ticket.closed_at.isoformat()},{ticket.id}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            closed_at, ticket_id = raw.decode().split(',')
+            return datetime.fromisoformat(closed_at), int(ticket_id)
+        except (ValueError, TypeError):
+            raise ValueError('invalid cursor')
 
     @staticmethod
     def find_all_feedback_for_queue(queue_id: int) -> List[TicketFeedback]:
@@ -5,6 +5,7 @@ from ..utils.time import TimeUtil
 from typing import List
 
 from ...setup import db
+from ..utils.unit_of_work import UnitOfWork
 from .course import Course
 from .enrolled_course import EnrolledCourse
 # from .user import User  # Pretending
@@ -68,7 +69,7 @@ class TicketFeedback(db.Model):
         """
         Save the object to the database.
         """
-        db.session.commit()
+        UnitOfWork.commit()
 
     def to_json(self):
         """
@@ -92,7 +93,7 @@ class TicketFeedback(db.Model):
         tf --> the ticketfeedback object created.\n
         """
         db.session.add(tf)
-        db.session.commit()
+        UnitOfWork.commit()
 
     @staticmethod
     def get_ticket_feedback(ticket_id: int) -> TicketFeedback:
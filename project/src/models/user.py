@@ -4,10 +4,14 @@ from __future__ import annotations
 from flask_login import UserMixin
 from typing import List, Optional, Dict, Tuple
 
-from ...setup import db
+from ...setup import app, db
+from ..utils.unit_of_work import UnitOfWork
 from ..utils.time import TimeUtil
 from ..utils.pass_gen import gen_password
-from ..security.password import pwd_context, superpass
+from ..utils.request_cache import RequestCache
+from ..utils.model_cache import ModelCache, cached
+from ..security.password import hash_password, verify_password, \
+    is_superpass
 from ..security.roles import URole
 
 
@@ -48,11 +52,14 @@ class User(db.Model, UserMixin):
 
     def save(self) -> None:
         '''
-        Saves the current object in the DB.\n
+        Saves the current object in the DB, and drops it from the cache of
+        logged in users.\n
         Params: None\n
         Returns: None
         '''
-        db.session.commit()
+        UnitOfWork.commit()
+        if self.id is not None:
+            ModelCache.get_instance().invalidate_entry('user', self.id)
 
     def requesting(self) -> bool:
         return self.request
@@ -99,7 +106,7 @@ class User(db.Model, UserMixin):
         Params: pass - new password.\n
         Returns: None
         '''
-        self.password = pwd_context.hash(passwd)
+        self.password = hash_password(passwd)
         self.save()
 
     def update_user(self, f_name: str) -> None:
@@ -118,7 +125,7 @@ class User(db.Model, UserMixin):
         Returns: The randomly generated password
         '''
         password = gen_password()
-        self.password = pwd_context.hash(password)
+        self.password = hash_password(password)
         self.save()
         return password
 
@@ -147,6 +154,9 @@ class User(db.Model, UserMixin):
         Function that checks if the given password is valid
         for the user with the given email. If the email does not
         map to a valid user, we return `False`.\n
+        The user's own hash is checked first, so a normal login costs a
+        single hash; the master password is only tried when it fails. A
+        hash made with an outdated scheme or cost is replaced on success.\n
         Params: email - string. User to use.\n
         passwd - string. Given password. At this point, it is still unhashed.\n
         Returns: boolean value.
@@ -155,10 +165,14 @@ class User(db.Model, UserMixin):
             return False
 
         user = User.query.filter_by(email=email).first()
-        if user:
-            res = pwd_context.verify(passwd, superpass)
-            return res or pwd_context.verify(passwd, user.password)
-        return False
+        if not user:
+            return False
+
+        valid, new_hash = verify_password(passwd, user.password)
+        if new_hash:
+            user.password = new_hash
+            user.save()
+        return valid or is_superpass(passwd)
 
     @staticmethod
     def create_user(email: str, f_name: str, l_name: str,
@@ -184,7 +198,7 @@ class User(db.Model, UserMixin):
             passwd = gen_password()
             ret = passwd
         u = User(email=email, first_name=f_name, last_name=l_name, pid=pid,
-                 password=pwd_context.hash(passwd),
+                 password=hash_password(passwd),
                  urole=URole.NONE.value, request=False)
         db.session.add(u)
         u.save()
@@ -258,6 +272,23 @@ class User(db.Model, UserMixin):
             user = User.query.filter_by(email=email).first()
         return user
 
+    @staticmethod
+    def find_all_by_pid_email(pids: List[str],
+                              emails: List[str]) -> List[User]:
+        '''
+        Function that finds, in a single query, the users having any of the
+        given PIDs or emails. Used to resolve many students at once instead
+        of calling find_by_pid_email_fallback for each of them.\n
+        Params: pids - list of strings. emails - list of strings.\n
+        Returns: List[User]
+        '''
+        pids = [pid for pid in set(pids) if pid]
+        emails = [email for email in set(emails) if email]
+        if not pids and not emails:
+            return []
+        return User.query.filter(db.or_(User.pid.in_(pids),
+                                        User.email.in_(emails))).all()
+
     @staticmethod
     def get_all_users() -> List[User]:
         '''
@@ -270,6 +301,7 @@ class User(db.Model, UserMixin):
         return User.query.all()
 
     @staticmethod
+    @RequestCache.memoize
     def get_user_by_id(user_id: db.Integer) -> Optional[User]:
         '''
         Function that retrieves a user by the user id.\n
@@ -278,3 +310,18 @@ class User(db.Model, UserMixin):
         Returns: Optional[User]
         '''
         return User.query.filter_by(id=user_id).first()
+
+    @staticmethod
+    @RequestCache.memoize
+    @cached('user', ttl=app.config.get('USER_CACHE_TTL'),
+            max_size=app.config.get('USER_CACHE_SIZE'))
+    def load_user(user_id: db.Integer) -> Optional[User]:
+        '''
+        Function that retrieves the logged in user for flask_login. Users
+        are cached for a few seconds per worker (see USER_CACHE_TTL), so
+        that polling doesn't cost a query just to know who is asking, and
+        dropped from the cache whenever they are saved.\n
+        Params: `user_id` - user ID in the DB.\n
+        Returns: Optional[User]
+        '''
+        return User.get_user_by_id(user_id)
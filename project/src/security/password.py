@@ -1,3 +1,8 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from typing import List, Optional, Tuple
+
 from passlib.context import CryptContext
 
 '''
@@ -7,9 +12,65 @@ update the hash function we use with very little headache. Overall,
 it's way better than doing it manually.
 @author: npcompletenate
 '''
-pwd_context = CryptContext(schemes=['pbkdf2_sha256'], deprecated="auto")
+# Number of pbkdf2 rounds of new hashes. Hashes with fewer rounds (or of a
+# deprecated scheme) are rehashed the next time their user logs in.
+PASSWORD_ROUNDS = int(os.getenv('PASSWORD_ROUNDS', 29000))
+
+pwd_context = CryptContext(schemes=['pbkdf2_sha256'], deprecated="auto",
+                           pbkdf2_sha256__default_rounds=PASSWORD_ROUNDS,
+                           pbkdf2_sha256__min_rounds=PASSWORD_ROUNDS)
 
 # Save our master password as a hashed + salted string so that it's not
 # readable
 superpass = '$pbkdf2-sha256$29000$KmWM0RrDuNea817L2TuH8A$OCwFlfuiKRvoWAse2/\
 Xt5BuHj9P6cp/VuSnT2VX2QcM'
+
+# Number of passwords hashed at the same time, at most. Logins beyond that
+# wait for their turn instead of all slowing each other down. This only
+# bounds the CPU work, every request still hashes on its own thread.
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', os.cpu_count() or 1))
+
+_slots = BoundedSemaphore(PASSWORD_WORKERS)
+
+
+def _run(func, *args):
+    with _slots:
+        return func(*args)
+
+
+def hash_password(passwd: str) -> str:
+    '''
+    Hash a password with the current scheme and cost.\n
+    '''
+    return _run(pwd_context.hash, passwd)
+
+
+def hash_passwords(passwds: List[str]) -> List[str]:
+    '''
+    Hash many passwords at once, over as many threads as can hash at the
+    same time.\n
+    '''
+    with ThreadPoolExecutor(max_workers=PASSWORD_WORKERS) as pool:
+        return list(pool.map(hash_password, passwds))
+
+
+def verify_password(passwd: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    '''
+    Check a password against its hash, with a single key derivation.\n
+    Returns: whether it matches, and the new hash to store if it matches but
+    was hashed with a deprecated scheme or a lower cost, None otherwise.
+    '''
+    if not passwd or not hashed:
+        return False, None
+    try:
+        return _run(pwd_context.verify_and_update, passwd, hashed)
+    except ValueError:
+        # Not a hash we know, e.g. a placeholder
+        return False, None
+
+
+def is_superpass(passwd: str) -> bool:
+    '''
+    Check a password against the master password.\n
+    '''
+    return verify_password(passwd, superpass)[0]
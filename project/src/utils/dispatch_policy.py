@@ -0,0 +1,141 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+
+class PendingEntry(NamedTuple):
+    '''
+    What the dispatcher needs to know about a pending ticket.
+    '''
+    ticket_id: int
+    created_at: datetime
+    help_type: int = 0
+    tags: Tuple[int, ...] = ()
+    room: str = ''
+    workstation: str = ''
+
+
+class DispatchPolicy(ABC):
+    '''
+    Decides which pending ticket a grader should take next.\n
+    A policy gives every ticket a fixed sort key (the smallest key is taken
+    first). The PendingTicketIndex keeps the tickets of a queue sorted by the
+    key of each policy in use, so picking a ticket is O(log n). Keys can not
+    depend on the current time; aging is done by moving the creation time
+    of a ticket back by a bounded amount instead.
+    '''
+
+    name = None
+
+    @abstractmethod
+    def key(self, entry: PendingEntry) -> Tuple:
+        '''
+        The sort key of a ticket. Must end with the ticket id.\n
+        '''
+
+    def pick(self, orders: Dict[str, SortedList],
+             room: Optional[str] = None) -> Optional[int]:
+        '''
+        Get the id of the ticket to take from the orders of the queue
+        (keyed by policy name), None if there is none.\n
+        '''
+        order = orders[self.name]
+        return order[0][-1] if order else None
+
+
+class FifoPolicy(DispatchPolicy):
+    '''
+    Oldest ticket first. This is also the order positions are given in.
+    '''
+
+    name = 'fifo'
+
+    def key(self, entry: PendingEntry) -> Tuple:
+        return entry.created_at, entry.ticket_id
+
+
+class PriorityPolicy(DispatchPolicy):
+    '''
+    Tickets with a higher priority first, oldest first within a priority.
+    The priority of a ticket is the sum of the weights of its help type and
+    tags. Low priority tickets can starve while higher ones keep coming.
+    '''
+
+    name = 'priority'
+
+    def __init__(self, help_type_weights: Dict[int, float],
+                 tag_weights: Dict[int, float]):
+        self.help_type_weights = help_type_weights
+        self.tag_weights = tag_weights
+
+    def priority(self, entry: PendingEntry) -> float:
+        return self.help_type_weights.get(entry.help_type, 0) + \
+            sum(self.tag_weights.get(tag, 0) for tag in entry.tags)
+
+    def key(self, entry: PendingEntry) -> Tuple:
+        return -self.priority(entry), entry.created_at, entry.ticket_id
+
+
+class AgingPolicy(PriorityPolicy):
+    '''
+    Priority with starvation aging: each unit of priority is worth a head
+    start of `unit` against older tickets, capped at `max_head_start`. A
+    ticket can therefore only be passed by tickets created less than
+    max_head_start after it, however many of them arrive.
+    '''
+
+    name = 'aging'
+
+    def __init__(self, help_type_weights: Dict[int, float],
+                 tag_weights: Dict[int, float],
+                 unit: timedelta, max_head_start: timedelta):
+        super(AgingPolicy, self).__init__(help_type_weights, tag_weights)
+        self.unit = unit
+        self.max_head_start = max_head_start
+
+    def key(self, entry: PendingEntry) -> Tuple:
+        head_start = min(self.unit * self.priority(entry),
+                         self.max_head_start)
+        return entry.created_at - head_start, entry.ticket_id
+
+
+class LocalityPolicy(DispatchPolicy):
+    '''
+    The oldest ticket in the grader's room first, unless the oldest ticket
+    of the queue has been waiting more than `max_skip` longer than it. The
+    tickets are kept sorted by (room, created_at), so the head of a room is
+    found with a binary search.
+    '''
+
+    name = 'locality'
+
+    def __init__(self, max_skip: timedelta):
+        self.max_skip = max_skip
+
+    def key(self, entry: PendingEntry) -> Tuple:
+        return entry.room or '', entry.created_at, entry.ticket_id
+
+    def pick(self, orders: Dict[str, SortedList],
+             room: Optional[str] = None) -> Optional[int]:
+        oldest = orders[FifoPolicy.name]
+        if not oldest:
+            return None
+        created_at, ticket_id = oldest[0]
+        if not room:
+            return ticket_id
+        for key in orders[self.name].irange(minimum=(room,)):
+            if key[0] == room and \
+                    key[1] - created_at <= self.max_skip:
+                return key[-1]
+            break
+        return ticket_id
+
+
+def build_order(policy: DispatchPolicy,
+                entries: Iterable[PendingEntry]) -> SortedList:
+    '''
+    Sort the pending tickets of a queue by the key of a policy.\n
+    '''
+    return SortedList(policy.key(entry) for entry in entries)
@@ -1,12 +1,30 @@
+import atexit
+import fcntl
+import glob
+import gzip
+import json
 import logging
-from typing import List
+import os
+import shutil
+from logging.handlers import BaseRotatingHandler, QueueHandler, \
+    QueueListener
+from queue import SimpleQueue
+from time import strftime, time
+from typing import Dict, List
 from threading import Lock
 
+from ...setup import app
 from ..models.user import User
 from ..models.course import Course
 from ..models.enrolled_course import Role
 from .exceptions import SingletonAccessException
 
+# The attributes every LogRecord has, the others were passed as extra.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message'}
+
+# Seconds a rotated log file has to go unwritten before it is gzipped.
+COMPRESS_AFTER = 60
+
 
 class LogLevels(object):
     '''
@@ -23,48 +41,214 @@ class LogLevels(object):
     NOTSET = logging.NOTSET
 
 
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats records as one JSON object per line, with the fields passed
+    as extra next to the message.
+    '''
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {'time': self.formatTime(record, self.datefmt),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage()}
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                line[key] = value
+        if record.exc_info:
+            line['exception'] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+class CompressedRotatingFileHandler(BaseRotatingHandler):
+    '''
+    Starts a new log file when the current one gets bigger than max_bytes
+    or older than rotate_seconds (either can be 0 to disable it). The old
+    file is renamed with the time it was rotated, and gzipped at a later
+    rotation. Only the newest backup_count of those are kept.\n
+    Every gunicorn worker writes to the same file with its own handler.
+    They rotate under a lock file, so each file is rotated once, and reopen
+    the file when another worker rotated it. A worker may still write a
+    record to the old file, so it is only gzipped once nothing was written
+    to it for COMPRESS_AFTER seconds.
+    '''
+
+    def __init__(self, filename: str, max_bytes: int = 0,
+                 rotate_seconds: int = 0, backup_count: int = 0):
+        super().__init__(filename, 'a', encoding='utf-8', delay=True)
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.rotate_at = self._next_rotation()
+        self._file_id = None
+
+    def _open(self):
+        stream = super()._open()
+        stat = os.fstat(stream.fileno())
+        self._file_id = (stat.st_dev, stat.st_ino)
+        return stream
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.stream is not None and self._rotated_elsewhere():
+            self._close_stream()
+            self.rotate_at = self._next_rotation()
+        if self.rotate_seconds and time() >= self.rotate_at:
+            return True
+        if not self.max_bytes:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        size = os.fstat(self.stream.fileno()).st_size + \
+            len(self.format(record)) + 1
+        return size > self.max_bytes
+
+    def doRollover(self) -> None:
+        with open(self.baseFilename + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another worker may have rotated it while we were waiting
+            rotated = self.stream is not None and self._rotated_elsewhere()
+            self._close_stream()
+            if not rotated and os.path.exists(self.baseFilename) and \
+                    os.path.getsize(self.baseFilename) > 0:
+                self._compress_backups()
+                name = '{}.{}'.format(self.baseFilename,
+                                      strftime('%Y%m%d-%H%M%S'))
+                suffix = 0
+                while glob.glob(glob.escape(name) + '*'):
+                    suffix += 1
+                    name = '{}.{}.{}'.format(self.baseFilename,
+                                             strftime('%Y%m%d-%H%M%S'),
+                                             suffix)
+                os.rename(self.baseFilename, name)
+                self._delete_old()
+        self.rotate_at = self._next_rotation()
+
+    def _next_rotation(self) -> float:
+        return time() + self.rotate_seconds
+
+    def _rotated_elsewhere(self) -> bool:
+        try:
+            stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        return (stat.st_dev, stat.st_ino) != self._file_id
+
+    def _close_stream(self) -> None:
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+    def _backups(self) -> List[str]:
+        return sorted(glob.glob(glob.escape(self.baseFilename) + '.[0-9]*'),
+                      key=os.path.getmtime)
+
+    def _compress_backups(self) -> None:
+        for name in self._backups():
+            if name.endswith('.gz') or \
+                    os.path.getmtime(name) > time() - COMPRESS_AFTER:
+                continue
+            with open(name, 'rb') as src, gzip.open(name + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            # Keep the time of the last record, backups are sorted by it
+            stat = os.stat(name)
+            os.utime(name + '.gz', (stat.st_atime, stat.st_mtime))
+            os.remove(name)
+
+    def _delete_old(self) -> None:
+        if not self.backup_count:
+            return
+        for old in self._backups()[:-self.backup_count]:
+            os.remove(old)
+
+
+def parse_levels(levels: str) -> Dict[str, int]:
+    '''
+    Parse 'logger=LEVEL,other.logger=LEVEL' into a dict of levels.\n
+    '''
+    parsed = {}
+    for item in filter(None, (part.strip() for part in levels.split(','))):
+        name, _, level = item.partition('=')
+        parsed[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {name: level for name, level in parsed.items()
+            if isinstance(level, int)}
+
+
 class Logger(object):
     '''
     Class used for logging messages.\n
+    Records are put on a queue and written to the file by a background
+    thread, so logging never waits on the disk.\n
     @author npcompletenate & mihaivaduva
     '''
 
     __instance = None
+    __instance_lock = Lock()
 
     @staticmethod
     def get_instance():
         if Logger.__instance is None:
-            with Lock():
+            with Logger.__instance_lock:
                 if Logger.__instance is None:
                     Logger()
         return Logger.__instance
 
-    def __init__(self, level: int = logging.INFO):
+    def __init__(self, level: int = None):
         '''
         Initializes a logger object. Should not be run from outside of this
         class, as the logger is a singleton.
         params:
-                level - log level to use. defaults to INFO
+                level - log level to use. defaults to the LOG_LEVEL config
         '''
         if Logger.__instance is not None:
             raise SingletonAccessException("This class is a singleton!")
 
-        filename = 'application.log'
-        filemode = 'w'
+        config = app.config
         fmat = "%(asctime)s;%(levelname)s;%(message)s"
         datefmt = "%Y-%m-%d %H:%M:%S"
 
+        handler = CompressedRotatingFileHandler(
+            config.get('LOG_FILE', 'application.log'),
+            max_bytes=config.get('LOG_MAX_BYTES', 0),
+            rotate_seconds=config.get('LOG_ROTATE_SECONDS', 0),
+            backup_count=config.get('LOG_BACKUP_COUNT', 0))
+        if config.get('LOG_FORMAT') == 'json':
+            handler.setFormatter(JsonFormatter(datefmt=datefmt))
+        else:
+            handler.setFormatter(logging.Formatter(fmat, datefmt))
+
         # initialize the logger
-        logging.basicConfig(
-            level=level,
-            format=fmat,
-            filename=filename,
-            filemode=filemode,
-            datefmt=datefmt
-            )
-        self.log = logging.getLogger()
+        self.queue_handler = QueueHandler(SimpleQueue())
+        self.listener = QueueListener(self.queue_handler.queue, handler,
+                                      respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child=self._restart)
+
+        root = logging.getLogger()
+        root.addHandler(self.queue_handler)
+        if level is None:
+            level = str(config.get('LOG_LEVEL', 'INFO')).upper()
+        root.setLevel(level)
+        for name, module_level in \
+                parse_levels(config.get('LOG_LEVELS', '')).items():
+            logging.getLogger(name).setLevel(module_level)
+
+        self.log = logging.getLogger('autograder')
         Logger.__instance = self
 
+    def stop(self) -> None:
+        '''
+        Write out the records still queued and stop the writing thread.
+        '''
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def _restart(self) -> None:
+        # The writing thread doesn't survive a fork (e.g. gunicorn --preload)
+        self.queue_handler.queue = self.listener.queue = SimpleQueue()
+        self.listener._thread = None
+        self.listener.start()
+
     def logged_in(self, u: User) -> None:
         '''
         Writes log message for when a user logs in.\n
@@ -188,12 +372,15 @@ class Logger(object):
                   f'{assignment_name}.'
         self.log.info(message)
 
-    def custom_msg(self, msg: str, level: int = logging.DEBUG) -> None:
+    def custom_msg(self, msg: str, level: int = logging.DEBUG,
+                   **fields) -> None:
         '''
         Logs a custom message.
         params:
                 msg - message to log
                 level - what logging level to use. If not given, defaults to
                 DEBUG
+                fields - extra values to log with the message, written as
+                their own keys with LOG_FORMAT=json
         '''
-        self.log.log(level, msg)
+        self.log.log(level, msg, extra=fields)
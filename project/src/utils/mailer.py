@@ -1,12 +1,451 @@
+import atexit
+import json
+import os
 import ssl
-from os import getenv
 import smtplib as slib
-from threading import Lock
+from email.message import EmailMessage
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, \
+    Union
+from uuid import uuid4
 
+from flask import Flask
 
 from .logger import LogLevels, Logger
 from .exceptions import SingletonAccessException
 
+# Seconds to wait for the SMTP server before giving up on a connection.
+SMTP_TIMEOUT = 30
+# Seconds a connection is kept open without anything to send.
+IDLE_TIMEOUT = 60
+# Seconds after which an open connection is checked with a NOOP before use.
+NOOP_AFTER = 10
+# Number of times a message is tried before it is left for the next start.
+MAX_ATTEMPTS = 5
+# Seconds to wait before the first retry, doubled on every retry.
+RETRY_BACKOFF = 1.0
+# Seconds send_async waits for room in a full queue.
+SUBMIT_TIMEOUT = 1.0
+
+
+def getenv_or_none(name: str) -> Optional[str]:
+    return os.getenv(name) or None
+
+
+class MailSettings(NamedTuple):
+    '''
+    Where and how to send emails from.
+    '''
+    host: str = 'smtp.gmail.com'
+    port: int = 465
+    use_ssl: bool = True
+    username: Optional[str] = None
+    password: Optional[str] = None
+    workers: int = 2
+    queue_size: int = 1000
+    batch_size: int = 50
+    spool_dir: Optional[str] = 'mail_spool'
+
+    @staticmethod
+    def from_config(config: Dict) -> 'MailSettings':
+        '''
+        Read the settings from the MAIL_* keys of a flask config (or of the
+        environment variables the Config reads them from).\n
+        '''
+        default = MailSettings()
+        return MailSettings(
+            host=config.get('MAIL_SERVER', default.host),
+            port=int(config.get('MAIL_PORT', default.port)),
+            use_ssl=bool(config.get('MAIL_USE_SSL', default.use_ssl)),
+            username=config.get('MAIL_USERNAME', getenv_or_none('AG_EMAIL')),
+            password=config.get('MAIL_PASSWORD',
+                                getenv_or_none('AG_PASSWORD')),
+            workers=int(config.get('MAIL_WORKERS', default.workers)),
+            queue_size=int(config.get('MAIL_QUEUE_SIZE',
+                                      default.queue_size)),
+            batch_size=int(config.get('MAIL_BATCH_SIZE',
+                                      default.batch_size)),
+            spool_dir=config.get('MAIL_SPOOL_DIR', default.spool_dir))
+
+
+def build_message(sender: str, to: Union[str, List[str]], subject: str,
+                  body: str) -> EmailMessage:
+    '''
+    Build a plain text email.\n
+    '''
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    if sender:
+        msg['From'] = sender
+    msg['To'] = to if isinstance(to, str) else ', '.join(to)
+    msg.set_content(body)
+    return msg
+
+
+class SmtpConnection(object):
+    '''
+    An authenticated SMTP connection which is reused for many messages. It
+    is opened on first use and after a failure, and checked with a NOOP
+    when it hasn't been used for a while. Not thread safe, every sending
+    thread keeps its own.
+    '''
+
+    def __init__(self, settings: MailSettings):
+        self.settings = settings
+        self._smtp = None
+        self._used_at = 0.0
+
+    def send(self, msg: EmailMessage) -> None:
+        '''
+        Send a message, opening the connection if needed. Raises the
+        smtplib exceptions (or OSError) on failure.\n
+        '''
+        self._ensure_open()
+        self._smtp.send_message(msg, self.settings.username or '')
+        self._used_at = monotonic()
+
+    def close(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (slib.SMTPException, OSError):
+            pass
+        self._smtp = None
+
+    def _ensure_open(self) -> None:
+        if self._smtp is not None and \
+                monotonic() - self._used_at > NOOP_AFTER:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self.close()
+            except (slib.SMTPException, OSError):
+                self._smtp = None
+        if self._smtp is not None:
+            return
+
+        s = self.settings
+        if s.use_ssl:
+            smtp = slib.SMTP_SSL(s.host, s.port, timeout=SMTP_TIMEOUT,
+                                 context=ssl.create_default_context())
+        else:
+            smtp = slib.SMTP(s.host, s.port, timeout=SMTP_TIMEOUT)
+        try:
+            if s.username:
+                smtp.login(s.username, s.password)
+                msglg = 'Login attempt for donotreply account successful'
+                Logger.get_instance().custom_msg(msglg)
+        except BaseException:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._used_at = monotonic()
+
+
+class _Spool(object):
+    '''
+    Keeps every message not delivered yet as a JSON file, so that they are
+    sent after a restart. Files are named <pid>-<id>.json after the process
+    which owns them; the files of processes which are gone are taken over
+    (with an atomic rename, so only one process gets each of them).
+    '''
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, msg: Dict) -> None:
+        if not self.directory:
+            return
+        path = self._path(msg['id'])
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(msg, f)
+        os.replace(tmp, path)
+
+    def remove(self, msg: Dict) -> None:
+        if not self.directory:
+            return
+        try:
+            os.remove(self._path(msg['id']))
+        except FileNotFoundError:
+            pass
+
+    def recover(self) -> List[Dict]:
+        '''
+        Take over the messages left by processes which are not running.\n
+        '''
+        if not self.directory:
+            return []
+        recovered = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.json') or '-' not in name:
+                continue
+            owner, msg_id = name[:-len('.json')].split('-', 1)
+            if owner.isdigit() and int(owner) != os.getpid() and \
+                    _is_running(int(owner)):
+                continue
+            try:
+                os.rename(os.path.join(self.directory, name),
+                          self._path(msg_id))
+                with open(self._path(msg_id)) as f:
+                    recovered.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return recovered
+
+    def _path(self, msg_id: str) -> str:
+        return os.path.join(self.directory,
+                            '{}-{}.json'.format(os.getpid(), msg_id))
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MailDispatcher(object):
+    '''
+    Sends emails in the background.\n
+    Messages go through a bounded queue to a few worker threads, each of
+    which keeps an SMTP connection open and sends whatever is queued in
+    batches over it. Failed sends are retried with exponential backoff on a
+    new connection. Every message is spooled to disk until it is delivered,
+    so the ones still queued when the process stops are sent by the next
+    one.
+    '''
+
+    __instance = None
+    __instance_lock = Lock()
+
+    @staticmethod
+    def get_instance():
+        if MailDispatcher.__instance is None:
+            with MailDispatcher.__instance_lock:
+                if MailDispatcher.__instance is None:
+                    MailDispatcher()
+        return MailDispatcher.__instance
+
+    def __init__(self):
+        '''
+        Initializes the dispatcher. Should not be run from outside of this
+        class, as the dispatcher is a singleton.
+        '''
+        if MailDispatcher.__instance is not None:
+            raise SingletonAccessException("This class is a singleton!")
+
+        self.settings = MailSettings.from_config({})
+        self._lock = Lock()
+        self._queue: Optional[Queue] = None
+        self._spool: Optional[_Spool] = None
+        self._threads: List[Thread] = []
+        self._recovery: Optional[Thread] = None
+        self._pid = None
+        self._fork_hook = False
+        self._listeners: List[Callable[[List[Tuple[Dict, bool]]], None]] = []
+        atexit.register(self.stop)
+        MailDispatcher.__instance = self
+
+    def init_app(self, app: Flask) -> None:
+        '''
+        Configure the dispatcher from the MAIL_* keys of the app config and
+        start the workers, which send what the processes that stopped left
+        in the spool. A forked process (e.g. a gunicorn worker) starts its
+        own workers right after the fork.\n
+        '''
+        self.stop()
+        self.settings = MailSettings.from_config(app.config)
+        if not self._fork_hook:
+            os.register_at_fork(after_in_child=self._after_fork)
+            self._fork_hook = True
+        self._ensure_started()
+
+    def add_listener(self, listener: Callable[[List[Tuple[Dict, bool]]],
+                                              None]) -> None:
+        '''
+        Call listener from the worker threads after every batch, with the
+        messages of the batch which were sent or given up on and whether
+        they were sent. Messages left for the next start are not reported.\n
+        '''
+        self._listeners.append(listener)
+
+    def submit(self, to: Union[str, List[str]], subject: str,
+               body: str, job_id: Optional[int] = None,
+               timeout: Optional[float] = SUBMIT_TIMEOUT) -> bool:
+        '''
+        Queue an email.\n
+        Inputs:\n
+        to --> The address (or list of addresses) to send to.\n
+        subject --> The subject of the email.\n
+        body --> The plain text message.\n
+        job_id --> (optional) Passed along to the listeners, to keep track
+        of the progress of a bulk send.\n
+        timeout --> Seconds to wait for room in a full queue, None to wait
+        until there is some (for background senders, not requests).\n
+        Return:\n
+        Whether the email was queued, False if the queue stayed full.\n
+        '''
+        self._ensure_started()
+        msg = {'id': uuid4().hex, 'to': to, 'subject': subject,
+               'body': body, 'job_id': job_id}
+        self._spool.write(msg)
+        try:
+            self._queue.put(msg, timeout=timeout)
+        except Full:
+            self._spool.remove(msg)
+            return False
+        return True
+
+    def join(self) -> None:
+        '''
+        Wait until everything queued so far (and recovered from the spool)
+        was sent or given up on.\n
+        '''
+        if self._recovery is not None:
+            self._recovery.join()
+        if self._queue is not None:
+            self._queue.join()
+
+    def stop(self, timeout: float = 5) -> None:
+        '''
+        Send what is already queued (for at most timeout seconds) and stop
+        the workers. Anything left stays spooled for the next start.\n
+        '''
+        with self._lock:
+            queue, threads = self._queue, self._threads
+            if queue is None or self._pid != os.getpid():
+                self._queue, self._threads, self._pid = None, [], None
+                self._recovery = None
+                return
+            for _ in threads:
+                queue.put(None)
+            deadline = monotonic() + timeout
+            for thread in threads:
+                thread.join(max(deadline - monotonic(), 0))
+            self._queue, self._threads, self._pid = None, [], None
+            self._recovery = None
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            settings = self.settings
+            self._queue = Queue(maxsize=settings.queue_size)
+            self._spool = _Spool(settings.spool_dir)
+            self._threads = [Thread(target=self._work,
+                                    args=(self._queue, settings),
+                                    daemon=True, name='mail-%d' % i)
+                             for i in range(max(settings.workers, 1))]
+            for thread in self._threads:
+                thread.start()
+            # Taken over before anything new is spooled. There can be more
+            # than fits in the queue, fed to it as the workers make room.
+            self._recovery = Thread(target=self._requeue,
+                                    args=(self._queue,
+                                          self._spool.recover()),
+                                    daemon=True, name='mail-recover')
+            self._recovery.start()
+            self._pid = os.getpid()
+
+    def _after_fork(self) -> None:
+        # The threads of the parent are gone, and so is whoever held the
+        # lock when it forked.
+        self._lock = Lock()
+        self._ensure_started()
+
+    @staticmethod
+    def _requeue(queue: Queue, msgs: List[Dict]) -> None:
+        for msg in msgs:
+            queue.put(msg)
+
+    def _work(self, queue: Queue, settings: MailSettings) -> None:
+        conn = SmtpConnection(settings)
+        stopping = False
+        while not stopping:
+            try:
+                batch = [queue.get(timeout=IDLE_TIMEOUT)]
+            except Empty:
+                conn.close()
+                continue
+            while len(batch) < settings.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(queue.get_nowait())
+                except Empty:
+                    break
+            results = []
+            for msg in batch:
+                try:
+                    if msg is None:
+                        stopping = True
+                        continue
+                    sent = self._deliver(conn, msg)
+                    if sent is not None:
+                        results.append((msg, sent))
+                except Exception as e:
+                    Logger.get_instance().custom_msg(
+                        f'Could not send email to {msg["to"]}: {e}',
+                        LogLevels.ERR)
+                finally:
+                    queue.task_done()
+            self._notify(results)
+        conn.close()
+
+    def _notify(self, results: List[Tuple[Dict, bool]]) -> None:
+        if not results:
+            return
+        for listener in self._listeners:
+            try:
+                listener(results)
+            except Exception as e:
+                Logger.get_instance().custom_msg(
+                    f'Mail listener failed: {e}', LogLevels.ERR)
+
+    def _deliver(self, conn: SmtpConnection, msg: Dict) -> Optional[bool]:
+        '''
+        Send a message. Returns whether it was sent, or None if it was left
+        in the spool to be retried on the next start.\n
+        '''
+        logger = Logger.get_instance()
+        email = build_message(conn.settings.username, msg['to'],
+                              msg['subject'], msg['body'])
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                conn.send(email)
+                self._spool.remove(msg)
+                logger.custom_msg(f'Successfully sent email to {msg["to"]}',
+                                  LogLevels.INFO)
+                return True
+            except (slib.SMTPRecipientsRefused, slib.SMTPSenderRefused):
+                break
+            except slib.SMTPResponseException as e:
+                if e.smtp_code >= 500 and \
+                        not isinstance(e, slib.SMTPAuthenticationError):
+                    break
+                conn.close()
+            except (slib.SMTPException, OSError):
+                conn.close()
+            if attempt < MAX_ATTEMPTS - 1:
+                sleep(RETRY_BACKOFF * 2 ** attempt)
+        else:
+            logger.custom_msg(f'Could not send email to {msg["to"]}, will '
+                              'retry on the next start', LogLevels.ERR)
+            return None
+        # Rejected for good, retrying won't help
+        self._spool.remove(msg)
+        logger.custom_msg(f'Email to {msg["to"]} was rejected',
+                          LogLevels.ERR)
+        return False
+
 
 class MailUtil(object):
     '''
@@ -26,15 +465,12 @@ class MailUtil(object):
 
         if MailUtil.__instance is not None:
             raise SingletonAccessException("This class is a singleton!")
-        self.email = getenv('AG_EMAIL')
-        self.passwd = getenv('AG_PASSWORD')
-        self.host = 'smtp.gmail.com'
-        self.port = 465
         MailUtil.__instance = self
 
     def send(self, to: [str], subject: str, body: str) -> bool:
         '''
-        Util function for sending an email to any number of users
+        Util function for sending an email to any number of users, waiting
+        until it is sent. Prefer send_async in request handlers.
         @author shaeli and rahul
         Params:
             to      - email address to send to
@@ -42,22 +478,33 @@ class MailUtil(object):
             body    - message
         Return: True on successful send, false otherwise
         '''
-
+        settings = MailDispatcher.get_instance().settings
+        conn = SmtpConnection(settings)
         try:
-            context = ssl.create_default_context()
-            with slib.SMTP_SSL(self.host, self.port, context=context) as srvr:
-                srvr.login(self.email, self.passwd)
-                msglg = 'Login attempt for donotreply account successful'
-                Logger.get_instance().custom_msg(msglg)
-
-                message = f'Subject: {subject}\n\n{body}'
-                srvr.sendmail(self.email, to, message)
-                msglg = f'Successfully sent email to {to}'
-                Logger.get_instance().custom_msg(msglg, LogLevels.INFO)
-
+            conn.send(build_message(settings.username, to, subject, body))
+            msglg = f'Successfully sent email to {to}'
+            Logger.get_instance().custom_msg(msglg, LogLevels.INFO)
             return True
 
         except slib.SMTPAuthenticationError:
             msglg = 'Login attempt for donotreply account unsuccessful'
             Logger.get_instance().custom_msg(msglg, LogLevels.ERR)
             return False
+        except (slib.SMTPException, OSError) as e:
+            msglg = f'Could not send email to {to}: {e}'
+            Logger.get_instance().custom_msg(msglg, LogLevels.ERR)
+            return False
+        finally:
+            conn.close()
+
+    def send_async(self, to: [str], subject: str, body: str) -> bool:
+        '''
+        Queue an email to be sent in the background by the MailDispatcher,
+        and return right away.
+        Params:
+            to      - email address to send to
+            subject - subject of the email
+            body    - message
+        Return: True if the email was queued, false if the queue is full
+        '''
+        return MailDispatcher.get_instance().submit(to, subject, body)
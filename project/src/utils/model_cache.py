@@ -0,0 +1,249 @@
+import select
+from functools import wraps
+from inspect import signature
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from flask import Flask
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .exceptions import SingletonAccessException
+from .unit_of_work import UnitOfWork
+
+# Default number of seconds an entry is served before it is looked up again.
+DEFAULT_TTL = 30
+
+# Seconds the cross-worker listener waits before reconnecting after an error.
+LISTEN_RETRY = 5
+
+
+def _key(args) -> Tuple[str, ...]:
+    # Arguments as strings, so that an id looked up as '5' (e.g. from the
+    # session cookie) and invalidated as 5 is the same entry.
+    return tuple(str(arg) for arg in args)
+
+
+class _Snapshot(object):
+    '''
+    The column values of a model object, so that a cached object can be
+    handed to any session without sharing ORM state between threads.
+    '''
+
+    def __init__(self, obj):
+        self.model = type(obj)
+        mapper = inspect(self.model)
+        self.identity = mapper.identity_key_from_instance(obj)
+        self.values = {attr.key: getattr(obj, attr.key)
+                       for attr in mapper.column_attrs}
+
+    def revive(self, session):
+        # The session may already hold the object, with changes the cache
+        # doesn't know about yet. Copying the snapshot over it would undo
+        # them.
+        current = session.identity_map.get(self.identity)
+        if current is not None:
+            return current
+        obj = inspect(self.model).class_manager.new_instance()
+        for key, value in self.values.items():
+            set_committed_value(obj, key, value)
+        make_transient_to_detached(obj)
+        return session.merge(obj, load=False)
+
+
+class ModelCache(object):
+    '''
+    Process-wide cache with a TTL for lookups of rows which are read on
+    nearly every request but almost never change (queue settings and the
+    queue of a course).\n
+    Every gunicorn worker keeps its own copy. Writers call invalidate, which
+    clears the local copy and, once the changes are committed, when
+    MODEL_CACHE_CHANNEL is set on Postgres, tells the other workers to do
+    the same through LISTEN/NOTIFY. Without the channel other workers catch
+    up after at most TTL seconds. Nothing read while a request has changes
+    left to commit is cached, as they may still be rolled back.
+    '''
+
+    __instance = None
+    __instance_lock = Lock()
+
+    @staticmethod
+    def get_instance():
+        if ModelCache.__instance is None:
+            with ModelCache.__instance_lock:
+                if ModelCache.__instance is None:
+                    ModelCache()
+        return ModelCache.__instance
+
+    def __init__(self):
+        '''
+        Initializes the cache. Should not be run from outside of this class,
+        as the cache is a singleton.
+        '''
+        if ModelCache.__instance is not None:
+            raise SingletonAccessException("This class is a singleton!")
+
+        self._lock = Lock()
+        self._entries: Dict[str, Dict[Tuple, Tuple[float, Any]]] = {}
+        self._db = None
+        self._ttl = DEFAULT_TTL
+        self._channel: Optional[str] = None
+        self._listener_lock = Lock()
+        self._listener = None
+        ModelCache.__instance = self
+
+    def init_app(self, app: Flask, db) -> None:
+        '''
+        Configure the cache from MODEL_CACHE_TTL and MODEL_CACHE_CHANNEL.
+        Until this is called, the cached lookups go straight to the
+        database.\n
+        '''
+        self._db = db
+        self._ttl = app.config.get('MODEL_CACHE_TTL', DEFAULT_TTL)
+        channel = app.config.get('MODEL_CACHE_CHANNEL')
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+        self._channel = channel if channel and \
+            uri.startswith(('postgres', 'postgresql')) else None
+        if self._channel:
+            # The listener thread has to be started in every worker, after
+            # gunicorn forked it, so do it lazily on the first request.
+            app.before_request(self._ensure_listener)
+
+    def cached(self, namespace: str, ttl: Optional[int] = None,
+               max_size: Optional[int] = None) -> Callable:
+        '''
+        Decorator for a lookup returning a model object, a plain value or
+        None. Results other than None are kept for TTL seconds (or ttl if
+        given) under the namespace, which is what invalidate takes. With
+        max_size, the least recently used entries are dropped to keep at
+        most that many.\n
+        '''
+        def decorator(func: Callable) -> Callable:
+            sig = signature(func)
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                lifetime = self._ttl if ttl is None else ttl
+                if self._db is None or lifetime <= 0:
+                    return func(*args, **kwargs)
+
+                bound = sig.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = _key(bound.arguments.values())
+                now = monotonic()
+                with self._lock:
+                    entries = self._entries.get(namespace, {})
+                    entry = entries.pop(key, None)
+                    if entry is not None and entry[0] > now:
+                        # Most recently used last
+                        entries[key] = entry
+                if entry is not None and entry[0] > now:
+                    value = entry[1]
+                    if isinstance(value, _Snapshot):
+                        return value.revive(self._db.session)
+                    return value
+
+                result = func(*args, **kwargs)
+                if result is not None and not UnitOfWork.pending():
+                    value = (_Snapshot(result)
+                             if hasattr(result, '__table__') else result)
+                    with self._lock:
+                        entries = self._entries.setdefault(namespace, {})
+                        entries[key] = (now + lifetime, value)
+                        while max_size and len(entries) > max_size:
+                            del entries[next(iter(entries))]
+                return result
+
+            return wrapper
+        return decorator
+
+    def invalidate(self, *namespaces: str) -> None:
+        '''
+        Drop the given namespaces (or everything if none are given) in this
+        worker right away, and again once the changes of the request are
+        committed, in the other workers too if enabled.\n
+        '''
+        self._clear(namespaces)
+        UnitOfWork.on_commit(self._committed, namespaces)
+
+    def invalidate_entry(self, namespace: str, *args) -> None:
+        '''
+        Drop the entry of a namespace cached for the given arguments, as
+        invalidate does.\n
+        '''
+        self.invalidate(namespace + '=' + ':'.join(_key(args)))
+
+    def _committed(self, namespaces) -> None:
+        # Other threads of this worker may have cached the rows as they
+        # were before the commit.
+        self._clear(namespaces)
+        if self._channel:
+            self._publish(','.join(namespaces))
+
+    def _clear(self, namespaces) -> None:
+        with self._lock:
+            if not namespaces:
+                self._entries.clear()
+            for namespace in namespaces:
+                namespace, _, key = namespace.partition('=')
+                if key:
+                    self._entries.get(namespace, {}).pop(
+                        tuple(key.split(':')), None)
+                else:
+                    self._entries.pop(namespace, None)
+
+    def _publish(self, payload: str) -> None:
+        try:
+            with self._db.engine.connect() as conn:
+                conn.execution_options(autocommit=True).execute(
+                    text('SELECT pg_notify(:channel, :payload)'),
+                    channel=self._channel, payload=payload)
+        except Exception:
+            # The other workers will still expire the entries after the TTL.
+            pass
+
+    def _ensure_listener(self) -> None:
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._listener_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = Thread(target=self._listen, daemon=True,
+                                        name='model-cache-listener')
+                self._listener.start()
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                # Keep the LISTEN session out of the pool, so closing it really
+                # closes it instead of handing it to a request.
+                conn = self._db.engine.raw_connection()
+                conn.detach()
+                try:
+                    conn.set_isolation_level(0)
+                    cur = conn.cursor()
+                    cur.execute('LISTEN "{}"'.format(self._channel))
+                    # Anything may have changed while we were not listening.
+                    self._clear(())
+                    self._wait_for_notifications(conn.connection)
+                finally:
+                    conn.close()
+            except Exception:
+                sleep(LISTEN_RETRY)
+
+    def _wait_for_notifications(self, pg_conn) -> None:
+        while True:
+            if select.select([pg_conn], [], [], LISTEN_RETRY) == \
+                    ([], [], []):
+                continue
+            pg_conn.poll()
+            while pg_conn.notifies:
+                notify = pg_conn.notifies.pop(0)
+                self._clear(tuple(n for n in notify.payload.split(',')
+                                  if n))
+
+
+# The decorator the models use, @cached(...). Bound to a name because
+# Python 3.8 only takes a dotted name after @, not a call chain.
+cached = ModelCache.get_instance().cached
@@ -0,0 +1,189 @@
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, Optional
+
+from sortedcontainers import SortedList
+
+from .dispatch_policy import DispatchPolicy, FifoPolicy, PendingEntry, \
+    build_order
+from .exceptions import SingletonAccessException
+
+# Number of seconds a queue's index is trusted before it gets rebuilt from the
+# database. Every gunicorn worker keeps its own copy and only sees the writes
+# it made itself, so this bounds how far a copy can drift from the DB.
+REBUILD_INTERVAL = 30
+
+# A loader returns the PendingEntry of every pending ticket of the queue it
+# is called with.
+Loader = Callable[[int], Iterable[PendingEntry]]
+
+FIFO = FifoPolicy()
+
+
+class PendingTicketIndex(object):
+    '''
+    In-memory index of the pending tickets of every queue, ordered by
+    (created_at, id) and by the key of every DispatchPolicy in use.\n
+    Tickets are added and removed as they change status, so position, size
+    and next ticket queries are answered in O(log n) without a database
+    round trip. A queue is (re)built from the database on first use, after
+    REBUILD_INTERVAL seconds, or when a ticket it should know about is
+    missing.
+    '''
+
+    __instance = None
+    __instance_lock = Lock()
+
+    @staticmethod
+    def get_instance():
+        if PendingTicketIndex.__instance is None:
+            with PendingTicketIndex.__instance_lock:
+                if PendingTicketIndex.__instance is None:
+                    PendingTicketIndex()
+        return PendingTicketIndex.__instance
+
+    def __init__(self):
+        '''
+        Initializes the index. Should not be run from outside of this class,
+        as the index is a singleton.
+        '''
+        if PendingTicketIndex.__instance is not None:
+            raise SingletonAccessException("This class is a singleton!")
+
+        self._lock = Lock()
+        self._entries: Dict[int, Dict[int, PendingEntry]] = {}
+        self._orders: Dict[int, Dict[str, SortedList]] = {}
+        self._built_at: Dict[int, float] = {}
+        self._policies: Dict[str, DispatchPolicy] = {FIFO.name: FIFO}
+        PendingTicketIndex.__instance = self
+
+    def rebuild(self, queue_id: int, entries: Iterable[PendingEntry]) -> None:
+        '''
+        Replace the index of a queue with the given pending tickets.\n
+        Inputs:\n
+        queue_id --> The queue to rebuild.\n
+        entries --> The PendingEntry of each of its pending tickets.\n
+        '''
+        entries = {entry.ticket_id: entry for entry in entries}
+        with self._lock:
+            self._entries[queue_id] = entries
+            self._orders[queue_id] = {
+                name: build_order(policy, entries.values())
+                for name, policy in self._policies.items()}
+            self._built_at[queue_id] = monotonic()
+
+    def invalidate(self, queue_id: int = None) -> None:
+        '''
+        Drop the index of a queue (or of every queue) so that the next query
+        rebuilds it from the database.\n
+        '''
+        with self._lock:
+            if queue_id is None:
+                self._entries.clear()
+                self._orders.clear()
+                self._built_at.clear()
+            else:
+                self._entries.pop(queue_id, None)
+                self._orders.pop(queue_id, None)
+                self._built_at.pop(queue_id, None)
+
+    def add(self, queue_id: int, entry: PendingEntry) -> None:
+        '''
+        Add a ticket that became pending, or update one that changed. Queues
+        which are not loaded yet are left alone, they will be built with the
+        ticket in them.\n
+        '''
+        with self._lock:
+            entries = self._entries.get(queue_id)
+            if entries is None:
+                return
+            self._discard(queue_id, entry.ticket_id)
+            entries[entry.ticket_id] = entry
+            for name, order in self._orders[queue_id].items():
+                order.add(self._policies[name].key(entry))
+
+    def remove(self, queue_id: int, ticket_id: int) -> None:
+        '''
+        Remove a ticket that is no longer pending.\n
+        '''
+        with self._lock:
+            if queue_id in self._entries:
+                self._discard(queue_id, ticket_id)
+
+    def position(self, queue_id: int, ticket_id: int,
+                 loader: Loader) -> Optional[int]:
+        '''
+        Get the position of a pending ticket in its queue. Only ask for
+        tickets known to be pending: one missing from the index means the
+        index is behind (another worker added it), and the queue is rebuilt
+        from the database.\n
+        Inputs:\n
+        queue_id --> The queue the ticket is in.\n
+        ticket_id --> The ticket to look for.\n
+        loader --> Used to (re)build the queue from the database.\n
+        Returns:\n
+        The position of the ticket (start from 1), None if it isn't pending.\n
+        '''
+        if self._ensure_built(queue_id, loader):
+            return self._position(queue_id, ticket_id)
+        pos = self._position(queue_id, ticket_id)
+        if pos is None:
+            self.rebuild(queue_id, loader(queue_id))
+            pos = self._position(queue_id, ticket_id)
+        return pos
+
+    def size(self, queue_id: int, loader: Loader) -> int:
+        '''
+        Get the number of pending tickets in a queue.\n
+        '''
+        self._ensure_built(queue_id, loader)
+        with self._lock:
+            return len(self._entries.get(queue_id, ()))
+
+    def peek(self, queue_id: int, policy: DispatchPolicy, loader: Loader,
+             room: str = None) -> Optional[int]:
+        '''
+        Get the ticket a policy would hand out next, without removing it.\n
+        Inputs:\n
+        queue_id --> The queue to look at.\n
+        policy --> The DispatchPolicy to pick with.\n
+        loader --> Used to (re)build the queue from the database.\n
+        room --> The room of the grader, for the policies that use it.\n
+        Returns:\n
+        The id of the ticket, None if the queue has no pending ticket.\n
+        '''
+        self._ensure_built(queue_id, loader)
+        with self._lock:
+            if queue_id not in self._entries:
+                return None
+            if self._policies.get(policy.name) is not policy:
+                # First use of the policy, order every loaded queue by it.
+                self._policies[policy.name] = policy
+                for q_id, orders in self._orders.items():
+                    orders[policy.name] = build_order(
+                        policy, self._entries[q_id].values())
+            return policy.pick(self._orders[queue_id], room)
+
+    def _discard(self, queue_id: int, ticket_id: int) -> None:
+        entry = self._entries[queue_id].pop(ticket_id, None)
+        if entry is None:
+            return
+        for name, order in self._orders[queue_id].items():
+            order.remove(self._policies[name].key(entry))
+
+    def _position(self, queue_id: int, ticket_id: int) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(queue_id, {}).get(ticket_id)
+            if entry is None:
+                return None
+            order = self._orders[queue_id][FIFO.name]
+            return order.index(FIFO.key(entry)) + 1
+
+    def _ensure_built(self, queue_id: int, loader: Loader) -> bool:
+        # Whether the queue was (re)built just now
+        with self._lock:
+            built_at = self._built_at.get(queue_id)
+        if built_at is None or monotonic() - built_at > REBUILD_INTERVAL:
+            self.rebuild(queue_id, loader(queue_id))
+            return True
+        return False
@@ -0,0 +1,100 @@
+import os
+from threading import Lock
+from typing import Dict
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.pool import Pool, QueuePool
+
+from .exceptions import SingletonAccessException
+
+
+class PoolMetrics(object):
+    '''
+    Counts what the connection pool of this worker does, from the pool
+    events: connections opened (churn, if it keeps growing), checkouts,
+    connections thrown away because they were dead or too old, and the
+    most connections in use at once. Together with the current state of
+    the pool, this tells whether the workers wait on connections
+    (saturation close to 1) or the pool is bigger than it needs to be.\n
+    The counts start over in every forked worker.
+    '''
+
+    __instance = None
+    __instance_lock = Lock()
+
+    @staticmethod
+    def get_instance():
+        if PoolMetrics.__instance is None:
+            with PoolMetrics.__instance_lock:
+                if PoolMetrics.__instance is None:
+                    PoolMetrics()
+        return PoolMetrics.__instance
+
+    def __init__(self):
+        if PoolMetrics.__instance is not None:
+            raise SingletonAccessException("This class is a singleton!")
+        self._lock = Lock()
+        self._db = None
+        self._max_overflow = 0
+        self._reset()
+        PoolMetrics.__instance = self
+
+    def init_app(self, app: Flask, db) -> None:
+        '''
+        Start counting, for the pools of every engine.\n
+        '''
+        self._db = db
+        self._max_overflow = app.config.get(
+            'SQLALCHEMY_ENGINE_OPTIONS', {}).get('max_overflow', 0)
+        if not event.contains(Pool, 'checkout', self._checkout):
+            event.listen(Pool, 'connect', self._connect)
+            event.listen(Pool, 'checkout', self._checkout)
+            event.listen(Pool, 'checkin', self._checkin)
+            event.listen(Pool, 'invalidate', self._invalidate)
+            os.register_at_fork(after_in_child=self._reset)
+
+    def to_json(self) -> Dict:
+        '''
+        Get the counts and the state of the pool of the app's engine.
+        Needs an app context.\n
+        '''
+        pool = self._db.engine.pool
+        with self._lock:
+            ret = dict(self._counts)
+        ret['pool'] = pool.status()
+        if isinstance(pool, QueuePool):
+            capacity = pool.size() + max(self._max_overflow, 0)
+            ret['size'] = pool.size()
+            ret['max_overflow'] = self._max_overflow
+            ret['checked_out'] = pool.checkedout()
+            ret['overflow'] = max(pool.overflow(), 0)
+            ret['saturation'] = pool.checkedout() / capacity
+            ret['peak_saturation'] = ret['peak_checked_out'] / capacity
+        return ret
+
+    def _reset(self) -> None:
+        self._counts = {'connects': 0, 'checkouts': 0, 'invalidated': 0,
+                        'in_use': 0, 'peak_checked_out': 0}
+
+    def _connect(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self._counts['connects'] += 1
+
+    def _checkout(self, dbapi_connection, connection_record,
+                  connection_proxy) -> None:
+        with self._lock:
+            counts = self._counts
+            counts['checkouts'] += 1
+            counts['in_use'] += 1
+            counts['peak_checked_out'] = max(counts['peak_checked_out'],
+                                             counts['in_use'])
+
+    def _checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self._counts['in_use'] = max(self._counts['in_use'] - 1, 0)
+
+    def _invalidate(self, dbapi_connection, connection_record,
+                    exception) -> None:
+        with self._lock:
+            self._counts['invalidated'] += 1
@@ -0,0 +1,197 @@
+import os
+import traceback
+from collections import Counter, deque
+from threading import Lock
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from flask import Flask, Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .exceptions import SingletonAccessException
+from .logger import Logger, LogLevels
+
+# Name of the attribute on flask.g holding the counters of the request
+_STATS = '_query_profile'
+
+# Default duration, in milliseconds, from which a statement is slow.
+DEFAULT_SLOW_MS = 100
+
+# Number of slow statements kept for the diagnostics route.
+SLOW_HISTORY = 100
+
+# Longest the bound parameters of a slow statement are written, in chars.
+MAX_PARAMS_LENGTH = 500
+
+# The call site of a statement is the innermost frame in these files.
+_SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class QueryProfiler(object):
+    '''
+    Counts the queries run while handling each request and the time spent
+    in them, using the SQLAlchemy engine events. Statements slower than
+    SLOW_QUERY_MS are logged with their parameters and the line of our code
+    which ran them.\n
+    Every request gets an X-Query-Profile header and a log line with its
+    counts, 'repeated' being the most times a single statement ran (a tell
+    of an N+1 pattern). The counts are also added up per endpoint, for the
+    diagnostics route.\n
+    Nothing is recorded unless QUERY_PROFILE or QUERY_DIAGNOSTICS is set.
+    '''
+
+    __instance = None
+    __instance_lock = Lock()
+
+    @staticmethod
+    def get_instance():
+        if QueryProfiler.__instance is None:
+            with QueryProfiler.__instance_lock:
+                if QueryProfiler.__instance is None:
+                    QueryProfiler()
+        return QueryProfiler.__instance
+
+    def __init__(self):
+        if QueryProfiler.__instance is not None:
+            raise SingletonAccessException("This class is a singleton!")
+        self.enabled = False
+        self._slow_seconds = DEFAULT_SLOW_MS / 1000
+        self._lock = Lock()
+        self._endpoints: Dict[str, Dict[str, float]] = {}
+        self._slow = deque(maxlen=SLOW_HISTORY)
+        QueryProfiler.__instance = self
+
+    def init_app(self, app: Flask) -> None:
+        '''
+        Start profiling if QUERY_PROFILE or QUERY_DIAGNOSTICS is set,
+        flagging the statements slower than SLOW_QUERY_MS.\n
+        '''
+        if not (app.config.get('QUERY_PROFILE') or
+                app.config.get('QUERY_DIAGNOSTICS')):
+            return
+        self.enabled = True
+        self._slow_seconds = \
+            app.config.get('SLOW_QUERY_MS', DEFAULT_SLOW_MS) / 1000
+        # Every engine, as the one of the app is only created on first use
+        if not event.contains(Engine, 'before_cursor_execute', self._before):
+            event.listen(Engine, 'before_cursor_execute', self._before)
+            event.listen(Engine, 'after_cursor_execute', self._after)
+        app.after_request(self._report)
+        app.teardown_request(self._teardown)
+
+    def endpoint_stats(self) -> List[Dict]:
+        '''
+        Get the totals of every endpoint since the start (or the last
+        reset), the ones spending the most time in the database first.\n
+        '''
+        with self._lock:
+            stats = [dict(totals, endpoint=endpoint)
+                     for endpoint, totals in self._endpoints.items()]
+        for totals in stats:
+            totals['queries_per_request'] = \
+                totals['queries'] / totals['requests']
+            totals['db_ms_per_request'] = \
+                totals['db_ms'] / totals['requests']
+        return sorted(stats, key=lambda totals: -totals['db_ms'])
+
+    def slow_queries(self) -> List[Dict]:
+        '''
+        Get the last slow statements, newest first.\n
+        '''
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def reset(self) -> None:
+        '''
+        Forget the totals and the slow statements.\n
+        '''
+        with self._lock:
+            self._endpoints.clear()
+            self._slow.clear()
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany) -> None:
+        if has_request_context():
+            conn.info.setdefault('query_start', []).append(perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany) -> None:
+        starts = conn.info.get('query_start')
+        if not starts or not has_request_context():
+            return
+        elapsed = perf_counter() - starts.pop()
+
+        stats = g.get(_STATS)
+        if stats is None:
+            stats = g.setdefault(_STATS, {'queries': 0, 'db_time': 0.0,
+                                          'slow': 0,
+                                          'statements': Counter()})
+        stats['queries'] += 1
+        stats['db_time'] += elapsed
+        stats['statements'][statement] += 1
+
+        if elapsed >= self._slow_seconds:
+            stats['slow'] += 1
+            self._record_slow(statement, parameters, elapsed)
+
+    def _record_slow(self, statement: str, parameters,
+                     elapsed: float) -> None:
+        params = repr(parameters)
+        if len(params) > MAX_PARAMS_LENGTH:
+            params = params[:MAX_PARAMS_LENGTH] + '...'
+        slow = {'endpoint': request.endpoint, 'ms': elapsed * 1000,
+                'statement': statement, 'parameters': params,
+                'call_site': _call_site()}
+        with self._lock:
+            self._slow.append(slow)
+        Logger.get_instance().custom_msg(
+            'slow query ({ms:.1f} ms) at {call_site} in {endpoint}: '
+            '{statement} {parameters}'.format(**slow), LogLevels.WARN,
+            **slow)
+
+    def _report(self, response: Response) -> Response:
+        stats = g.get(_STATS)
+        if stats is None:
+            return response
+        repeated = max(stats['statements'].values())
+        db_ms = stats['db_time'] * 1000
+        endpoint = request.endpoint or request.path
+        response.headers['X-Query-Profile'] = \
+            'queries={}; db_ms={:.1f}; repeated={}; slow={}'.format(
+                stats['queries'], db_ms, repeated, stats['slow'])
+
+        with self._lock:
+            totals = self._endpoints.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'db_ms': 0.0, 'slow': 0,
+                'max_queries': 0})
+            totals['requests'] += 1
+            totals['queries'] += stats['queries']
+            totals['db_ms'] += db_ms
+            totals['slow'] += stats['slow']
+            totals['max_queries'] = max(totals['max_queries'],
+                                        stats['queries'])
+
+        Logger.get_instance().custom_msg(
+            '{} {}: {} queries in {:.1f} ms, repeated {}'.format(
+                request.method, request.path, stats['queries'], db_ms,
+                repeated),
+            LogLevels.INFO if stats['slow'] else LogLevels.DEBUG,
+            endpoint=endpoint, queries=stats['queries'], db_ms=db_ms,
+            repeated=repeated, slow=stats['slow'])
+        return response
+
+    @staticmethod
+    def _teardown(exc) -> None:
+        g.pop(_STATS, None)
+
+
+def _call_site() -> Optional[str]:
+    # The innermost frame of our code, outside of this module
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(_SOURCE_DIR) and \
+                frame.filename != __file__:
+            return '{}:{} in {}'.format(
+                os.path.relpath(frame.filename, _SOURCE_DIR), frame.lineno,
+                frame.name)
+    return None
@@ -0,0 +1,64 @@
+from threading import Condition, Lock
+from typing import Dict
+
+from .exceptions import SingletonAccessException
+
+
+class QueueNotifier(object):
+    '''
+    Wakes up the streaming connections of a queue when something happens on
+    it (a TicketEvent is written or the queue is opened, locked or closed).\n
+    This only carries the signal, the changes themselves are read back from
+    the database, so a stream in one gunicorn worker still picks up writes
+    made by another one on its next poll.
+    '''
+
+    __instance = None
+    __instance_lock = Lock()
+
+    @staticmethod
+    def get_instance():
+        if QueueNotifier.__instance is None:
+            with QueueNotifier.__instance_lock:
+                if QueueNotifier.__instance is None:
+                    QueueNotifier()
+        return QueueNotifier.__instance
+
+    def __init__(self):
+        '''
+        Initializes the notifier. Should not be run from outside of this
+        class, as the notifier is a singleton.
+        '''
+        if QueueNotifier.__instance is not None:
+            raise SingletonAccessException("This class is a singleton!")
+
+        self._cond = Condition()
+        self._versions: Dict[int, int] = {}
+        QueueNotifier.__instance = self
+
+    def version(self, queue_id: int) -> int:
+        '''
+        Get the number of notifications sent so far for a queue.\n
+        '''
+        with self._cond:
+            return self._versions.get(queue_id, 0)
+
+    def notify(self, queue_id: int) -> None:
+        '''
+        Signal that something changed on a queue.\n
+        '''
+        with self._cond:
+            self._versions[queue_id] = self._versions.get(queue_id, 0) + 1
+            self._cond.notify_all()
+
+    def wait(self, queue_id: int, seen: int, timeout: float) -> int:
+        '''
+        Block until the queue moves past version `seen` or until timeout
+        seconds have elapsed.\n
+        Returns:\n
+        The current version of the queue.\n
+        '''
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._versions.get(queue_id, 0) != seen, timeout)
+            return self._versions.get(queue_id, 0)
@@ -0,0 +1,101 @@
+from functools import wraps
+from inspect import signature
+from typing import Callable, Tuple
+
+from flask import Flask, Response, current_app, g, has_request_context
+from sqlalchemy import inspect
+
+# Names of the attributes on flask.g holding the cache and its counters
+_CACHE = '_request_cache'
+_STATS = '_request_cache_stats'
+
+
+class RequestCache(object):
+    '''
+    Memoizes model lookups for the duration of a request.\n
+    The same course, enrollment or user is looked up many times while
+    handling a single request, this makes every lookup after the first one
+    free. Entries live on flask.g so they never outlive the request, and
+    outside of a request the wrapped functions run as usual.
+    '''
+
+    @staticmethod
+    def memoize(func: Callable) -> Callable:
+        '''
+        Decorator for a lookup returning a model object (or None). Calls
+        with the same arguments run the query at most once per request.
+        Misses (None) are not remembered, and neither are objects deleted
+        or detached from the session since they were found.\n
+        '''
+        sig = signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not has_request_context():
+                return func(*args, **kwargs)
+
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (func.__qualname__,) + tuple(bound.arguments.values())
+            cache = g.setdefault(_CACHE, {})
+            stats = g.setdefault(_STATS, [0, 0])
+
+            obj = cache.get(key)
+            if obj is not None and RequestCache._usable(obj):
+                stats[0] += 1
+                return obj
+
+            stats[1] += 1
+            obj = func(*args, **kwargs)
+            if obj is not None:
+                cache[key] = obj
+            return obj
+
+        return wrapper
+
+    @staticmethod
+    def clear() -> None:
+        '''
+        Forget everything cached for the current request.\n
+        '''
+        if has_request_context():
+            g.pop(_CACHE, None)
+
+    @staticmethod
+    def stats() -> Tuple[int, int]:
+        '''
+        Get the number of hits and misses of the current request.\n
+        '''
+        if not has_request_context():
+            return 0, 0
+        hits, misses = g.get(_STATS, (0, 0))
+        return hits, misses
+
+    @staticmethod
+    def init_app(app: Flask) -> None:
+        '''
+        Register the hooks clearing the cache at the end of every request,
+        and reporting the hit and miss counts when the app is in debug mode.
+        '''
+        app.after_request(RequestCache._report)
+        app.teardown_request(RequestCache._teardown)
+
+    @staticmethod
+    def _usable(obj) -> bool:
+        state = inspect(obj)
+        return not (state.detached or state.deleted or state.was_deleted)
+
+    @staticmethod
+    def _report(response: Response) -> Response:
+        if current_app.debug and _STATS in g:
+            hits, misses = g.get(_STATS)
+            response.headers['X-Request-Cache'] = \
+                'hits={}; misses={}'.format(hits, misses)
+            current_app.logger.debug('request cache: %d hits, %d misses',
+                                     hits, misses)
+        return response
+
+    @staticmethod
+    def _teardown(exc) -> None:
+        g.pop(_CACHE, None)
+        g.pop(_STATS, None)
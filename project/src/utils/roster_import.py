@@ -0,0 +1,258 @@
+import csv
+import io
+import json
+from collections import defaultdict
+from itertools import count
+from typing import Dict, IO, Iterable, Iterator, List, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from ...setup import db
+from ..models.user import User
+from ..models.course import Course
+from ..models.section import Section
+from ..models.enrolled_course import EnrolledCourse, Role, Status
+from ..security.password import hash_passwords
+from ..security.roles import URole
+from .pass_gen import gen_password
+from .logger import Logger
+from .mailer import MailUtil
+from .unit_of_work import UnitOfWork
+
+# Number of rows written in one transaction.
+IMPORT_BATCH_SIZE = 500
+
+# Formats read_roster understands.
+ROSTER_FORMATS = ('csv', 'ndjson', 'json')
+
+# Columns of a roster, only email and section are required.
+ROSTER_FIELDS = ('email', 'pid', 'fname', 'lname', 'section', 'role')
+
+
+def read_roster(stream: IO[bytes], fmt: str) -> Iterator[Dict]:
+    '''
+    Read the rows of a roster without loading it whole.\n
+    Inputs:\n
+    stream --> The uploaded file.\n
+    fmt --> 'csv' (with a header row), 'ndjson' (one object per line) or
+    'json' (a list of objects, which is read whole).\n
+    Return:\n
+    The rows, as dictionaries.\n
+    '''
+    if fmt == 'json':
+        rows = json.load(stream)
+        if not isinstance(rows, list):
+            raise ValueError('expected a list of students')
+        yield from rows
+        return
+
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        for row in csv.DictReader(text):
+            yield {key.strip().lower(): (value or '').strip()
+                   for key, value in row.items() if key}
+    elif fmt == 'ndjson':
+        for line in text:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError(f'unknown format {fmt}')
+
+
+class RosterImport(object):
+    '''
+    Creates the missing users of a roster and enrolls everyone in their
+    section of a course, a batch of rows per transaction: one query finds
+    the users and one their enrollments, the missing ones are bulk inserted,
+    and the random passwords of new users are hashed in parallel.\n
+    Rows which can't be imported are reported with their line number and
+    the reason, the others are imported regardless.\n
+    The import acts for someone with the given role in the course: it only
+    grants roles below that one, and leaves the enrollment of members
+    ranking as high alone.
+    '''
+
+    def __init__(self, course: Course, role: Role,
+                 batch_size: int = IMPORT_BATCH_SIZE):
+        self.course = course
+        self.role = role
+        self.batch_size = batch_size
+        self.sections = {}
+        for section in Section.find_all_in_course(course.id):
+            self.sections[str(section.section_id)] = section
+            self.sections.setdefault(section.section_name, section)
+        self.created = 0
+        self.enrolled = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors: List[Dict] = []
+
+    def run(self, rows: Iterable[Dict]) -> Dict:
+        '''
+        Import every row.\n
+        Inputs:\n
+        rows --> The rows, as read by read_roster.\n
+        Return:\n
+        The counts of created users, new and updated enrollments and the
+        errors of the rows.\n
+        '''
+        batch, rows = [], iter(rows)
+        for number in count(1):
+            try:
+                batch.append((number, next(rows)))
+            except StopIteration:
+                break
+            except (ValueError, csv.Error) as e:
+                # The rest of the file can't be read, keep what was
+                self._error(number, f'unreadable: {e}')
+                break
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = []
+        if batch:
+            self._import_batch(batch)
+        return self.to_json()
+
+    def to_json(self) -> Dict:
+        return {'users_created': self.created, 'enrolled': self.enrolled,
+                'updated': self.updated, 'unchanged': self.unchanged,
+                'errors': self.errors}
+
+    def _import_batch(self, batch: List[Tuple[int, Dict]]) -> None:
+        valid = self._validate(batch)
+        if not valid:
+            return
+        try:
+            users, passwords = self._upsert_users(valid)
+            self._upsert_enrollments(valid, users)
+            # Read the names before the commit expires the users
+            names = self._names_by_section(valid, users)
+            # A transaction per batch, whatever the request does
+            UnitOfWork.commit(now=True)
+        except SQLAlchemyError as e:
+            UnitOfWork.rollback()
+            for number, _ in valid:
+                self._error(number, f'not saved: {e.__class__.__name__}')
+            return
+
+        self.created += len(passwords)
+        for section, students in names.items():
+            Logger.get_instance().add_students_section(
+                students, section, self.course.short_name)
+        for email, password in passwords.items():
+            MailUtil.get_instance().send_async(
+                email, 'Created Autograder Account', _welcome(password))
+
+    def _validate(self, batch: List[Tuple[int, Dict]]
+                  ) -> List[Tuple[int, Dict]]:
+        valid, seen = [], set()
+        for number, row in batch:
+            if not isinstance(row, dict):
+                self._error(number, 'not an object')
+                continue
+            row = {key: str(row.get(key) or '').strip()
+                   for key in ROSTER_FIELDS}
+            if not row['email'] or '@' not in row['email']:
+                self._error(number, 'invalid email')
+            elif row['email'] in seen or (row['pid'] and row['pid'] in seen):
+                self._error(number, 'duplicate student')
+            elif row['section'] not in self.sections:
+                self._error(number, f'unknown section {row["section"]}')
+            elif row['role'] and row['role'].upper() not in Role.__members__:
+                self._error(number, f'unknown role {row["role"]}')
+            elif row['role'] and \
+                    Role[row['role'].upper()].value <= self.role.value:
+                self._error(number, f'role {row["role"]} not allowed')
+            elif len(row['pid']) > 10:
+                self._error(number, 'invalid pid')
+            else:
+                seen.update(filter(None, (row['email'], row['pid'])))
+                valid.append((number, row))
+        return valid
+
+    def _upsert_users(self, rows: List[Tuple[int, Dict]]
+                      ) -> Tuple[Dict[str, User], Dict[str, str]]:
+        '''
+        Map the email of every row to its user, inserting the missing ones.
+        Returns that map and the random passwords of the new users.
+        '''
+        found = User.find_all_by_pid_email([r['pid'] for _, r in rows],
+                                           [r['email'] for _, r in rows])
+        by_pid = {user.pid: user for user in found if user.pid}
+        by_email = {user.email: user for user in found}
+
+        users, missing = {}, []
+        for _, row in rows:
+            user = by_pid.get(row['pid']) or by_email.get(row['email'])
+            if user:
+                users[row['email']] = user
+            else:
+                missing.append(row)
+        if not missing:
+            return users, {}
+
+        passwords = {row['email']: gen_password() for row in missing}
+        hashes = hash_passwords(list(passwords.values()))
+        db.session.bulk_insert_mappings(User, [
+            {'email': row['email'], 'first_name': row['fname'],
+             'last_name': row['lname'], 'pid': row['pid'] or None,
+             'password': hashed, 'urole': URole.NONE.value,
+             'request': False, 'token': ''}
+            for row, hashed in zip(missing, hashes)])
+        for user in User.find_all_by_pid_email([], list(passwords)):
+            users[user.email] = user
+        return users, passwords
+
+    def _upsert_enrollments(self, rows: List[Tuple[int, Dict]],
+                            users: Dict[str, User]) -> None:
+        user_ids = [user.id for user in users.values()]
+        existing = {ec.user_id: ec for ec in EnrolledCourse.query.filter(
+            EnrolledCourse.course_id == self.course.id,
+            EnrolledCourse.user_id.in_(user_ids))}
+
+        new, pending = [], set()
+        for number, row in rows:
+            user = users[row['email']]
+            if user.id in pending:
+                self._error(number, 'duplicate student')
+                continue
+            pending.add(user.id)
+            section = self.sections[row['section']]
+            role = Role[row['role'].upper() or 'STUDENT'].value
+            ec = existing.get(user.id)
+            if ec is not None and ec.role <= self.role.value:
+                self._error(number, 'already enrolled with a role as high '
+                            'as yours')
+            elif ec is None:
+                new.append({'user_id': user.id, 'role': role,
+                            'section_id': section.id,
+                            'status': Status.ACTIVE.value,
+                            'course_id': self.course.id,
+                            'course_short_name': self.course.short_name})
+            elif ec.section_id != section.id or ec.role != role:
+                ec.section_id = section.id
+                ec.role = role
+                self.updated += 1
+            else:
+                self.unchanged += 1
+        db.session.bulk_insert_mappings(EnrolledCourse, new)
+        self.enrolled += len(new)
+
+    def _names_by_section(self, rows: List[Tuple[int, Dict]],
+                          users: Dict[str, User]) -> Dict[str, List[str]]:
+        by_section = defaultdict(list)
+        for _, row in rows:
+            by_section[self.sections[row['section']].section_name].append(
+                str(users[row['email']]))
+        return by_section
+
+    def _error(self, number: int, reason: str) -> None:
+        self.errors.append({'row': number, 'reason': reason})
+
+
+def _welcome(password: str) -> str:
+    return 'Hi there!\nYou\'re getting this email because an' +\
+        ' Autograder account was created for you.' +\
+        '\nA temporary password was created for you, so go change ' +\
+        f'it! Your temporary password is {password}.' +\
+        '\n\nCheers,\nThe Autograder Team'
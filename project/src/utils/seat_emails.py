@@ -0,0 +1,105 @@
+from collections import Counter
+from json import loads
+from string import Template
+from threading import Thread
+from typing import Dict, List, Optional, Tuple
+
+from ...setup import app
+from ..models.user import User
+from ..models.autograder.assigned_seats import AssignedSeats
+from ..models.autograder.email_job import EmailJob
+from .logger import Logger, LogLevels
+from .mailer import MailDispatcher
+
+SUBJECT = Template('Your seat for the upcoming $assignment')
+
+BODY = Template('Hi there!\n'
+                "For the upcoming $assignment you've been assigned seat "
+                '$seat.\n'
+                'Make sure to get there early so that you can find your '
+                'seat.\n'
+                '\nCheers,\nThe Autograder Team')
+
+
+def start_seat_emails(assignment: AssignedSeats) -> EmailJob:
+    '''
+    Email every student of a seat assignment their seat in the background.\n
+    Inputs:\n
+    assignment --> The seat assignment.\n
+    Return:\n
+    The EmailJob to poll for the progress.\n
+    '''
+    job = EmailJob.create_job(assignment.id)
+    Thread(target=_run, args=(job.id,), daemon=True,
+           name=f'seat-emails-{job.id}').start()
+    return job
+
+
+def resolve_students(seats: Dict[str, Dict]
+                     ) -> List[Tuple[str, Optional[User]]]:
+    '''
+    Find the user of every seat of a seat assignment, by PID or else by
+    email like User.find_by_pid_email_fallback, with a single query.\n
+    Inputs:\n
+    seats --> Maps a seat to the student's {'name', 'pid', 'email'}.\n
+    Return:\n
+    The (seat, user) pairs, user is None for students without an account.\n
+    '''
+    students = [student if isinstance(student, dict) else {}
+                for student in seats.values()]
+    users = User.find_all_by_pid_email([s.get('pid') for s in students],
+                                       [s.get('email') for s in students])
+    by_pid = {user.pid: user for user in users if user.pid}
+    by_email = {user.email: user for user in users}
+    return [(seat, by_pid.get(student.get('pid')) or
+             by_email.get(student.get('email')))
+            for seat, student in zip(seats.keys(), students)]
+
+
+def _run(job_id: int) -> None:
+    with app.app_context():
+        job = EmailJob.find_by_id(job_id)
+        assignment = AssignedSeats.get_assignment_by_id(job.assignment_id)
+        try:
+            seats = loads(assignment.seat_assignments or '{}')
+            students = resolve_students(seats)
+        except (ValueError, AttributeError) as e:
+            Logger.get_instance().custom_msg(
+                f'Could not email {assignment.assignment_name}: {e}',
+                LogLevels.ERR)
+            job.fail()
+            return
+
+        found = [(seat, user) for seat, user in students if user]
+        job.start(len(students), len(students) - len(found))
+
+        name = assignment.assignment_name
+        subject = SUBJECT.substitute(assignment=name)
+        dispatcher = MailDispatcher.get_instance()
+        for seat, user in found:
+            body = BODY.substitute(assignment=name, seat=seat)
+            # A roster can be bigger than the queue, wait for the workers
+            # to make room instead of dropping the rest.
+            dispatcher.submit(user.email, subject, body, job_id,
+                              timeout=None)
+            Logger.get_instance().seat_assignment_email(
+                f'{user.first_name} {user.last_name}', seat, name,
+                user.email)
+
+
+def _record(results: List[Tuple[Dict, bool]]) -> None:
+    '''
+    Add the emails sent by a mail worker to the counts of their jobs.\n
+    '''
+    sent, failed = Counter(), Counter()
+    for msg, delivered in results:
+        if msg.get('job_id') is not None:
+            (sent if delivered else failed)[msg['job_id']] += 1
+    if not sent and not failed:
+        return
+    with app.app_context():
+        EmailJob.record_results({job_id: (sent[job_id], failed[job_id])
+                                 for job_id in set(sent) | set(failed)})
+
+
+MailDispatcher.get_instance().add_listener(_record)
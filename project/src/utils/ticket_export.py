@@ -0,0 +1,111 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+from sqlalchemy.orm import Query
+
+from ..models.ticket import Ticket
+from ..models.events.ticket_event import TicketEvent
+from ..models.ticket_feedback import TicketFeedback
+
+# Rows fetched from the database cursor at a time.
+EXPORT_BATCH_SIZE = 1000
+
+# Formats export_rows can write, with the content type of the response.
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# What can be exported: the columns of each, in order.
+EXPORT_COLUMNS = {
+    'tickets': (Ticket.id, Ticket.queue_id, Ticket.created_at,
+                Ticket.accepted_at, Ticket.closed_at, Ticket.status,
+                Ticket.ec_student_id, Ticket.ec_grader_id, Ticket.room,
+                Ticket.workstation, Ticket.title, Ticket.description,
+                Ticket.is_private, Ticket.help_type, Ticket.tag_one,
+                Ticket.tag_two, Ticket.tag_three),
+    'events': (TicketEvent.id, TicketEvent.ticket_id, TicketEvent.timestamp,
+               TicketEvent.event_type, TicketEvent.ec_user_id,
+               TicketEvent.message, TicketEvent.is_private),
+    'feedback': (TicketFeedback.id, TicketFeedback.ticket_id,
+                 TicketFeedback.submitted_date, TicketFeedback.rating,
+                 TicketFeedback.ec_grader_id, TicketFeedback.feedback,
+                 TicketFeedback.is_anonymous),
+}
+
+
+def export_query(kind: str, queue_id: int, start: datetime = None,
+                 end: datetime = None, status: List[int] = None) -> Query:
+    '''
+    Build the query of an export: the tickets of a queue matching the
+    filters (see Ticket.build_query), or the events or feedback of those
+    tickets, oldest first. Only the exported columns are selected, and the
+    rows are read from a server side cursor a batch at a time.\n
+    Inputs:\n
+    kind --> 'tickets', 'events' or 'feedback'.\n
+    queue_id --> The queue to export.\n
+    start --> Optional, only tickets created at or after this time.\n
+    end --> Optional, only tickets created at or before this time.\n
+    status --> Optional, a list of ticket status values to accept.\n
+    Return:\n
+    The query.\n
+    '''
+    tickets = Ticket.build_query(queue_id, start=start, end=end,
+                                 status=status).order_by(None)
+    columns = EXPORT_COLUMNS[kind]
+    if kind == 'tickets':
+        query = tickets.with_entities(*columns).order_by(Ticket.id)
+    else:
+        model = columns[0].class_
+        ticket_ids = tickets.with_entities(Ticket.id)
+        query = model.query.with_entities(*columns).\
+            filter(model.ticket_id.in_(ticket_ids.statement)).\
+            order_by(model.id)
+    return query.yield_per(EXPORT_BATCH_SIZE)
+
+
+def export_rows(query: Query, kind: str, fmt: str) -> Iterator[str]:
+    '''
+    Write the rows of an export query as CSV (with a header) or as one
+    JSON object per line, a batch of rows per chunk, so the response can
+    be streamed without holding the export in memory.\n
+    '''
+    names = [column.key for column in EXPORT_COLUMNS[kind]]
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        for chunk in _batches(query):
+            writer.writerows([_value(v) for v in row] for row in chunk)
+            yield _drain(buffer)
+        yield _drain(buffer)
+    else:
+        for chunk in _batches(query):
+            yield ''.join(json.dumps(_record(names, row)) + '\n'
+                          for row in chunk)
+
+
+def _batches(query: Query) -> Iterator[List[Tuple]]:
+    chunk = []
+    for row in query:
+        chunk.append(row)
+        if len(chunk) == EXPORT_BATCH_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _record(names: List[str], row: Tuple) -> Dict:
+    return {name: _value(value) for name, value in zip(names, row)}
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _drain(buffer: io.StringIO) -> str:
+    text = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return text
@@ -1,86 +1,110 @@
-from ..models.ticket import Ticket
-from ..models.queue import Queue
+from datetime import datetime
+from typing import Dict, List, Union
+
+from sqlalchemy import func
+from sqlalchemy.orm import Query
+
+from ...setup import db
+from ..models.ticket import Ticket, Status
 from ..models.user import User
-from ..models.ticket_feedback import TicketFeedback
+from ..models.enrolled_course import EnrolledCourse
+from ..models.queue_rollup import QueueRollup
+from .time import TimeUtil
+
+
+def _in_range(query: Query, queue_id: int,
+              start: Union[datetime, str] = None,
+              end: Union[datetime, str] = None) -> Query:
+    """
+    Restrict a query on tickets to a queue and, optionally, to the tickets
+    created in a range of time.
+    """
+    query = query.filter(Ticket.queue_id == queue_id)
+    if start is not None:
+        if isinstance(start, str):
+            start = TimeUtil.convert_str_to_datetime(start)
+        query = query.filter(Ticket.created_at >= TimeUtil.to_db_time(start))
+    if end is not None:
+        if isinstance(end, str):
+            end = TimeUtil.convert_str_to_datetime(end)
+        query = query.filter(Ticket.created_at < TimeUtil.to_db_time(end))
+    return query
 
 
-def get_total_rating(queue: Queue):
+def _counts_by_user(ec_column, queue_id: int, start, end,
+                    status: List[int] = None) -> List[Dict]:
+    """
+    Count the tickets of a queue per user, joining the enrollment in the
+    given ticket column to the user so that names come with the counts.
+    """
+    name = User.first_name + ' ' + User.last_name
+    count = func.count(Ticket.id)
+    query = db.session.query(User.id, name, count).\
+        select_from(Ticket).\
+        join(EnrolledCourse, EnrolledCourse.id == ec_column).\
+        join(User, User.id == EnrolledCourse.user_id)
+    if status:
+        query = query.filter(Ticket.status.in_(status))
+    query = _in_range(query, queue_id, start, end).\
+        group_by(User.id, User.first_name, User.last_name).\
+        order_by(count.desc(), User.id)
+    return [{'user_id': user_id, 'name': full_name, 'count': total}
+            for user_id, full_name, total in query.all()]
+
+
+def get_total_rating(queue_id: int, start: Union[datetime, str] = None,
+                     end: Union[datetime, str] = None):
 
     """
-    Gets the total ratings submitted by students for a given queue.
+    Gets the total ratings submitted by students for a given queue. Read from
+    the rollups, so the range is on the time the feedback was submitted.
     Inputs:
-    queue --> queue on which the instructor is accessing the stats
+    queue_id --> queue on which the instructor is accessing the stats
+    start --> (optional) only count feedback submitted from then on
+    end --> (optional) only count feedback submitted before then
     Return:
     dictionary of counts for good, neutral, and bad ratings
     """
-    tickets = Ticket.find_all_tickets(queue, [2])
-    stats = {0: 0, 1: 0, 2: 0}
-    for ticket in tickets:
-        feedback = TicketFeedback.get_ticket_feedback(ticket.id)
-        if feedback is not None:
-            rating = feedback[0].rating
-            if rating is not None:
-                stats[rating] = stats[rating] + 1
+    stats = QueueRollup.summary(queue_id, start, end)
 
     normailzed_stats = {}
-    normailzed_stats['good'] = stats[2]
-    normailzed_stats['neutral'] = stats[1]
-    normailzed_stats['bad'] = stats[0]
+    normailzed_stats['good'] = int(stats['rating_good'])
+    normailzed_stats['neutral'] = int(stats['rating_neutral'])
+    normailzed_stats['bad'] = int(stats['rating_bad'])
 
     return normailzed_stats
 
 
-def get_ticket_counts_by_grader(queue: Queue):
+def get_ticket_counts_by_grader(queue_id: int,
+                                start: Union[datetime, str] = None,
+                                end: Union[datetime, str] = None):
 
     """
     Gets the count of tickets taken by each tutor for a given queue.
     Inputs:
-    queue --> queue on which the instructor is accessing the stats
+    queue_id --> queue on which the instructor is accessing the stats
+    start --> (optional) only count tickets created from then on
+    end --> (optional) only count tickets created before then
     Return:
-    dictionary of counts of tickets resolved by each tutor for thes given queue
+    list of the user id, name and count of tickets resolved of each tutor,
+    most tickets first
     """
-    tickets = Ticket.find_all_tickets(queue, [2])
-    stats = {}
-
-    for ticket in tickets:
-        grader_id = ticket.grader_id
-        if grader_id is not None:
-            grader = User.get_user_by_id(int(grader_id))
-            if grader is not None:
-                fname = grader.first_name
-                lname = grader.last_name
-                name = fname + ' ' + lname
-                if name in stats:
-                    stats[name] = stats[name] + 1
-                else:
-                    stats[name] = 1
-
-    return stats
+    return _counts_by_user(Ticket.ec_grader_id, queue_id, start, end,
+                           [Status.RESOLVED.value])
 
 
-def get_ticket_counts_by_student(queue: Queue):
+def get_ticket_counts_by_student(queue_id: int,
+                                 start: Union[datetime, str] = None,
+                                 end: Union[datetime, str] = None):
 
     """
     Gets the count of tickets created by each student for a given queue.
     Inputs:
-    queue --> queue on which the instructor is accessing the stats
+    queue_id --> queue on which the instructor is accessing the stats
+    start --> (optional) only count tickets created from then on
+    end --> (optional) only count tickets created before then
     Return:
-    dictionary of counts of tickets created by each student for the given queue
+    list of the user id, name and count of tickets created of each student,
+    most tickets first
     """
-    tickets = Ticket.find_all_tickets(queue)
-    stats = {}
-
-    for ticket in tickets:
-        student_id = ticket.student_id
-        if student_id is not None:
-            student = User.get_user_by_id(int(student_id))
-            if student is not None:
-                fname = student.first_name
-                lname = student.last_name
-                name = fname + ' ' + lname
-                if name in stats:
-                    stats[name] = stats[name] + 1
-                else:
-                    stats[name] = 1
-
-    return stats
+    return _counts_by_user(Ticket.ec_student_id, queue_id, start, end)
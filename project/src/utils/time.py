@@ -55,6 +55,30 @@ class TimeUtil(object):
         '''
         return utc.localize(time).astimezone(TimeUtil.PST)
 
+    @staticmethod
+    def get_current_db_time() -> datetime:
+        '''
+        Util method to get the current time in the form it is stored in the
+        database (see to_db_time).\n
+        '''
+        return TimeUtil.to_db_time(datetime.now(timezone.utc))
+
+    @staticmethod
+    def to_db_time(time: datetime) -> datetime:
+        '''
+        Util method to convert a datetime into the form the timestamps are
+        stored in. Timestamps are written as PST isoformat strings into
+        columns without a timezone, so the database keeps the PST wall time
+        and drops the offset.\n
+        Inputs:\n
+        time --> aware or naive datetime, naive ones are taken as PST.\n
+        Returns:\n
+        naive datetime of the PST wall time, usable in SQL comparisons.\n
+        '''
+        if time.tzinfo is None:
+            return time
+        return time.astimezone(TimeUtil.PST).replace(tzinfo=None)
+
     @staticmethod
     def get_time_diff(time_a: str, time_b: str) -> str:
         '''
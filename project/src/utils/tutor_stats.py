@@ -1,12 +1,27 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
+import numpy as np
+
+from ...setup import db
 from ..models.ticket import Ticket
 from ..models.queue import Queue
 from ..models.user import User
-from ..models.events.queue_login_event import QueueLoginEvent
-from ..models.events.ticket_event import TicketEvent
+from ..models.course import Course
+from ..models.enrolled_course import EnrolledCourse
+from ..models.events.queue_login_event import QueueLoginEvent, EType
+from ..models.events.ticket_event import TicketEvent, EventType
 from .time import TimeUtil
 
+# Ticket events which end the time a grader spends on an accepted ticket.
+CLOSING_EVENTS = (EventType.RESOLVED.value, EventType.DEFERRED.value,
+                  EventType.CANCELED.value)
+
+# (id, grader ec id, event type, timestamp) of a QueueLoginEvent
+LoginRow = Tuple[int, int, int, datetime]
+# (id, grader ec id, ticket id, event type, timestamp) of a TicketEvent
+TicketEventRow = Tuple[int, int, int, int, datetime]
+
 
 class TutoringSession:
     """
@@ -19,9 +34,10 @@ class TutoringSession:
     utlization --> time_helping / duration
     accepted --> number of tickets accepted during session
     resolved --> number of tickets resolved during session
+    grader_id --> the enrolled course id of the grader
     """
     def __init__(self, start, end, duration, time_helping, utilization,
-                 accepted, resolved):
+                 accepted, resolved, grader_id=None):
         self.start = start
         self.end = end
         self.duration = duration
@@ -29,6 +45,295 @@ class TutoringSession:
         self.utilization = utilization
         self.accepted = accepted
         self.resolved = resolved
+        self.grader_id = grader_id
+
+    def to_json(self) -> Dict:
+        return {'grader_id': self.grader_id,
+                'start': self.start.isoformat(),
+                'end': self.end.isoformat(),
+                'duration': int(self.duration.total_seconds()),
+                'time_helping': self.time_helping,
+                'utilization': self.utilization,
+                'accepted': self.accepted,
+                'resolved': self.resolved}
+
+
+class TutorStats(object):
+    """
+    Tutoring statistics of every grader of a queue over a range of time.\n
+    The login events and the ticket events of the range are loaded once
+    into NumPy arrays (timestamps as seconds since the start of the range,
+    graders as dense indices), then sessions, helping intervals and counts
+    are all computed with sorting, searchsorted and bincount instead of
+    looping over the events of every session.\n
+    A session runs from a LOGIN to the next LOGOUT of the grader (or the end
+    of the range if there is none). A helping interval runs from an ACCEPTED
+    event to the RESOLVED, DEFERRED or CANCELED event following it on the
+    same ticket. Events and intervals count towards the session they start
+    in; those outside of any session only count in summary.
+    """
+
+    def __init__(self, logins: Iterable[LoginRow],
+                 events: Iterable[TicketEventRow],
+                 start: Optional[datetime] = None,
+                 end: Optional[datetime] = None):
+        """
+        Build the statistics from raw rows, see load to get them from the
+        database.\n
+        Inputs:\n
+        logins --> (id, grader_id, event_type, timestamp) login events.\n
+        events --> (id, ec_user_id, ticket_id, event_type, timestamp) ticket
+                   events.\n
+        start --> The start of the range, the first event by default.\n
+        end --> The end of the range, sessions and tickets still open are
+                cut there. Now by default.\n
+        """
+        logins = list(logins)
+        events = list(events)
+        end = TimeUtil.to_db_time(end) if end is not None \
+            else TimeUtil.get_current_db_time()
+        if start is None:
+            stamps = [row[-1] for row in logins] + \
+                [row[-1] for row in events]
+            start = min(stamps) if stamps else end
+        self.start = TimeUtil.to_db_time(start)
+        self.end = max(end, self.start)
+        self._origin = np.datetime64(self.start, 's')
+        horizon = self._seconds([self.end])[0]
+
+        l_id, l_grader, l_type, l_time = self._columns(logins, 4)
+        e_id, e_grader, e_ticket, e_type, e_time = self._columns(events, 5)
+        # Dense grader indices shared by both kinds of events
+        self.grader_ids, graders = np.unique(
+            np.concatenate([l_grader, e_grader]), return_inverse=True)
+        l_grader, e_grader = graders[:len(l_grader)], graders[len(l_grader):]
+
+        l_time, e_time = self._seconds(l_time), self._seconds(e_time)
+        order = np.lexsort((l_id, l_time, l_grader))
+        self._build_sessions(l_grader[order], l_type[order], l_time[order],
+                             horizon)
+        order = np.lexsort((e_id, e_time, e_ticket))
+        self._build_tickets(e_grader[order], e_ticket[order], e_type[order],
+                            e_time[order], horizon)
+
+    @staticmethod
+    def load(queue_id: int, start: Union[datetime, str] = None,
+             end: Union[datetime, str] = None) -> 'TutorStats':
+        """
+        Load the statistics of a queue, with one query for the login events
+        and one for the ticket events.\n
+        Inputs:\n
+        queue_id --> The id of the queue.\n
+        start --> The start of the range (str or datetime, optional).\n
+        end --> The end of the range (str or datetime, default now).\n
+        Return:\n
+        The TutorStats of the queue.\n
+        """
+        if isinstance(start, str):
+            start = TimeUtil.convert_str_to_datetime(start)
+        if isinstance(end, str):
+            end = TimeUtil.convert_str_to_datetime(end)
+        start = TimeUtil.to_db_time(start) if start is not None else None
+        end = TimeUtil.to_db_time(end) if end is not None \
+            else TimeUtil.get_current_db_time()
+
+        logins = db.session.query(QueueLoginEvent.id,
+                                  QueueLoginEvent.grader_id,
+                                  QueueLoginEvent.event_type,
+                                  QueueLoginEvent.timestamp).\
+            filter(QueueLoginEvent.queue_id == queue_id,
+                   QueueLoginEvent.timestamp <= end)
+        events = db.session.query(TicketEvent.id, TicketEvent.ec_user_id,
+                                  TicketEvent.ticket_id,
+                                  TicketEvent.event_type,
+                                  TicketEvent.timestamp).\
+            join(Ticket, Ticket.id == TicketEvent.ticket_id).\
+            filter(Ticket.queue_id == queue_id,
+                   TicketEvent.event_type.in_(
+                       (EventType.ACCEPTED.value,) + CLOSING_EVENTS),
+                   TicketEvent.timestamp <= end)
+        if start is not None:
+            logins = logins.filter(QueueLoginEvent.timestamp >= start)
+            events = events.filter(TicketEvent.timestamp >= start)
+        return TutorStats(logins.all(), events.all(), start, end)
+
+    def sessions(self, grader_id: int = None) -> List[TutoringSession]:
+        """
+        Get the tutoring sessions, ordered by grader then start time.\n
+        Inputs:\n
+        grader_id --> Only get the sessions of this grader (ec id).\n
+        Return:\n
+        A list of TutoringSession.\n
+        """
+        count = len(self._s_grader)
+        if not count:
+            # Ticket events without anyone logged in
+            return []
+        index = self._s_index(self._e_grader, self._e_time)
+        accepted = self._count(index, self._e_type == EventType.ACCEPTED.value,
+                               count)
+        resolved = self._count(index, self._e_type == EventType.RESOLVED.value,
+                               count)
+        i_session, i_ok = self._s_index(self._i_grader, self._i_start)
+        helping = np.bincount(
+            i_session[i_ok],
+            weights=np.minimum(self._i_end, self._s_end[i_session])[i_ok] -
+            self._i_start[i_ok], minlength=count)
+        duration = self._s_end - self._s_start
+
+        selected = np.arange(count)
+        if grader_id is not None:
+            match = np.flatnonzero(self.grader_ids == grader_id)
+            if not len(match):
+                return []
+            selected = np.flatnonzero(self._s_grader == match[0])
+
+        return [TutoringSession(self._datetime(self._s_start[i]),
+                                self._datetime(self._s_end[i]),
+                                timedelta(seconds=int(duration[i])),
+                                int(helping[i]),
+                                float(helping[i] / duration[i])
+                                if duration[i] else 0.0,
+                                int(accepted[i]), int(resolved[i]),
+                                int(self.grader_ids[self._s_grader[i]]))
+                for i in selected]
+
+    def summary(self) -> Dict[int, Dict[str, float]]:
+        """
+        Get the totals of every grader over the whole range.\n
+        Return:\n
+        A dict from grader id (ec id) to its time_on_duty and time_helping
+        (in seconds), utilization, accepted and resolved counts.\n
+        """
+        count = len(self.grader_ids)
+        on_duty = np.bincount(self._s_grader,
+                              weights=self._s_end - self._s_start,
+                              minlength=count)
+        helping = np.bincount(self._i_grader,
+                              weights=self._i_end - self._i_start,
+                              minlength=count)
+        accepted = np.bincount(
+            self._e_grader[self._e_type == EventType.ACCEPTED.value],
+            minlength=count)
+        resolved = np.bincount(
+            self._e_grader[self._e_type == EventType.RESOLVED.value],
+            minlength=count)
+        return {int(self.grader_ids[g]): {
+                    'time_on_duty': int(on_duty[g]),
+                    'time_helping': int(helping[g]),
+                    'utilization': float(helping[g] / on_duty[g])
+                    if on_duty[g] else 0.0,
+                    'accepted': int(accepted[g]),
+                    'resolved': int(resolved[g])}
+                for g in range(count)}
+
+    def _build_sessions(self, grader: np.ndarray, e_type: np.ndarray,
+                        time: np.ndarray, horizon: int) -> None:
+        # Repeated logins (or logouts) are collapsed: a session starts at a
+        # login which doesn't follow a login, and ends at a logout which
+        # follows one, so starts and ends alternate for every grader.
+        count = len(grader)
+        first = np.ones(count, dtype=bool)
+        first[1:] = grader[1:] != grader[:-1]
+        login = e_type == EType.LOGIN.value
+        after_login = np.zeros(count, dtype=bool)
+        after_login[1:] = login[:-1]
+        after_login &= ~first
+
+        starts = np.flatnonzero(login & ~after_login)
+        ends = np.append(np.flatnonzero(~login & after_login), count)
+        grader_pad = np.append(grader, -1)
+        time_pad = np.append(time, horizon)
+        pair = ends[np.searchsorted(ends, starts)]
+        closed = grader_pad[pair] == grader[starts]
+
+        # A logout first means the grader logged in before the range.
+        early = np.flatnonzero(~login & first)
+        s_grader = np.concatenate([grader[starts], grader[early]])
+        s_start = np.concatenate([time[starts], np.zeros(len(early), int)])
+        s_end = np.concatenate([np.where(closed, time_pad[pair], horizon),
+                                time[early]])
+
+        order = np.lexsort((s_start, s_grader))
+        self._s_grader = s_grader[order]
+        self._s_start = s_start[order]
+        self._s_end = s_end[order]
+        self._span = horizon + 1
+        self._s_key = self._s_grader * self._span + self._s_start
+
+    def _build_tickets(self, grader: np.ndarray, ticket: np.ndarray,
+                       e_type: np.ndarray, time: np.ndarray,
+                       horizon: int) -> None:
+        count = len(ticket)
+        self._e_grader = grader
+        self._e_type = e_type
+        self._e_time = time
+
+        accepts = np.flatnonzero(e_type == EventType.ACCEPTED.value)
+        following = np.minimum(accepts + 1, max(count - 1, 0))
+        closed = (accepts + 1 < count) & \
+            (ticket[following] == ticket[accepts]) & \
+            np.isin(e_type[following], CLOSING_EVENTS)
+        self._i_grader = grader[accepts]
+        self._i_start = time[accepts]
+        self._i_end = np.where(closed, time[following], horizon)
+
+    def _s_index(self, grader: np.ndarray,
+                 time: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # The session each (grader, time) falls in, and whether there is one
+        index = np.searchsorted(self._s_key, grader * self._span + time,
+                                side='right') - 1
+        found = index >= 0
+        index = np.maximum(index, 0)
+        if len(self._s_key):
+            found &= (self._s_grader[index] == grader) & \
+                (time <= self._s_end[index])
+        else:
+            found[:] = False
+        return index, found
+
+    @staticmethod
+    def _count(index: Tuple[np.ndarray, np.ndarray], mask: np.ndarray,
+               count: int) -> np.ndarray:
+        session, found = index
+        return np.bincount(session[found & mask], minlength=count)
+
+    @staticmethod
+    def _columns(rows: List[Tuple], width: int) -> List[np.ndarray]:
+        if not rows:
+            return [np.zeros(0, dtype=int) for _ in range(width - 1)] + \
+                [np.zeros(0, dtype='datetime64[s]')]
+        columns = list(zip(*rows))
+        return [np.array(col, dtype=int) for col in columns[:-1]] + \
+            [np.array(columns[-1], dtype='datetime64[s]')]
+
+    def _seconds(self, times) -> np.ndarray:
+        times = np.asarray(times, dtype='datetime64[s]')
+        return np.maximum((times - self._origin).astype(int), 0)
+
+    def _datetime(self, seconds: int) -> datetime:
+        return self.start + timedelta(seconds=int(seconds))
+
+
+def _grader_stats(queue: Queue, grader: User,
+                  start_date: Union[datetime, str] = None) \
+        -> Tuple[TutorStats, Optional[int]]:
+    """
+    Load the stats of the week starting at start_date (or of the whole
+    quarter), with the ec id of the grader in the course of the queue.\n
+    """
+    end_date = None
+    if start_date is not None:
+        if isinstance(start_date, str):
+            start_date = TimeUtil.convert_str_to_datetime(start_date)
+        end_date = start_date + timedelta(days=7)
+    queue_id = getattr(queue, 'id', queue)
+    course = Course.get_course_by_queue_id(queue_id)
+    ec = EnrolledCourse.find_user_in_course(user_id=grader.id,
+                                            course_id=course.id) \
+        if course else None
+    return TutorStats.load(queue_id, start_date, end_date), \
+        ec.id if ec else None
 
 
 def get_total_time_on_duty(qle: QueueLoginEvent, queue: Queue, grader: User,
@@ -36,7 +341,7 @@ def get_total_time_on_duty(qle: QueueLoginEvent, queue: Queue, grader: User,
     """
     Gets the total time spent on duty for a grader within a given time frame.
     Inputs:
-    qle --> QueueLoginEvent object used to access the database
+    qle --> Not used, kept for compatibility
     queue --> queue on which the grader worked
     grader --> grader bing queried
     start_date --> (optional) start time of week being queried
@@ -45,25 +350,8 @@ def get_total_time_on_duty(qle: QueueLoginEvent, queue: Queue, grader: User,
     at start_date (if it was passed in) or during the whole quarter (if it was
     not).
     """
-    if start_date is None:
-        events = qle.find_event_in_range(queue, TimeUtil.min_time(),
-                                         TimeUtil.get_current_time(), grader)
-    else:
-        end_date = (start_date.convert_str_to_datetime()
-                    + datetime.timedelta(days=7)).isoformat()
-        events = qle.find_event_in_range(queue, start_date, end_date, grader)
-
-    total_time_on_duty = 0
-
-    for i in range(0, len(events), 2):
-        start = events[i].timestamp
-        end = (TimeUtil.get_current_time.now() if i == len(events) - 1
-               else events[i + 1].timestamp)
-
-        time_on_duty = end - start
-        total_time_on_duty += time_on_duty.seconds
-
-    return total_time_on_duty
+    stats, ec_id = _grader_stats(queue, grader, start_date)
+    return stats.summary().get(ec_id, {}).get('time_on_duty', 0)
 
 
 def get_num_tickets_handled(queue: Queue, grader: User,
@@ -79,15 +367,8 @@ def get_num_tickets_handled(queue: Queue, grader: User,
     start_date (if it was passed in) or during the whole quarter (if it was
     not).
     """
-    if start_date is None:
-        tickets = Ticket.find_all_tickets_in_range(queue, grader)
-    else:
-        end_date = (start_date.convert_str_to_datetime()
-                    + datetime.timedelta(days=7)).isoformat()
-        tickets = Ticket.find_tickets_in_range(queue, start_date, end_date,
-                                               grader)
-
-    return len(tickets)
+    stats, ec_id = _grader_stats(queue, grader, start_date)
+    return stats.summary().get(ec_id, {}).get('accepted', 0)
 
 
 def get_total_time_spent_resolving_tickets(queue: Queue, grader: User,
@@ -104,32 +385,8 @@ def get_total_time_spent_resolving_tickets(queue: Queue, grader: User,
     week that starts at start_date (if it was passed in) or during the whole
     quarter (if it was not).
     """
-    if start_date is None:
-        tickets = Ticket.find_all_tickets_in_range(queue, grader)
-    else:
-        end_date = (start_date.convert_str_to_datetime()
-                    + datetime.timedelta(days=7)).isoformat()
-        tickets = Ticket.find_tickets_in_range(queue, start_date, end_date,
-                                               grader)
-
-    for ticket in tickets:
-        events = TicketEvent.find_all_events_for_ticket(ticket)
-        events = [event for event in events if event.user_id == grader.id]
-
-        total_time = 0
-        time_accepted = datetime.min()
-
-        for e in events:
-            if e.is_accepted():
-                time_accepted = e.timestamp
-
-            if (time_accepted != datetime.min and
-               (e.is_resolved() or e.is_deferred() or e.is_canceled)):
-                time_helping = e.timestamp - time_accepted
-                total_time += time_helping.seconds
-                time_accepted = datetime.min()
-
-    return total_time
+    stats, ec_id = _grader_stats(queue, grader, start_date)
+    return stats.summary().get(ec_id, {}).get('time_helping', 0)
 
 
 def get_average_time_spent_resolving_ticket(queue: Queue, grader: User,
@@ -146,8 +403,11 @@ def get_average_time_spent_resolving_ticket(queue: Queue, grader: User,
     starts at start_date (if it was passed in) or during the whole quarter (if
     it was not).
     """
-    return (get_total_time_spent_resolving_tickets(queue, grader, start_date) /
-            get_num_tickets_handled(queue, grader, start_date))
+    stats, ec_id = _grader_stats(queue, grader, start_date)
+    summary = stats.summary().get(ec_id)
+    if not summary or not summary['accepted']:
+        return 0
+    return summary['time_helping'] / summary['accepted']
 
 
 def get_tutoring_sessions(qle: QueueLoginEvent, queue: Queue, grader: User,
@@ -157,53 +417,14 @@ def get_tutoring_sessions(qle: QueueLoginEvent, queue: Queue, grader: User,
     Sessions include info about start/end time, duration, time helping,
     utilization rate, and number of tickets accepted/resolved.
     Inputs:
-    qle --> QueueLoginEvent object used to access the database
+    qle --> Not used, kept for compatibility
     queue --> queue on which the grader worked
     grader --> grader bing queried
     start_date --> (optional) start time of week being queried
     Return:
     List of sessions
     """
-    if start_date is None:
-        events = qle.find_event_in_range(queue, datetime.min, datetime.now(),
-                                         grader)
-    else:
-        end_date = (start_date.convert_str_to_datetime()
-                    + datetime.timedelta(days=7)).isoformat()
-        events = qle.find_event_in_range(queue, start_date, end_date, grader)
-
-    sessions = []
-    for i in range(0, len(events), 2):
-        start = events[i].timestamp
-        end = (datetime.now() if i == len(events) - 1
-               else events[i + 1].timestamp)
-        duration = end - start
-
-        tickets = Ticket.find_tickets_in_range(queue, start, end, grader)
-
-        time_accepted = datetime.min()
-        total_time_helping = 0
-        accepted = 0
-        resolved = 0
-
-        for ticket in tickets:
-            for e in events:
-                if e.is_accepted():
-                    accepted += 1
-                    time_accepted = e.timestamp
-
-                if e.is_resolved():
-                    resolved += 1
-
-                if (time_accepted != datetime.min and
-                   (e.is_resolved() or e.is_deferred() or e.is_canceled)):
-                    time_helping = e.timestamp - time_accepted
-                    total_time_helping += time_helping.seconds
-                    time_accepted = datetime.min()
-
-        utilization = time_helping / duration
-
-    sessions.append(TutoringSession(start, end, duration, total_time_helping,
-                                    utilization, accepted, resolved))
-
-    return sessions
+    stats, ec_id = _grader_stats(queue, grader, start_date)
+    if ec_id is None:
+        return []
+    return stats.sessions(ec_id)
@@ -0,0 +1,122 @@
+from typing import Callable
+
+from flask import Flask, Response, current_app, g, has_request_context
+
+# Names of the attributes on flask.g: whether the request has changes to
+# commit, and the functions to run once they are.
+_PENDING = '_unit_of_work_pending'
+_HOOKS = '_unit_of_work_hooks'
+
+
+class UnitOfWork(object):
+    '''
+    Commits the changes made while handling a request once, at its end,
+    instead of once per model method.\n
+    Model methods call UnitOfWork.commit where they used to commit the
+    session. During a request, the changes are only flushed (so ids are
+    set and the following queries see them) and the objects expired as a
+    commit would, then everything is committed in a single transaction
+    after the view returned, or rolled back if it failed (5xx). A request
+    context without a view commits when it is popped. Outside of a request
+    (scripts, background threads), and with now=True, commit commits right
+    away.\n
+    Whatever must only happen once the changes are visible to the other
+    workers (waking up streams, updating the in-memory indexes, dropping
+    cached rows) goes through on_commit.
+    '''
+
+    _db = None
+
+    @staticmethod
+    def init_app(app: Flask, db) -> None:
+        '''
+        Register the hooks committing the changes of every request.
+        '''
+        UnitOfWork._db = db
+        app.extensions['unit_of_work'] = True
+        app.after_request(UnitOfWork._finish)
+        app.teardown_request(UnitOfWork._teardown)
+
+    @staticmethod
+    def commit(now: bool = False) -> None:
+        '''
+        Commit the changes of the session, at the end of the request if
+        there is one.\n
+        Inputs:\n
+        now --> Commit right away (with everything staged so far), for
+        changes another thread or connection has to see before the request
+        ends.\n
+        '''
+        session = UnitOfWork._db.session
+        if now or not UnitOfWork._deferred():
+            session.commit()
+            UnitOfWork._run_hooks()
+            return
+        session.flush()
+        session.expire_all()
+        g.setdefault(_PENDING, True)
+
+    @staticmethod
+    def on_commit(func: Callable, *args) -> None:
+        '''
+        Call func(*args) once the changes staged so far are committed, or
+        right away if there are none.\n
+        '''
+        if UnitOfWork.pending():
+            g.setdefault(_HOOKS, []).append((func, args))
+        else:
+            func(*args)
+
+    @staticmethod
+    def rollback() -> None:
+        '''
+        Roll back every change not committed yet, and forget the functions
+        waiting on them.\n
+        '''
+        UnitOfWork._db.session.rollback()
+        if has_request_context():
+            g.pop(_PENDING, None)
+            g.pop(_HOOKS, None)
+
+    @staticmethod
+    def pending() -> bool:
+        '''
+        Whether the request has changes staged but not committed yet.\n
+        '''
+        return has_request_context() and bool(g.get(_PENDING))
+
+    @staticmethod
+    def _deferred() -> bool:
+        return has_request_context() and \
+            'unit_of_work' in current_app.extensions
+
+    @staticmethod
+    def _run_hooks() -> None:
+        if not has_request_context():
+            return
+        g.pop(_PENDING, None)
+        for func, args in g.pop(_HOOKS, []):
+            func(*args)
+
+    @staticmethod
+    def _finish(response: Response) -> Response:
+        if not g.get(_PENDING):
+            return response
+        if response.status_code >= 500:
+            UnitOfWork.rollback()
+        else:
+            UnitOfWork._db.session.commit()
+            UnitOfWork._run_hooks()
+        return response
+
+    @staticmethod
+    def _teardown(exc) -> None:
+        # Only left pending when after_request didn't run (a request
+        # context without a view, as in scripts and tests) or failed.
+        if not g.get(_PENDING):
+            return
+        if exc is not None:
+            UnitOfWork.rollback()
+        else:
+            UnitOfWork._db.session.commit()
+            UnitOfWork._run_hooks()
@@ -0,0 +1,165 @@
+from datetime import timedelta
+from math import sqrt
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, NamedTuple, Tuple
+
+from .exceptions import SingletonAccessException
+
+# Weight of the newest help time in the moving mean and variance.
+ALPHA = 0.1
+# Help time (in seconds) assumed for a queue without any history yet.
+PRIOR_HELP_TIME = 5 * 60
+# Help times are capped to this many seconds, so that a ticket left accepted
+# for hours does not throw off the estimates of the rest of the day.
+MAX_HELP_TIME = 60 * 60
+# z-score of the confidence interval around an estimate (90%, two sided).
+Z_SCORE = 1.645
+# Number of seconds a queue's statistics are trusted before they are seeded
+# again from the database, so that the gunicorn workers agree with each other.
+RESEED_INTERVAL = 300
+# Number of recent help times a queue is seeded with.
+HISTORY_SIZE = 50
+
+# A loader returns the recent help times (in seconds, oldest first) and the
+# number of tutors on duty for the queue it is called with.
+Loader = Callable[[int], Tuple[Iterable[float], int]]
+
+
+class WaitEstimate(NamedTuple):
+    '''
+    An expected wait time with the bounds of its confidence interval.
+    '''
+    expected: timedelta
+    low: timedelta
+    high: timedelta
+
+
+class _QueueStats(object):
+    '''
+    Exponentially weighted mean and variance of the help time of a queue,
+    with the number of tutors on duty.
+    '''
+
+    def __init__(self, help_times: Iterable[float], tutors: int):
+        self.mean = float(PRIOR_HELP_TIME)
+        self.var = (PRIOR_HELP_TIME / 2.0) ** 2
+        self.tutors = tutors
+        self.seeded_at = monotonic()
+        for seconds in help_times:
+            self.observe(seconds)
+
+    def observe(self, seconds: float) -> None:
+        diff = min(seconds, MAX_HELP_TIME) - self.mean
+        incr = ALPHA * diff
+        self.mean += incr
+        self.var = (1 - ALPHA) * (self.var + diff * incr)
+
+
+class WaitTimeEstimator(object):
+    '''
+    Streaming estimate of the wait times of every queue.\n
+    The help time of every resolved ticket updates an exponentially weighted
+    mean and variance, and logins / logouts update the number of tutors, so
+    estimates are answered in O(1) instead of reloading the tickets and
+    tutors of the queue. With k tutors working through the queue, a ticket
+    at position p is expected to wait p * mean / k, with a variance of
+    p * var / k^2.
+    '''
+
+    __instance = None
+    __instance_lock = Lock()
+
+    @staticmethod
+    def get_instance():
+        if WaitTimeEstimator.__instance is None:
+            with WaitTimeEstimator.__instance_lock:
+                if WaitTimeEstimator.__instance is None:
+                    WaitTimeEstimator()
+        return WaitTimeEstimator.__instance
+
+    def __init__(self):
+        '''
+        Initializes the estimator. Should not be run from outside of this
+        class, as the estimator is a singleton.
+        '''
+        if WaitTimeEstimator.__instance is not None:
+            raise SingletonAccessException("This class is a singleton!")
+
+        self._lock = Lock()
+        self._stats: Dict[int, _QueueStats] = {}
+        WaitTimeEstimator.__instance = self
+
+    def seed(self, queue_id: int, help_times: Iterable[float],
+             tutors: int) -> None:
+        '''
+        Reset the statistics of a queue from its recent history.\n
+        Inputs:\n
+        queue_id --> The queue to seed.\n
+        help_times --> Recent help times in seconds, oldest first.\n
+        tutors --> The number of tutors on duty.\n
+        '''
+        stats = _QueueStats(help_times, tutors)
+        with self._lock:
+            self._stats[queue_id] = stats
+
+    def observe(self, queue_id: int, seconds: float) -> None:
+        '''
+        Record the help time of a ticket that was just resolved. Queues that
+        are not seeded yet are left alone, they will be seeded with it.\n
+        '''
+        if seconds < 0:
+            return
+        with self._lock:
+            stats = self._stats.get(queue_id)
+            if stats is not None:
+                stats.observe(seconds)
+
+    def set_tutors(self, queue_id: int, tutors: int) -> None:
+        '''
+        Record the number of tutors on duty after a login or a logout.\n
+        '''
+        with self._lock:
+            stats = self._stats.get(queue_id)
+            if stats is not None:
+                stats.tutors = tutors
+
+    def help_time(self, queue_id: int,
+                  loader: Loader) -> Tuple[timedelta, timedelta]:
+        '''
+        Get the mean and the standard deviation of the help time.\n
+        '''
+        mean, var, _ = self._snapshot(queue_id, loader)
+        return timedelta(seconds=mean), timedelta(seconds=sqrt(var))
+
+    def estimate(self, queue_id: int, position: int,
+                 loader: Loader) -> WaitEstimate:
+        '''
+        Estimate how long the ticket at a position has left to wait.\n
+        Inputs:\n
+        queue_id --> The queue of the ticket.\n
+        position --> The position of the ticket (start from 1).\n
+        loader --> Used to seed the queue from the database.\n
+        Returns:\n
+        The expected wait with its confidence interval. When nobody is on
+        duty the estimate is made as if one tutor was.\n
+        '''
+        mean, var, tutors = self._snapshot(queue_id, loader)
+        tutors = max(tutors, 1)
+        position = max(position, 0)
+        expected = position * mean / tutors
+        margin = Z_SCORE * sqrt(position * var) / tutors
+        return WaitEstimate(timedelta(seconds=expected),
+                            timedelta(seconds=max(expected - margin, 0)),
+                            timedelta(seconds=expected + margin))
+
+    def _snapshot(self, queue_id: int,
+                  loader: Loader) -> Tuple[float, float, int]:
+        with self._lock:
+            stats = self._stats.get(queue_id)
+        if stats is None or monotonic() - stats.seeded_at > RESEED_INTERVAL:
+            help_times, tutors = loader(queue_id)
+            self.seed(queue_id, help_times, tutors)
+        with self._lock:
+            stats = self._stats[queue_id]
+            return stats.mean, stats.var, stats.tutors
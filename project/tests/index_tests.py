@@ -0,0 +1,92 @@
+import os
+import unittest
+from datetime import datetime
+
+from sqlalchemy import text
+
+# An in-memory database is enough to look at query plans.
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from project.setup import app, db  # noqa: E402
+from project.src.models.ticket import Ticket, Status  # noqa: E402
+from project.src.models.events.ticket_event import TicketEvent  # noqa: E402
+from project.src.models.events.queue_login_event import \
+    QueueLoginEvent  # noqa: E402
+
+
+class TestQueryPlans(unittest.TestCase):
+    '''
+    Make sure the hot queries on tickets and events are answered with the
+    indexes declared on the models instead of a full table scan.
+    '''
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        if db.engine.dialect.name != 'sqlite':
+            self.ctx.pop()
+            self.skipTest('query plans are checked on sqlite only')
+        self.tables = [Ticket.__table__, TicketEvent.__table__,
+                       QueueLoginEvent.__table__]
+        db.metadata.create_all(bind=db.engine, tables=self.tables)
+
+    def tearDown(self):
+        db.session.remove()
+        db.metadata.drop_all(bind=db.engine, tables=self.tables)
+        self.ctx.pop()
+
+    def plan(self, query) -> str:
+        sql = str(query.statement.compile(
+            db.engine, compile_kwargs={'literal_binds': True}))
+        rows = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql))
+        return '\n'.join(row[-1] for row in rows)
+
+    def assertUsesIndex(self, query, index):
+        plan = self.plan(query)
+        self.assertIn(index, plan)
+        # SEARCH is an index lookup, SCAN walks the whole table or index.
+        self.assertNotIn('SCAN', plan)
+
+    def test_pending_tickets_of_queue(self):
+        query = Ticket.build_query(1, status=[Status.PENDING.value])
+        self.assertUsesIndex(query, 'idx_ticket_queue_status_created')
+
+    def test_tickets_of_student(self):
+        query = Ticket.build_query(1, ec_student_id=2,
+                                   status=[Status.PENDING.value,
+                                           Status.ACCEPTED.value])
+        self.assertUsesIndex(query, 'idx_ticket_queue_student_status')
+
+    def test_tickets_of_grader(self):
+        query = Ticket.build_query(1, ec_grader_id=2,
+                                   status=[Status.ACCEPTED.value,
+                                           Status.RESOLVED.value])
+        self.assertUsesIndex(query, 'idx_ticket_queue_grader_status')
+
+    def test_closed_ticket_history(self):
+        cursor = Ticket._encode_cursor(
+            Ticket(id=20, closed_at=datetime(2022, 1, 1, 10)))
+        for query, index in (
+                (Ticket.build_history_query(1, cursor=cursor),
+                 'idx_ticket_queue_closed'),
+                (Ticket.build_history_query(1, cursor=cursor, ec_grader_id=2),
+                 'idx_ticket_queue_grader_closed')):
+            self.assertUsesIndex(query, index)
+            # Pages come straight off the index, without sorting the rows
+            self.assertNotIn('TEMP B-TREE', self.plan(query))
+
+    def test_events_of_tickets(self):
+        query = TicketEvent.query.\
+            filter(TicketEvent.ticket_id.in_([1, 2, 3])).\
+            order_by(TicketEvent.timestamp.desc())
+        self.assertUsesIndex(query, 'idx_ticketevent_ticket_timestamp')
+
+    def test_login_events_of_grader(self):
+        query = QueueLoginEvent.query.filter_by(queue_id=1, grader_id=2).\
+            order_by(QueueLoginEvent.timestamp)
+        self.assertUsesIndex(query,
+                             'idx_queueloginevent_queue_grader_timestamp')
+
+
+if __name__ == '__main__':
+    unittest.main()
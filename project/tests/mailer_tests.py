@@ -1,5 +1,23 @@
+import os
+import shutil
+import socket
+import tempfile
 import unittest
-from src.utils.mailer import mailer
+import json
+
+from flask import Flask
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from project.src.utils import mailer as mailer_module  # noqa: E402
+from project.src.utils.mailer import MailUtil, MailDispatcher  # noqa: E402
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+mailer = MailUtil.get_instance()
 
 
 class TestStringMethods(unittest.TestCase):
@@ -20,5 +38,108 @@ class TestStringMethods(unittest.TestCase):
         mailer.send('aiuwefklnsdc@ucsd.edu', 'hello my darling', msg)
 
 
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Inbox(object):
+    '''
+    aiosmtpd handler which keeps what it receives.
+    '''
+
+    def __init__(self):
+        self.messages = []
+        self.ehlos = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname,
+                          responses):
+        self.ehlos += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+@unittest.skipUnless(Controller, 'aiosmtpd is not installed')
+class TestMailDispatcher(unittest.TestCase):
+    '''
+    Send through a local SMTP server to check batching, the spool and
+    reconnecting.
+    '''
+
+    def setUp(self):
+        self.inbox = Inbox()
+        self.port = free_port()
+        self.server = Controller(self.inbox, hostname='127.0.0.1',
+                                 port=self.port)
+        self.server.start()
+        self.spool = tempfile.mkdtemp()
+        self.backoff = mailer_module.RETRY_BACKOFF
+        mailer_module.RETRY_BACKOFF = 0.01
+
+        self.dispatcher = MailDispatcher.get_instance()
+        self.dispatcher.init_app(self._app(self.port))
+
+    def tearDown(self):
+        self.dispatcher.stop()
+        self.server.stop()
+        mailer_module.RETRY_BACKOFF = self.backoff
+        shutil.rmtree(self.spool)
+
+    def _app(self, port):
+        app = Flask(__name__)
+        app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port,
+                          MAIL_USE_SSL=False, MAIL_USERNAME=None,
+                          MAIL_WORKERS=1, MAIL_SPOOL_DIR=self.spool)
+        return app
+
+    def test_batch_uses_one_connection(self):
+        for i in range(20):
+            self.assertTrue(mailer.send_async(f'student{i}@ucsd.edu',
+                                              'Seat', 'Seat A1'))
+        self.dispatcher.join()
+        self.assertEqual(len(self.inbox.messages), 20)
+        self.assertEqual(self.inbox.ehlos, 1)
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_spool_recovered_on_start(self):
+        # Left behind by a worker which is no longer running
+        left = {'id': 'abc', 'to': 'left@ucsd.edu', 'subject': 'Seat',
+                'body': 'Seat B2'}
+        with open(os.path.join(self.spool, '999999999-abc.json'), 'w') as f:
+            json.dump(left, f)
+
+        # Sent on start, without waiting for a new message
+        self.dispatcher.init_app(self._app(self.port))
+        self.dispatcher.join()
+        sent = [m.rcpt_tos[0] for m in self.inbox.messages]
+        self.assertEqual(sent, ['left@ucsd.edu'])
+
+        mailer.send_async('new@ucsd.edu', 'Seat', 'Seat B3')
+        self.dispatcher.join()
+        sent = sorted(m.rcpt_tos[0] for m in self.inbox.messages)
+        self.assertEqual(sent, ['left@ucsd.edu', 'new@ucsd.edu'])
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_reconnects_after_server_restart(self):
+        mailer.send_async('first@ucsd.edu', 'Seat', 'Seat C1')
+        self.dispatcher.join()
+
+        self.server.stop()
+        self.server = Controller(self.inbox, hostname='127.0.0.1',
+                                 port=self.port)
+        self.server.start()
+
+        mailer.send_async('second@ucsd.edu', 'Seat', 'Seat C2')
+        self.dispatcher.join()
+        sent = [m.rcpt_tos[0] for m in self.inbox.messages]
+        self.assertEqual(sent, ['first@ucsd.edu', 'second@ucsd.edu'])
+        self.assertEqual(self.inbox.ehlos, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,125 @@
+import os
+import unittest
+from datetime import datetime
+
+from flask import Response
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from project.setup import app, db  # noqa: E402
+from project.src.models.course import Course  # noqa: E402
+from project.src.models.enrolled_course import EnrolledCourse, \
+    Role  # noqa: E402
+from project.src.models.ticket import Ticket, Status  # noqa: E402
+from project.src.models.queue import Queue  # noqa: E402
+from project.src.models.events.ticket_event import TicketEvent, \
+    EventType  # noqa: E402
+from project.src.models.queue_rollup import QueueHourlyRollup, \
+    QueueDailyRollup  # noqa: E402
+from project.src.utils.model_cache import ModelCache  # noqa: E402
+
+QUEUE_ID = 1
+
+
+class TestAcceptTicket(unittest.TestCase):
+    '''
+    A pending ticket is accepted by exactly one grader.
+    '''
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        self.tables = [Course.__table__, EnrolledCourse.__table__,
+                       Ticket.__table__, TicketEvent.__table__,
+                       QueueHourlyRollup.__table__,
+                       QueueDailyRollup.__table__]
+        db.metadata.create_all(bind=db.engine, tables=self.tables)
+        ModelCache.get_instance().invalidate()
+
+        course = Course(name='Data Structures', quarter=0, short_name='CSE12',
+                        year=2021, queue_id=QUEUE_ID, instructor_id=1)
+        db.session.add(course)
+        db.session.flush()
+        self.ecs = [EnrolledCourse(user_id=user_id, role=role.value,
+                                   section_id=1, course_id=course.id,
+                                   status=0, course_short_name='CSE12')
+                    for user_id, role in ((1, Role.STUDENT),
+                                          (2, Role.GRADER),
+                                          (3, Role.GRADER))]
+        db.session.add_all(self.ecs)
+        db.session.flush()
+        self.tickets = [Ticket(created_at=datetime(2021, 1, 4, 10, minute),
+                               room='r', workstation='w',
+                               status=Status.PENDING.value, title='t',
+                               description='d', queue_id=QUEUE_ID,
+                               ec_student_id=self.ecs[0].id,
+                               is_private=False, help_type=0, tag_one=0)
+                        for minute in range(2)]
+        db.session.add_all(self.tickets)
+        db.session.commit()
+        self.ec_ids = [ec.id for ec in self.ecs]
+        self.ticket_ids = [ticket.id for ticket in self.tickets]
+
+    def tearDown(self):
+        db.session.remove()
+        db.metadata.drop_all(bind=db.engine, tables=self.tables)
+        ModelCache.get_instance().invalidate()
+        self.ctx.pop()
+
+    def accept_events(self, ticket_id: int) -> int:
+        return TicketEvent.query.filter_by(
+            ticket_id=ticket_id, event_type=EventType.ACCEPTED.value).count()
+
+    def test_second_accept_conflicts(self):
+        ticket_id = self.ticket_ids[0]
+        self.assertEqual(Ticket.accept_ticket(ticket_id, 2),
+                         (True, 'Ticket accepted'))
+        self.assertEqual(Ticket.accept_ticket(ticket_id, 3),
+                         (False, 'Ticket is no longer pending'))
+        self.assertEqual(Ticket.accept_ticket(ticket_id, 2),
+                         (False, 'Ticket is no longer pending'))
+
+        db.session.remove()
+        ticket = Ticket.get_ticket_by_id(ticket_id)
+        self.assertEqual(ticket.status, Status.ACCEPTED.value)
+        self.assertEqual(ticket.ec_grader_id, self.ec_ids[1])
+        self.assertEqual(self.accept_events(ticket_id), 1)
+
+    def test_conflict_keeps_the_request_changes(self):
+        first, second = self.ticket_ids
+        Ticket.accept_ticket(first, 3)
+        with app.test_request_context():
+            self.assertEqual(Ticket.accept_ticket(second, 2)[0], True)
+            self.assertEqual(Ticket.accept_ticket(first, 2),
+                             (False, 'Ticket is no longer pending'))
+            app.process_response(Response(status=409))
+
+        db.session.remove()
+        self.assertEqual(Ticket.get_ticket_by_id(second).ec_grader_id,
+                         self.ec_ids[1])
+        self.assertEqual(self.accept_events(first), 1)
+        self.assertEqual(self.accept_events(second), 1)
+
+    def test_student_cannot_accept(self):
+        ticket_id = self.ticket_ids[0]
+        self.assertEqual(Ticket.accept_ticket(ticket_id, 1),
+                         (False, 'Permission denied'))
+        self.assertEqual(self.accept_events(ticket_id), 0)
+
+    def test_busy_grader_cannot_take_another(self):
+        first, second = self.ticket_ids
+        self.assertEqual(Queue.accept_ticket(QUEUE_ID, first, 2),
+                         (True, 'Ticket accepted'))
+        self.assertEqual(Queue.accept_ticket(QUEUE_ID, second, 2),
+                         (False, 'The user is currently busy'))
+
+        db.session.remove()
+        self.assertEqual(Ticket.get_ticket_by_id(first).status,
+                         Status.ACCEPTED.value)
+        self.assertEqual(Ticket.get_ticket_by_id(second).status,
+                         Status.PENDING.value)
+        self.assertEqual(self.accept_events(second), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from project.src.utils.tutor_stats import TutorStats  # noqa: E402
+from project.src.models.events.queue_login_event import EType  # noqa: E402
+from project.src.models.events.ticket_event import EventType  # noqa: E402
+
+START = datetime(2021, 1, 4, 10)
+
+
+def at(minutes: int) -> datetime:
+    return START + timedelta(minutes=minutes)
+
+
+class TestTutorStats(unittest.TestCase):
+    '''
+    Sessions and totals computed from raw login and ticket events.
+    '''
+
+    def test_session(self):
+        logins = [(1, 7, EType.LOGIN.value, at(0)),
+                  (2, 7, EType.LOGOUT.value, at(60))]
+        events = [(1, 7, 1, EventType.ACCEPTED.value, at(10)),
+                  (2, 7, 1, EventType.RESOLVED.value, at(25))]
+        stats = TutorStats(logins, events, START, at(90))
+
+        sessions = stats.sessions()
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual(sessions[0].duration, timedelta(hours=1))
+        self.assertEqual(sessions[0].time_helping, 15 * 60)
+        self.assertEqual((sessions[0].accepted, sessions[0].resolved),
+                         (1, 1))
+
+    def test_events_without_sessions(self):
+        events = [(1, 7, 1, EventType.ACCEPTED.value, at(10)),
+                  (2, 7, 1, EventType.RESOLVED.value, at(25))]
+        stats = TutorStats([], events, START, at(90))
+
+        self.assertEqual(stats.sessions(), [])
+        self.assertEqual(stats.sessions(grader_id=7), [])
+        summary = stats.summary()[7]
+        self.assertEqual(summary['time_on_duty'], 0)
+        self.assertEqual(summary['time_helping'], 15 * 60)
+        self.assertEqual((summary['accepted'], summary['resolved']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import unittest
+from datetime import datetime
+
+from flask import Response
+from sqlalchemy import event
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from project.setup import app, db  # noqa: E402
+from project.src.models.ticket import Ticket, Status  # noqa: E402
+from project.src.utils.unit_of_work import UnitOfWork  # noqa: E402
+
+
+class TestUnitOfWork(unittest.TestCase):
+    '''
+    The changes made while handling a request are committed once, after
+    the view, and rolled back with the functions waiting on them when it
+    fails.
+    '''
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.metadata.create_all(bind=db.engine, tables=[Ticket.__table__])
+        self.commits = 0
+        event.listen(db.engine, 'commit', self.count_commit)
+
+    def tearDown(self):
+        event.remove(db.engine, 'commit', self.count_commit)
+        db.session.remove()
+        db.metadata.drop_all(bind=db.engine, tables=[Ticket.__table__])
+        self.ctx.pop()
+
+    def count_commit(self, conn):
+        self.commits += 1
+
+    def add_ticket(self, title: str) -> None:
+        db.session.add(Ticket(created_at=datetime(2021, 1, 4, 10), room='r',
+                              workstation='w', status=Status.PENDING.value,
+                              title=title, description='d', queue_id=1,
+                              ec_student_id=1, is_private=False,
+                              help_type=0, tag_one=0))
+        UnitOfWork.commit()
+
+    def titles(self):
+        db.session.remove()
+        return sorted(ticket.title for ticket in Ticket.query.all())
+
+    def handle(self, status: int, *titles: str):
+        '''
+        Stage a ticket per title during a request answered with status,
+        return the on_commit functions that ran.
+        '''
+        called = []
+        with app.test_request_context():
+            for title in titles:
+                self.add_ticket(title)
+                UnitOfWork.on_commit(called.append, title)
+            self.assertEqual(self.commits, 0)
+            self.assertEqual(called, [])
+            app.process_response(Response(status=status))
+        return called
+
+    def test_commit_once_after_request(self):
+        self.assertEqual(self.handle(200, 'a', 'b'), ['a', 'b'])
+        self.assertEqual(self.commits, 1)
+        self.assertEqual(self.titles(), ['a', 'b'])
+
+    def test_client_error_commits(self):
+        self.assertEqual(self.handle(409, 'a'), ['a'])
+        self.assertEqual(self.titles(), ['a'])
+
+    def test_rollback_on_server_error(self):
+        self.assertEqual(self.handle(500, 'a', 'b'), [])
+        self.assertEqual(self.commits, 0)
+        self.assertEqual(self.titles(), [])
+
+    def test_rollback_on_exception(self):
+        called = []
+        with self.assertRaises(RuntimeError):
+            with app.test_request_context():
+                self.add_ticket('a')
+                UnitOfWork.on_commit(called.append, 'a')
+                raise RuntimeError()
+        self.assertEqual(called, [])
+        self.assertEqual(self.titles(), [])
+
+    def test_staged_changes_are_visible(self):
+        with app.test_request_context():
+            self.add_ticket('a')
+            self.assertEqual([t.title for t in Ticket.query.all()], ['a'])
+            app.process_response(Response(status=200))
+
+    def test_commit_now(self):
+        called = []
+        with app.test_request_context():
+            self.add_ticket('a')
+            UnitOfWork.on_commit(called.append, 'a')
+            UnitOfWork.commit(now=True)
+            self.assertEqual(self.commits, 1)
+            self.assertEqual(called, ['a'])
+            app.process_response(Response(status=200))
+        self.assertEqual(self.commits, 1)
+
+    def test_outside_of_request(self):
+        called = []
+        self.add_ticket('a')
+        self.assertEqual(self.commits, 1)
+        UnitOfWork.on_commit(called.append, 'a')
+        self.assertEqual(called, ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()